@@ -1,201 +1,218 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from claude_client import ClaudeClient
-from request_logger import RequestLogger
-from repo_analyzer import RepoAnalyzer
-import os
+from claude_client import close_async_pools
+from api_handlers import request_manager, request_logger, sse_event, INVALID_REQUEST_ID, UNKNOWN_JOB_ID
+from job_queue import get_job_queue
+import api_handlers
+import queue
 import asyncio
-import uuid
+import threading
 
 
 app = Flask(__name__)
 CORS(app)
 
-CLAUDE_LOCATION = os.getenv("CLAUDE_LOCATION", "us-central1")
-CLAUDE_PROJECT_ID = os.getenv("CLAUDE_PROJECT_ID")
 
-claude_client = ClaudeClient(CLAUDE_LOCATION, CLAUDE_PROJECT_ID)
-repo_analyzer = RepoAnalyzer(CLAUDE_LOCATION, CLAUDE_PROJECT_ID)
+def async_route(f):
+    async def run(*args, **kwargs):
+        try:
+            return await f(*args, **kwargs)
+        finally:
+            # The loop ends with the request, so its pooled Claude connections are closed with it
+            await close_async_pools()
 
+    def wrapper(*args, **kwargs):
+        return asyncio.run(run(*args, **kwargs))
 
-# RequestManager to handle repo_analyzer instances per request_id
-class RequestManager:
-    def __init__(self):
-        self.cache = {}
+    wrapper.__name__ = f.__name__
+    return wrapper
 
-    def create_analyzer(self, request_id, task, repo_path):
-        # Instantiate a new RepoAnalyzer and store it
-        analyzer = RepoAnalyzer(CLAUDE_LOCATION, CLAUDE_PROJECT_ID)
-        self.cache[request_id] = {
-            "repo_analyzer": analyzer,
-            "task": task,
-            "repoPath": repo_path,
-        }
-        return analyzer
 
-    def get_analyzer(self, request_id):
-        return self.cache.get(request_id)
+def stream_events(make_events):
+    """
+    Turn an async generator of SSE strings into a streaming Flask response.
 
-    def delete_analyzer(self, request_id):
-        if request_id in self.cache:
-            del self.cache[request_id]
+    The generator runs on its own event loop in a background thread, so it
+    finishes (including usage logging) even if the client disconnects early.
+    """
+    events = queue.Queue()
+    done = object()
 
+    async def pump():
+        try:
+            async for event in make_events():
+                events.put(event)
+        except Exception as e:
+            print(f"Error during streaming: {str(e)}")
+            events.put(sse_event("error", {"error": f"Analyse-Fehler: {str(e)}"}))
+        finally:
+            events.put(done)
+            await close_async_pools()
 
-request_manager = RequestManager()
-request_logger = RequestLogger()
+    threading.Thread(target=lambda: asyncio.run(pump()), daemon=True).start()
 
+    def generate():
+        while (event := events.get()) is not done:
+            yield event
 
-def async_route(f):
-    def wrapper(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def stream_stats(repo_analyzer):
+    stats = repo_analyzer.claude_client.last_stream_stats
+    if not stats:
+        return {}
+    return {
+        "timeToFirstToken": stats.time_to_first_token,
+        "totalSeconds": stats.total_seconds,
+        "cached": stats.cached,
+    }
+
+
+def invalid_body():
+    return jsonify({"error": "Request-Body muss ein JSON-Objekt sein"}), 400
 
-    wrapper.__name__ = f.__name__
-    return wrapper
+
+def unsupported_media_type():
+    return (
+        jsonify({"error": "Unsupported Media Type. Expected 'application/json'."}),
+        415,
+    )
 
 
 @app.route("/api/analyze", methods=["POST"])
 @async_route
 async def analyze_repository():
     if request.content_type != "application/json":
-        return (
-            jsonify({"error": "Unsupported Media Type. Expected 'application/json'."}),
-            415,
-        )
-
-    try:
-        data = request.get_json()
-        task = data.get("task")
-        repo_path = data.get("repoPath")
-        confirm = data.get("confirm", False)
-
-        request_logger.log_request(
-            request_type="analyze",
-            content=data,
-        )
-
-        if not task or not repo_path:
-            return jsonify({"error": "Task und Repository-Pfad sind erforderlich"}), 400
-
-        if not confirm:
-            estimated_tokens = 100  # Replace with actual estimation
-            estimated_cost = estimated_tokens * 0.000003 + 5000 * 0.000015
-
-            # Generate a unique request_id and create a repo_analyzer instance for it
-            request_id = str(uuid.uuid4())
-            request_manager.create_analyzer(request_id, task, repo_path)
-
-            return jsonify(
-                {
-                    "needsConfirmation": True,
-                    "requestId": request_id,
-                    "estimatedTokens": estimated_tokens,
-                    "estimatedCost": estimated_cost,
-                }
-            )
-        else:
-            return (
-                jsonify(
-                    {
-                        "error": "Bitte bestätigen Sie die Analyse mit dem Bestätigungs-Endpunkt."
-                    }
-                ),
-                400,
-            )
-
-    except Exception as e:
-        print(f"Error during analysis: {str(e)}")
-        return jsonify({"error": f"Analyse-Fehler: {str(e)}"}), 500
+        return unsupported_media_type()
+    payload, status = await api_handlers.analyze(request.get_json())
+    return jsonify(payload), status
 
 
 @app.route("/api/confirm", methods=["POST"])
 @async_route
 async def confirm_analysis():
     if request.content_type != "application/json":
-        return (
-            jsonify({"error": "Unsupported Media Type. Expected 'application/json'."}),
-            415,
-        )
-
-    try:
-        data = request.get_json()
-        request_id = data.get("requestId")
-
-        request_logger.log_request(
-            request_type="confirm",
-            content=data,
-        )
-
-        # Retrieve the repo_analyzer instance from the RequestManager
-        analysis_request = request_manager.get_analyzer(request_id)
-        if not analysis_request:
-            return (
-                jsonify(
-                    {
-                        "error": "Ungültige Anforderungs-ID oder die Anfrage ist abgelaufen."
-                    }
-                ),
-                400,
-            )
-
-        task = analysis_request["task"]
-        repo_path = analysis_request["repoPath"]
-        repo_analyzer = analysis_request["repo_analyzer"]
+        return unsupported_media_type()
+    payload, status = await api_handlers.confirm(request.get_json())
+    return jsonify(payload), status
 
-        relevant_files = await repo_analyzer.find_relevant_files(repo_path, task)
-        if relevant_files:
-            analysis = await repo_analyzer.analyze_changes(
-                repo_path, relevant_files, task
-            )
-            return jsonify(
-                {
-                    "files": relevant_files,
-                    "recommendations": analysis.recommendations,
-                    "needsConfirmation": False,
-                }
-            )
-        else:
-            return jsonify({"error": "Keine relevanten Dateien gefunden"}), 400
-
-    except Exception as e:
-        print(f"Error during confirm analysis: {str(e)}")
-        return jsonify({"error": f"Analyse-Fehler: {str(e)}"}), 500
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@async_route
+async def job_status(job_id):
+    """Status, progress and (once finished) result of a confirmed analysis"""
+    include_events = request.args.get("events", "").lower() in ("1", "true")
+    payload, status = await api_handlers.job_status(job_id, include_events=include_events)
+    return jsonify(payload), status
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Server-Sent Events of a job: every progress event, then the final job state"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": UNKNOWN_JOB_ID}), 404
+    return Response(
+        api_handlers.job_event_stream(job),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/api/ask", methods=["POST"])
 @async_route
 async def ask_followup():
-    try:
-        data = request.get_json()
-        question = data.get("question")
-        request_id = data.get("requestId")
-
-        request_logger.log_request(
-            request_type="followup",
-            content=data,
-        )
-
-        if not question or not request_id:
-            return jsonify({"error": "Frage und requestId sind erforderlich"}), 400
-
-        # Retrieve the repo_analyzer instance from the RequestManager for follow-up
-        analysis_request = request_manager.get_analyzer(request_id)
-        if not analysis_request:
-            return (
-                jsonify(
-                    {
-                        "error": "Ungültige Anforderungs-ID oder die Anfrage ist abgelaufen."
-                    }
-                ),
-                400,
-            )
-
-        repo_analyzer = analysis_request["repo_analyzer"]
-        response = await repo_analyzer.ask_followup_question(question)
-        return jsonify({"response": response})
-
-    except Exception as e:
-        print(f"Error during follow-up: {str(e)}")
-        return jsonify({"error": f"Fehler: {str(e)}"}), 500
+    payload, status = await api_handlers.ask(request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/api/confirm/stream", methods=["POST"])
+def confirm_analysis_stream():
+    """Server-Sent Events variant of /api/confirm: files, then recommendation deltas"""
+    if request.content_type != "application/json":
+        return unsupported_media_type()
+
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return invalid_body()
+    request_id = data.get("requestId")
+
+    request_logger.log_request(
+        request_type="confirm_stream",
+        content=data,
+    )
+
+    analysis_request = request_manager.get_analyzer(request_id)
+    if not analysis_request:
+        return jsonify({"error": INVALID_REQUEST_ID}), 400
+
+    task = analysis_request["task"]
+    repo_path = analysis_request["repoPath"]
+    repo_analyzer = analysis_request["repo_analyzer"]
+
+    async def events():
+        relevant_files = await repo_analyzer.find_relevant_files(repo_path, task)
+        if not relevant_files:
+            yield sse_event("error", {"error": "Keine relevanten Dateien gefunden"})
+            return
+        yield sse_event("files", {"files": relevant_files})
+
+        async for delta in repo_analyzer.analyze_changes_stream(repo_path, relevant_files, task):
+            yield sse_event("delta", {"text": delta})
+        yield sse_event("done", {"files": relevant_files, **stream_stats(repo_analyzer)})
+
+    return stream_events(events)
+
+
+@app.route("/api/ask/stream", methods=["POST"])
+def ask_followup_stream():
+    """Server-Sent Events variant of /api/ask"""
+    if request.content_type != "application/json":
+        return unsupported_media_type()
+
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return invalid_body()
+    question = data.get("question")
+    request_id = data.get("requestId")
+
+    request_logger.log_request(
+        request_type="followup_stream",
+        content=data,
+    )
+
+    if not question or not request_id:
+        return jsonify({"error": "Frage und requestId sind erforderlich"}), 400
+
+    analysis_request = request_manager.get_analyzer(request_id)
+    if not analysis_request:
+        return jsonify({"error": INVALID_REQUEST_ID}), 400
+
+    repo_analyzer = analysis_request["repo_analyzer"]
+
+    async def events():
+        async for delta in repo_analyzer.ask_followup_stream(question):
+            yield sse_event("delta", {"text": delta})
+        yield sse_event("done", stream_stats(repo_analyzer))
+
+    return stream_events(events)
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit rates and memory of the caches shared by all sessions, and coalesced identical calls"""
+    return jsonify(api_handlers.cache_stats())
+
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """Latency, token, cache and queue metrics in the Prometheus text format"""
+    return Response(api_handlers.metrics_text(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/")
@@ -376,7 +393,19 @@ def home():
                     <br>
                     POST /api/confirm_analysis
                     <br>
+                    GET /api/jobs/&lt;jobId&gt;
+                    <br>
+                    GET /api/jobs/&lt;jobId&gt;/events (Server-Sent Events)
+                    <br>
                     POST /api/ask
+                    <br>
+                    POST /api/confirm/stream (Server-Sent Events)
+                    <br>
+                    POST /api/ask/stream (Server-Sent Events)
+                    <br>
+                    GET /api/cache/stats
+                    <br>
+                    GET /api/metrics (Prometheus)
                 </div>
             </div>
 
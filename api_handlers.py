@@ -0,0 +1,353 @@
+"""
+Endpoint logic shared by the Flask app (api.py) and the ASGI app (asgi.py).
+
+Handlers take the parsed JSON body and return (payload, HTTP status); they
+never raise, so both servers only have to serialize the result.
+"""
+import os
+import json
+import uuid
+import logging
+import functools
+from dataclasses import asdict
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Tuple
+
+from job_queue import FINISHED_STATES, Job, QUEUED, RUNNING, get_job_queue
+from repo_analyzer import RepoAnalyzer
+from request_logger import get_request_logger
+from file_cache import get_file_cache
+from response_cache import get_response_cache
+from rate_limiter import get_rate_limiter
+from single_flight import single_flight_stats
+from tracing import Trace, current_trace, start_trace
+from metrics import registry, REQUEST_SECONDS, CACHE_EVENTS, CACHE_BYTES, QUEUE_DEPTH, IN_FLIGHT
+from conversation_history import HISTORY_STRATEGIES
+from config import (DEFAULT_PRESELECT_K, ANALYSIS_TOKEN_BUDGET, ANALYSIS_BATCH_CONCURRENCY,
+                    ANALYSIS_MAX_FILES_PER_BATCH, HISTORY_TOKEN_BUDGET, HISTORY_STRATEGY)
+
+CLAUDE_LOCATION = os.getenv("CLAUDE_LOCATION", "us-central1")
+CLAUDE_PROJECT_ID = os.getenv("CLAUDE_PROJECT_ID")
+
+INVALID_REQUEST_ID = "Ungültige Anforderungs-ID oder die Anfrage ist abgelaufen."
+UNKNOWN_JOB_ID = "Unbekannte Job-ID oder der Job ist abgelaufen."
+
+HandlerResult = Tuple[dict, int]
+
+logger = logging.getLogger(__name__)
+
+
+# RequestManager to handle repo_analyzer instances per request_id
+class RequestManager:
+    def __init__(self):
+        self.cache = {}
+
+    def create_analyzer(self, request_id, task, repo_path, **analyzer_options):
+        # Instantiate a new RepoAnalyzer and store it
+        analyzer = RepoAnalyzer(CLAUDE_LOCATION, CLAUDE_PROJECT_ID, **analyzer_options)
+        self.cache[request_id] = {
+            "repo_analyzer": analyzer,
+            "task": task,
+            "repoPath": repo_path,
+        }
+        return analyzer
+
+    def get_analyzer(self, request_id):
+        return self.cache.get(request_id)
+
+    def delete_analyzer(self, request_id):
+        if request_id in self.cache:
+            del self.cache[request_id]
+
+    def clear(self):
+        self.cache.clear()
+
+
+request_manager = RequestManager()
+request_logger = get_request_logger()
+
+
+def collect_metrics() -> None:
+    """Refresh the cache and queue gauges from the stats of the shared components"""
+    files = get_file_cache().stats_dict()
+    for event in ("hits", "misses", "invalidations", "evictions"):
+        CACHE_EVENTS.set(files[event], cache="files", event=event)
+    CACHE_BYTES.set(files["bytes"], cache="files")
+    responses = get_response_cache().stats_dict()
+    for event in ("memory_hits", "disk_hits", "misses", "stores", "evictions", "expired"):
+        CACHE_EVENTS.set(responses[event], cache="responses", event=event)
+    for name, stats in single_flight_stats().items():
+        CACHE_EVENTS.set(stats["coalesced"], cache=f"single_flight_{name}", event="coalesced")
+        CACHE_EVENTS.set(stats["executions"], cache=f"single_flight_{name}", event="executions")
+        IN_FLIGHT.set(stats["in_flight"], kind=f"single_flight_{name}")
+
+    limiter = get_rate_limiter().stats_dict()
+    QUEUE_DEPTH.set(limiter["queued"], queue="claude_rate_limit")
+    IN_FLIGHT.set(limiter["in_flight"], kind="claude_requests")
+    IN_FLIGHT.set(limiter["concurrency_limit"], kind="claude_concurrency_limit")
+    QUEUE_DEPTH.set(request_logger.stats_dict()["queued"], queue="request_log")
+    jobs = get_job_queue().status_counts()
+    QUEUE_DEPTH.set(jobs.get(QUEUED, 0), queue="jobs")
+    IN_FLIGHT.set(jobs.get(RUNNING, 0), kind="jobs")
+
+
+registry.add_collector(collect_metrics)
+
+
+def metrics_text() -> str:
+    """All metrics in the Prometheus text format"""
+    return registry.render()
+
+
+def finish_trace(trace: Trace, endpoint: str, status: str) -> None:
+    REQUEST_SECONDS.observe(trace.elapsed, endpoint=endpoint, status=status)
+    stages = ", ".join(f"{name} {stage['seconds']:.3f}s" for name, stage in trace.breakdown().items())
+    logger.info(f"{endpoint} {trace.request_id or '-'} took {trace.elapsed:.3f}s ({stages or 'no stages'})")
+
+
+def traced(endpoint: str):
+    """Run a handler in a trace of its requestId and record its latency"""
+    def decorator(handler: Callable[[dict], Awaitable[HandlerResult]]):
+        @functools.wraps(handler)
+        async def wrapper(data) -> HandlerResult:
+            with start_trace(data.get("requestId") if isinstance(data, dict) else None) as trace:
+                payload, status = await handler(data)
+            finish_trace(trace, endpoint, str(status))
+            return payload, status
+        return wrapper
+    return decorator
+
+
+@traced("analyze")
+async def analyze(data: dict) -> HandlerResult:
+    try:
+        task = data.get("task")
+        repo_path = data.get("repoPath")
+        confirm = data.get("confirm", False)
+        preselect_k = data.get("preselectK", DEFAULT_PRESELECT_K)
+        symbols_only = bool(data.get("symbolsOnly", False))
+        use_cache = not data.get("noCache", False)
+        token_budget = data.get("tokenBudget", ANALYSIS_TOKEN_BUDGET)
+        batch_concurrency = data.get("batchConcurrency", ANALYSIS_BATCH_CONCURRENCY)
+        max_files_per_batch = data.get("maxFilesPerBatch", ANALYSIS_MAX_FILES_PER_BATCH)
+        history_budget = data.get("historyBudget", HISTORY_TOKEN_BUDGET)
+        history_strategy = data.get("historyStrategy", HISTORY_STRATEGY)
+
+        request_logger.log_request(
+            request_type="analyze",
+            content=data,
+        )
+
+        if not task or not repo_path:
+            return {"error": "Task und Repository-Pfad sind erforderlich"}, 400
+
+        # bool is an int subclass, but true/false are no valid counts
+        if not isinstance(preselect_k, int) or isinstance(preselect_k, bool) or preselect_k < 0:
+            return {"error": "preselectK muss eine nicht-negative Ganzzahl sein"}, 400
+
+        for name, value in (("tokenBudget", token_budget), ("batchConcurrency", batch_concurrency),
+                            ("historyBudget", history_budget)):
+            if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                return {"error": f"{name} muss eine positive Ganzzahl sein"}, 400
+
+        if not isinstance(max_files_per_batch, int) or isinstance(max_files_per_batch, bool) or max_files_per_batch < 0:
+            return {"error": "maxFilesPerBatch muss eine nicht-negative Ganzzahl sein"}, 400
+
+        if history_strategy not in HISTORY_STRATEGIES:
+            return {"error": f"historyStrategy muss einer von {', '.join(HISTORY_STRATEGIES)} sein"}, 400
+
+        if not confirm:
+            # Generate a unique request_id and create a repo_analyzer instance for it
+            request_id = str(uuid.uuid4())
+            current_trace().request_id = request_id
+            analyzer = request_manager.create_analyzer(
+                request_id, task, repo_path,
+                preselect_k=preselect_k,
+                symbols_only=symbols_only,
+                use_cache=use_cache,
+                token_budget=token_budget,
+                batch_concurrency=batch_concurrency,
+                max_files_per_batch=max_files_per_batch,
+                history_budget=history_budget,
+                history_strategy=history_strategy
+            )
+
+            # Selection and analysis prompt sized from the file list and cached per-file token counts
+            try:
+                estimate = await analyzer.estimate_pipeline(repo_path, task)
+            except FileNotFoundError:
+                request_manager.delete_analyzer(request_id)
+                return {"error": f"Repository nicht gefunden: {repo_path}"}, 404
+
+            return {
+                "needsConfirmation": True,
+                "requestId": request_id,
+                "estimatedTokens": round(estimate.total_tokens.expected),
+                "estimatedCost": estimate.cost.expected,
+                "estimate": estimate.to_dict(),
+            }, 200
+        else:
+            return {"error": "Bitte bestätigen Sie die Analyse mit dem Bestätigungs-Endpunkt."}, 400
+
+    except Exception as e:
+        print(f"Error during analysis: {str(e)}")
+        return {"error": f"Analyse-Fehler: {str(e)}"}, 500
+
+
+async def run_confirmed_analysis(job: Job, request_id: str, analysis_request: dict) -> dict:
+    """Job body of /api/confirm: select the files, then stream the analysis into the job"""
+    task = analysis_request["task"]
+    repo_path = analysis_request["repoPath"]
+    repo_analyzer = analysis_request["repo_analyzer"]
+
+    repo_analyzer.progress_callback = job.progress
+    status = "failed"
+    with start_trace(request_id) as trace:
+        try:
+            relevant_files = await repo_analyzer.find_relevant_files(repo_path, task)
+            if not relevant_files:
+                raise LookupError("Keine relevanten Dateien gefunden")
+
+            chunks = []
+            async for delta in repo_analyzer.analyze_changes_stream(repo_path, relevant_files, task):
+                chunks.append(delta)
+                job.progress("analysis_delta", text=delta)
+            status = "succeeded"
+        finally:
+            repo_analyzer.progress_callback = None
+            finish_trace(trace, "confirm_job", status)
+
+    preselection = repo_analyzer.last_preselection
+    return {
+        "files": relevant_files,
+        "recommendations": "".join(chunks),
+        "needsConfirmation": False,
+        "preselection": asdict(preselection) if preselection else None,
+        "symbolMatches": repo_analyzer.last_symbol_matches,
+        "analysisBatches": repo_analyzer.last_batch_count,
+        "timings": trace.breakdown(),
+    }
+
+
+@traced("confirm")
+async def confirm(data: dict) -> HandlerResult:
+    """Queue the confirmed analysis and return its job id right away (HTTP 202)"""
+    try:
+        request_id = data.get("requestId")
+        priority = data.get("priority", 0)
+
+        request_logger.log_request(
+            request_type="confirm",
+            content=data,
+        )
+
+        # Retrieve the repo_analyzer instance from the RequestManager
+        analysis_request = request_manager.get_analyzer(request_id)
+        if not analysis_request:
+            return {"error": INVALID_REQUEST_ID}, 400
+
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            return {"error": "priority muss eine Ganzzahl sein"}, 400
+
+        job = get_job_queue().submit(
+            "confirm",
+            lambda job: run_confirmed_analysis(job, request_id, analysis_request),
+            priority=priority
+        )
+        return {"jobId": job.id, "status": job.status, "needsConfirmation": False}, 202
+
+    except Exception as e:
+        print(f"Error during confirm analysis: {str(e)}")
+        return {"error": f"Analyse-Fehler: {str(e)}"}, 500
+
+
+async def job_status(job_id: str, include_events: bool = False) -> HandlerResult:
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return {"error": UNKNOWN_JOB_ID}, 404
+    return job.to_dict(include_events=include_events), 200
+
+
+def sse_event(event, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _job_event_chunks(job: Job, events: List[dict], sent: int) -> Tuple[List[str], bool]:
+    """SSE chunks for newly read events, and whether the stream is finished"""
+    chunks = [sse_event(event["stage"], event) for event in events]
+    if job.status in FINISHED_STATES and sent + len(events) == len(job.events):
+        chunks.append(sse_event("done", job.to_dict()))
+        return chunks, True
+    if not events:
+        chunks.append(": keepalive\n\n")
+    return chunks, False
+
+
+def job_event_stream(job: Job, keepalive_seconds: float = 15) -> Iterator[str]:
+    """
+    Server-Sent Events of a job: every progress event, then "done" with the
+    final job state. Blocks while waiting for events; async servers use
+    async_job_event_stream instead.
+    """
+    sent = 0
+    while True:
+        events = job.wait_for_events(sent, timeout=keepalive_seconds)
+        chunks, finished = _job_event_chunks(job, events, sent)
+        yield from chunks
+        sent += len(events)
+        if finished:
+            return
+
+
+async def async_job_event_stream(job: Job, keepalive_seconds: float = 15) -> AsyncIterator[str]:
+    """job_event_stream for async servers, waiting on the event loop rather than in a thread"""
+    sent = 0
+    while True:
+        events = await job.wait_for_events_async(sent, timeout=keepalive_seconds)
+        chunks, finished = _job_event_chunks(job, events, sent)
+        for chunk in chunks:
+            yield chunk
+        sent += len(events)
+        if finished:
+            return
+
+
+def cache_stats() -> dict:
+    """Hit rates and memory of the caches shared by all sessions, and coalesced identical calls"""
+    return {
+        "files": get_file_cache().stats_dict(),
+        "responses": get_response_cache().stats_dict(),
+        "coalescing": single_flight_stats(),
+    }
+
+
+@traced("ask")
+async def ask(data: dict) -> HandlerResult:
+    try:
+        question = data.get("question")
+        request_id = data.get("requestId")
+
+        request_logger.log_request(
+            request_type="followup",
+            content=data,
+        )
+
+        if not question or not request_id:
+            return {"error": "Frage und requestId sind erforderlich"}, 400
+
+        # Retrieve the repo_analyzer instance from the RequestManager for follow-up
+        analysis_request = request_manager.get_analyzer(request_id)
+        if not analysis_request:
+            return {"error": INVALID_REQUEST_ID}, 400
+
+        repo_analyzer = analysis_request["repo_analyzer"]
+        response = await repo_analyzer.ask_followup_question(question)
+        return {
+            "response": response,
+            "usage": asdict(repo_analyzer.claude_client.usage_totals),
+            "history": repo_analyzer.claude_client.history.turn_tokens(),
+            "timings": current_trace().breakdown(),
+        }, 200
+
+    except Exception as e:
+        print(f"Error during follow-up: {str(e)}")
+        return {"error": f"Fehler: {str(e)}"}, 500
@@ -1,5 +1,32 @@
 import argparse
 from colorama import Fore, Style
+from config import (DEFAULT_PRESELECT_K, ANALYSIS_TOKEN_BUDGET, ANALYSIS_BATCH_CONCURRENCY,
+                    ANALYSIS_MAX_FILES_PER_BATCH, HISTORY_TOKEN_BUDGET, HISTORY_STRATEGY)
+from conversation_history import HISTORY_STRATEGIES
+from claude_transport import TRANSPORT_MODES, get_transport_mode
+
+
+def non_negative_int(value: str) -> int:
+    """argparse type for counts where 0 means unlimited, as validated by the API"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' ist keine Ganzzahl")
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"darf nicht negativ sein, nicht {number}")
+    return number
+
+
+def positive_int(value: str) -> int:
+    """argparse type for budgets and limits that must be at least 1, as validated by the API"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' ist keine Ganzzahl")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"muss eine positive Ganzzahl sein, nicht {number}")
+    return number
+
 
 def create_argument_parser():
     parser = argparse.ArgumentParser(
@@ -12,5 +39,29 @@ def create_argument_parser():
     parser.add_argument('--ignore', action='append', help='Zusätzliche Ignore-Patterns')
     parser.add_argument('--show-ignored', action='store_true', help='Zeige ignorierte Patterns')
     parser.add_argument('--interactive', action='store_true', help='Aktiviert den interaktiven Modus für Nachfragen')
+    parser.add_argument('--preselect-k', type=non_negative_int, default=DEFAULT_PRESELECT_K,
+                        help='Nur die K lokal am besten bewerteten Dateien an Claude senden (0 = alle)')
+    parser.add_argument('--symbols-only', action='store_true',
+                        help='Im Task genannte Symbole direkt über den Symbolindex auflösen, ohne Claude-Anfrage')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Antwort-Cache umgehen und Claude immer neu fragen')
+    parser.add_argument('--no-stream', action='store_true',
+                        help='Antworten erst nach Abschluss vollständig ausgeben statt fortlaufend')
+    parser.add_argument('--token-budget', type=positive_int, default=ANALYSIS_TOKEN_BUDGET,
+                        help='Maximale Token für Dateiinhalte pro Analyse-Anfrage, größere Auswahl wird aufgeteilt')
+    parser.add_argument('--batch-concurrency', type=positive_int, default=ANALYSIS_BATCH_CONCURRENCY,
+                        help='Anzahl gleichzeitig analysierter Teile bei aufgeteilter Analyse')
+    parser.add_argument('--batch-max-files', type=non_negative_int, default=ANALYSIS_MAX_FILES_PER_BATCH,
+                        help='Maximale Dateien pro Analyse-Teil (0 = nur durch das Token-Budget begrenzt)')
+    parser.add_argument('--history-budget', type=positive_int, default=HISTORY_TOKEN_BUDGET,
+                        help='Maximale Token des Gesprächsverlaufs, darüber wird er verdichtet')
+    parser.add_argument('--history-strategy', choices=HISTORY_STRATEGIES, default=HISTORY_STRATEGY,
+                        help='Verdichtung des Verlaufs: alte Runden entfernen (evict), erneut gesendete '
+                             'Dateiinhalte entfernen (supersede) oder alte Runden zusammenfassen (digest)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Am Ende die Dauer der einzelnen Phasen (Scan, Lesen, Token, Claude, Logging) ausgeben')
+    parser.add_argument('--transport', choices=TRANSPORT_MODES, default=get_transport_mode(),
+                        help='Claude-Anbindung: live (Vertex), record (live und Antworten speichern), '
+                             'replay (gespeicherte Antworten) oder synthetic (generierte Antworten ohne Netzwerk)')
 
     return parser
@@ -0,0 +1,227 @@
+"""
+ASGI server mode for the analyze/confirm/ask, job, cache stats and metrics endpoints.
+
+Unlike the Flask app, which starts a new event loop for every request, all
+requests share one long-lived loop, so the pooled Claude clients, executors
+and caches are reused across requests. Startup and shutdown run as ASGI
+lifespan hooks.
+
+Usage:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+    python asgi.py [--host 0.0.0.0] [--port 8000] [--transport synthetic]
+"""
+import json
+import asyncio
+import logging
+import argparse
+from typing import Awaitable, Callable, Dict, Tuple
+
+import api_handlers
+from api_handlers import HandlerResult
+from claude_transport import TRANSPORT_MODES, get_transport_mode, set_transport_mode
+from claude_client import close_async_pools
+from job_queue import get_job_queue, shutdown_job_queue
+from token_estimator import get_token_estimator
+from response_cache import get_response_cache
+from file_cache import get_file_cache
+from config import ASGI_MAX_BODY_BYTES
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[HandlerResult]]
+
+ROUTES: Dict[str, Tuple[Handler, bool]] = {
+    # path: (handler, requires a JSON content type, as in the Flask app)
+    "/api/analyze": (api_handlers.analyze, True),
+    "/api/confirm": (api_handlers.confirm, True),
+    "/api/ask": (api_handlers.ask, False),
+}
+
+JOBS_PREFIX = "/api/jobs/"
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type"),
+]
+
+
+async def startup() -> None:
+    """Create the process-wide state before the first request instead of during it"""
+    await asyncio.to_thread(lambda: (get_response_cache(), get_file_cache(), get_token_estimator()))
+    logger.info("ASGI app started")
+
+
+async def shutdown() -> None:
+    """Stop the job workers, close pooled connections and write the remaining request log records"""
+    await asyncio.to_thread(shutdown_job_queue)
+    api_handlers.request_manager.clear()
+    await close_async_pools()
+    await asyncio.to_thread(api_handlers.request_logger.close)
+    logger.info("ASGI app stopped")
+
+
+async def send_json(send, status: int, payload) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_text(send, status: int, text: str, content_type: bytes = b"text/plain; version=0.0.4") -> None:
+    body = text.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())] + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_job_events(receive, send, job) -> None:
+    """Stream the Server-Sent Events of a job until it is finished or the client goes away"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no")] + CORS_HEADERS,
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    events = api_handlers.async_job_event_stream(job)
+    try:
+        async for event in events:
+            if disconnected.done():
+                return
+            await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        await events.aclose()
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("Client disconnected")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > ASGI_MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            try:
+                await shutdown()
+            except Exception as e:
+                await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/api/metrics" and scope["method"] == "GET":
+        await send_text(send, 200, await asyncio.to_thread(api_handlers.metrics_text))
+        return
+    if scope["path"] == "/api/cache/stats" and scope["method"] == "GET":
+        await send_json(send, 200, await asyncio.to_thread(api_handlers.cache_stats))
+        return
+    if scope["path"].startswith(JOBS_PREFIX) and scope["method"] == "GET":
+        job_id, _, sub_path = scope["path"][len(JOBS_PREFIX):].partition("/")
+        if sub_path == "events":
+            job = get_job_queue().get(job_id)
+            if job is None:
+                await send_json(send, 404, {"error": api_handlers.UNKNOWN_JOB_ID})
+            else:
+                await send_job_events(receive, send, job)
+        elif sub_path:
+            await send_json(send, 404, {"error": "Not Found"})
+        else:
+            query = scope.get("query_string", b"").decode()
+            payload, status = await api_handlers.job_status(job_id, include_events="events=1" in query.split("&"))
+            await send_json(send, status, payload)
+        return
+
+    route = ROUTES.get(scope["path"])
+    if route is None:
+        await send_json(send, 404, {"error": "Not Found"})
+        return
+    if scope["method"] == "OPTIONS":
+        await send({"type": "http.response.start", "status": 204, "headers": CORS_HEADERS})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    if scope["method"] != "POST":
+        await send_json(send, 405, {"error": "Method Not Allowed"})
+        return
+
+    handler, json_only = route
+    headers = dict(scope.get("headers", []))
+    content_type = headers.get(b"content-type", b"").split(b";")[0].strip()
+    if json_only and content_type != b"application/json":
+        await send_json(send, 415, {"error": "Unsupported Media Type. Expected 'application/json'."})
+        return
+
+    try:
+        data = json.loads(await read_body(receive) or b"{}")
+    except ConnectionError:
+        return
+    except ValueError as e:
+        await send_json(send, 400, {"error": f"Ungültiger Request-Body: {e}"})
+        return
+    if not isinstance(data, dict):
+        await send_json(send, 400, {"error": "Request-Body muss ein JSON-Objekt sein"})
+        return
+
+    payload, status = await handler(data)
+    await send_json(send, status, payload)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ASGI-Server für die Analyse-API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--transport", choices=TRANSPORT_MODES, default=get_transport_mode(),
+                        help="Claude-Anbindung: live, record, replay oder synthetic")
+    args = parser.parse_args()
+    set_transport_mode(args.transport)
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("Für den ASGI-Modus wird uvicorn benötigt: pip install uvicorn")
+    uvicorn.run(app, host=args.host, port=args.port, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Batch mode: analyze many (repository, task) pairs in one process.
+
+Every repository is scanned once up front in a process pool, which brings
+the on-disk repository and symbol indexes up to date in parallel. The tasks
+then run with bounded concurrency; tasks of the same repository share the
+process-wide indexes, file cache, response cache and rate limiter. Each
+finished task is appended to the output as one JSON line right away, and
+tasks that already succeeded in an existing output are skipped, so an
+interrupted sweep resumes where it stopped.
+
+Manifest, as JSONL (one object per line) or YAML (a list of the same objects,
+needs PyYAML):
+    {"repo": "/srv/billing", "task": "Add retries to the invoice export"}
+    {"repo": "/srv/billing", "tasks": ["...", "..."], "ignore": ["generated/*"]}
+An optional "id" names a task in the output; it defaults to a hash of the
+repository path and the task.
+
+Usage:
+    python batch.py manifest.jsonl --project-id my-project --output results.jsonl
+        [--concurrency 4] [--scan-workers 4] [--transport synthetic] [--fresh]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from claude_transport import TRANSPORT_MODES, get_transport_mode, set_transport_mode
+from color_printer import ColorPrinter
+from ignore_rules import IgnoreMatcher
+from repo_analyzer import RepoAnalyzer
+from repo_index import get_repo_index
+from symbol_index import get_symbol_index
+from tracing import start_trace
+from config import IGNORED_FILE_PATTERNS, IGNORED_DIRECTORIES, BATCH_CONCURRENCY, BATCH_SCAN_WORKERS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+@dataclass
+class BatchTask:
+    """One (repository, task) pair of the manifest"""
+    id: str
+    repo: str
+    task: str
+    ignore: Tuple[str, ...] = ()
+
+
+def default_task_id(repo: str, task: str) -> str:
+    key = f"{Path(repo).expanduser().resolve()}\0{task}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def load_manifest(path: Path) -> List[BatchTask]:
+    """Parse a JSONL or YAML manifest into tasks; raises ValueError on invalid entries"""
+    text = path.read_text(encoding="utf-8")
+    if path.suffix in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise SystemExit("Für YAML-Manifeste wird PyYAML benötigt: pip install pyyaml")
+        entries = yaml.safe_load(text) or []
+        if isinstance(entries, dict):
+            entries = entries.get("tasks", [])
+    else:
+        entries = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if line.strip():
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Manifest-Zeile {number} ist kein gültiges JSON: {e}")
+
+    tasks = []
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get("repo"):
+            raise ValueError(f"Manifest-Eintrag {number} braucht ein Objekt mit 'repo'")
+        descriptions = entry.get("tasks") or ([entry["task"]] if entry.get("task") else [])
+        if not descriptions or not all(isinstance(task, str) and task for task in descriptions):
+            raise ValueError(f"Manifest-Eintrag {number} braucht 'task' oder eine Liste 'tasks'")
+        if entry.get("id") and len(descriptions) > 1:
+            raise ValueError(f"Manifest-Eintrag {number}: 'id' ist nur mit einer einzelnen 'task' erlaubt")
+        ignore = tuple(entry.get("ignore") or ())
+        for task in descriptions:
+            tasks.append(BatchTask(str(entry.get("id") or default_task_id(entry["repo"], task)),
+                                   entry["repo"], task, ignore))
+
+    seen: Set[str] = set()
+    for task in tasks:
+        if task.id in seen:
+            raise ValueError(f"Task-ID {task.id} kommt im Manifest mehrfach vor")
+        seen.add(task.id)
+    return tasks
+
+
+def completed_task_ids(output: Path) -> Set[str]:
+    """
+    Ids of tasks that already succeeded in an existing output.
+
+    A line cut short by a crash is removed, so that appending continues on a
+    line of its own.
+    """
+    if not output.exists():
+        return set()
+    with open(output, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logger.warning(f"Removing an incomplete last line from {output}")
+            f.truncate(complete)
+
+    done = set()
+    for line in data[:complete].splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if record.get("status") == SUCCEEDED:
+            done.add(record.get("id"))
+    return done
+
+
+class ResultWriter:
+    """Appends one JSON line per finished task and syncs it to disk, so a crash loses nothing written"""
+
+    def __init__(self, path: Path, fresh: bool = False):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "w" if fresh else "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def scan_repository(repo: str, ignore: Tuple[str, ...]) -> dict:
+    """
+    Bring the repository and symbol index of repo up to date; runs in a pool
+    process, the indexes are persisted under CACHE_DIR for the main process.
+    """
+    # Same patterns in the same order as RepoAnalyzer.add_ignore_pattern builds them, so the index matches
+    matcher = IgnoreMatcher.from_patterns(dict.fromkeys(list(IGNORED_FILE_PATTERNS) + list(ignore)))
+    index = get_repo_index(repo)
+    scan = index.scan(matcher, IGNORED_DIRECTORIES)
+    get_symbol_index(repo).build(scan.files, index.get_hashes(scan.files), scan.fingerprint)
+    return {"files": len(scan.files), "hashed": len(scan.hashed_paths), "seconds": scan.duration}
+
+
+class BatchRunner:
+    def __init__(self, tasks: List[BatchTask], writer: ResultWriter, location: str, project_id: str,
+                 concurrency: int = BATCH_CONCURRENCY, scan_workers: int = BATCH_SCAN_WORKERS,
+                 **analyzer_options):
+        self.tasks = tasks
+        self.writer = writer
+        self.location = location
+        self.project_id = project_id
+        self.scan_workers = max(1, scan_workers)
+        self.analyzer_options = analyzer_options
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.counts: Counter = Counter()
+
+    async def run(self) -> Counter:
+        by_repo: Dict[Tuple[str, Tuple[str, ...]], List[BatchTask]] = {}
+        for task in self.tasks:
+            by_repo.setdefault((task.repo, task.ignore), []).append(task)
+
+        # Spawned, so the pool does not inherit the threads of this process
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(self.scan_workers, len(by_repo)), mp_context=context) as pool:
+            scans = {key: asyncio.wrap_future(pool.submit(scan_repository, *key)) for key in by_repo}
+            await asyncio.gather(*(self._run_repository(key, tasks, scans[key]) for key, tasks in by_repo.items()))
+        return self.counts
+
+    async def _run_repository(self, key: Tuple[str, Tuple[str, ...]], tasks: List[BatchTask],
+                              scan: "asyncio.Future[dict]") -> None:
+        repo = key[0]
+        try:
+            stats = await scan
+            logger.info(f"Scanned {repo}: {stats['files']} files, {stats['hashed']} hashed "
+                        f"in {stats['seconds']:.2f}s, {len(tasks)} tasks")
+        except Exception as e:
+            logger.error(f"Scan of {repo} failed: {e}")
+            for task in tasks:
+                self._write(task, FAILED, error=f"Scan fehlgeschlagen: {e}")
+            return
+        await asyncio.gather(*(self._run_task(task) for task in tasks))
+
+    async def _run_task(self, task: BatchTask) -> None:
+        async with self.semaphore:
+            start = time.perf_counter()
+            analyzer = RepoAnalyzer(self.location, self.project_id, **self.analyzer_options)
+            for pattern in task.ignore:
+                analyzer.add_ignore_pattern(pattern)
+
+            with start_trace(task.id) as trace:
+                try:
+                    files = await analyzer.find_relevant_files(task.repo, task.task)
+                    recommendations = None
+                    if files:
+                        analysis = await analyzer.analyze_changes(task.repo, files, task.task)
+                        recommendations = analysis.recommendations
+                except Exception as e:
+                    logger.error(f"Task {task.id} failed: {e}")
+                    self._write(task, FAILED, analyzer=analyzer, error=str(e), seconds=time.perf_counter() - start,
+                                timings=trace.breakdown())
+                    return
+
+            self._write(task, SUCCEEDED, analyzer=analyzer, files=files, recommendations=recommendations,
+                        batches=analyzer.last_batch_count, seconds=time.perf_counter() - start,
+                        timings=trace.breakdown())
+
+    def _write(self, task: BatchTask, status: str, analyzer: RepoAnalyzer = None, **fields) -> None:
+        record = {"id": task.id, "repo": task.repo, "task": task.task, "status": status, **fields}
+        if analyzer is not None:
+            usage = analyzer.claude_client.usage_totals
+            record["usage"] = {**asdict(usage), "cost": usage.input_cost + usage.output_cost}
+        record["finished"] = datetime.now(timezone.utc).isoformat()
+        self.writer.write(record)
+        self.counts[status] += 1
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Batch-Analyse vieler Aufgaben über viele Repositories")
+    parser.add_argument("manifest", help="Manifest mit (repo, task)-Paaren als JSONL oder YAML")
+    parser.add_argument("--output", required=True, help="Ergebnisse als JSONL, wird fortgesetzt falls vorhanden")
+    parser.add_argument("--location", default="us-east5", help="Anthropic API Location")
+    parser.add_argument("--project-id", default=os.getenv("CLAUDE_PROJECT_ID"), help="GCP Project ID")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help="Anzahl gleichzeitig bearbeiteter Aufgaben")
+    parser.add_argument("--scan-workers", type=int, default=BATCH_SCAN_WORKERS,
+                        help="Prozesse für das Scannen der Repositories vor dem Start")
+    parser.add_argument("--no-cache", action="store_true", help="Antwort-Cache umgehen")
+    parser.add_argument("--transport", choices=TRANSPORT_MODES, default=get_transport_mode(),
+                        help="Claude-Anbindung: live, record, replay oder synthetic")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Vorhandene Ergebnisse verwerfen statt abgeschlossene Aufgaben zu überspringen")
+    return parser
+
+
+async def main() -> int:
+    args = create_argument_parser().parse_args()
+    printer = ColorPrinter()
+    set_transport_mode(args.transport)
+
+    try:
+        tasks = load_manifest(Path(args.manifest))
+    except (OSError, ValueError) as e:
+        printer.error(f"Manifest kann nicht gelesen werden: {e}")
+        return 2
+
+    output = Path(args.output)
+    done = set() if args.fresh else completed_task_ids(output)
+    pending = [task for task in tasks if task.id not in done]
+    printer.highlight(f"{len(tasks)} Aufgaben in {len({task.repo for task in tasks})} Repositories, "
+                      f"{len(tasks) - len(pending)} bereits erledigt")
+    if not pending:
+        return 0
+
+    writer = ResultWriter(output, fresh=args.fresh)
+    try:
+        counts = await BatchRunner(pending, writer, args.location, args.project_id,
+                                   concurrency=args.concurrency, scan_workers=args.scan_workers,
+                                   use_cache=not args.no_cache).run()
+    finally:
+        writer.close()
+
+    printer.success(f"Fertig: {counts[SUCCEEDED]} erfolgreich, {counts[FAILED]} fehlgeschlagen, "
+                    f"Ergebnisse in {output}")
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main()))
+    except KeyboardInterrupt:
+        print("\nAbgebrochen, mit demselben Aufruf wird fortgesetzt.")
+        sys.exit(130)
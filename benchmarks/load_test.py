@@ -0,0 +1,93 @@
+"""
+Load test for the API: requests per second and latency percentiles.
+
+Sends the same workload to one or more running servers, e.g. the Flask app
+(python api.py) and the ASGI app (python asgi.py), and prints a comparison.
+The default workload is POST /api/analyze, which creates an analysis request
+without calling Claude and so measures the serving overhead; --endpoint ask
+sends follow-up questions to a request id created first (needs credentials).
+
+Usage:
+    python -m benchmarks.load_test <repo_path> --url flask=http://127.0.0.1:443 \\
+        --url asgi=http://127.0.0.1:8000 [--requests 500] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_load(url: str, endpoint: str, repo_path: str, task: str, total: int,
+                   concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(base_url=url, timeout=600,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        request_id = None
+        if endpoint == "ask":
+            response = await client.post("/api/analyze", json={"task": task, "repoPath": repo_path})
+            response.raise_for_status()
+            request_id = response.json()["requestId"]
+
+        counter = iter(range(total))
+
+        async def worker():
+            nonlocal errors
+            for _ in counter:
+                if endpoint == "ask":
+                    body = {"question": task, "requestId": request_id}
+                else:
+                    body = {"task": task, "repoPath": repo_path}
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"/api/{endpoint}", json=body)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "rps": total / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "mean": statistics.mean(latencies) * 1000,
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="API load test")
+    parser.add_argument("repo_path")
+    parser.add_argument("--task", default="Add input validation to the API endpoints")
+    parser.add_argument("--url", action="append", required=True,
+                        help="name=base URL of a running server, repeat to compare")
+    parser.add_argument("--endpoint", choices=("analyze", "ask"), default="analyze")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'server':>10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'errors':>7}")
+    for entry in args.url:
+        name, _, url = entry.partition("=")
+        if not url:
+            name = url = entry
+        result = asyncio.run(run_load(url, args.endpoint, args.repo_path, args.task,
+                                      args.requests, args.concurrency))
+        print(f"{name:>10} {result['rps']:>9.1f} {result['p50']:>9.1f} {result['p95']:>9.1f} "
+              f"{result['mean']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
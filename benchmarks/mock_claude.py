@@ -0,0 +1,79 @@
+"""
+Deterministic in-process stand-in for ClaudeClient, for benchmarks that must
+not call Vertex.
+
+File selection prompts are answered with the first non-binary candidates
+listed in the prompt; every other prompt gets a fixed-length recommendation
+derived from a hash of the prompt. Token counts are estimated like ClaudeClient does it, so
+the reported usage matches what a real run would be billed for the prompt.
+"""
+import sys
+import hashlib
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+from anthropic.types import Usage
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from claude_client import StreamStats, TokenUsage  # noqa: E402
+from context_packer import split_file_blocks  # noqa: E402
+from file_tree import listed_paths  # noqa: E402
+from conversation_history import ConversationHistory  # noqa: E402
+from rate_limiter import PRIORITY_NORMAL  # noqa: E402
+from token_estimator import get_token_estimator  # noqa: E402
+
+WORDS = ("update", "the", "cache", "handler", "so", "that", "session", "tokens", "refresh", "before",
+         "expiry", "and", "add", "a", "test", "for", "invalidation", "in", "module", "config")
+# Claude does not pick images or archives for a code change
+BINARY_SUFFIXES = (".png", ".jpg", ".gif", ".ico", ".pdf", ".zip")
+
+
+class MockClaudeClient:
+    """Answers like ClaudeClient.send_message_async/stream_message_async, without network or cost"""
+
+    def __init__(self, selection_size: int = 20, answer_tokens: int = 800, stream_chunk_chars: int = 80):
+        self.selection_size = selection_size
+        self.answer_tokens = answer_tokens
+        self.stream_chunk_chars = stream_chunk_chars
+        self.token_estimator = get_token_estimator()
+        self.history = ConversationHistory(self.token_estimator)
+        self.usage_totals = TokenUsage()
+        self.last_stream_stats: Optional[StreamStats] = None
+        self.calls: List[TokenUsage] = []
+
+    @property
+    def message_history(self) -> list:
+        return self.history.messages()
+
+    def send_message(self, prompt: str, bypass_cache: bool = False, stateless: bool = False,
+                     priority: int = PRIORITY_NORMAL) -> dict:
+        content = self._answer(prompt)
+        usage = TokenUsage(
+            input_tokens=self.token_estimator.estimate_parts(split_file_blocks(prompt)),
+            output_tokens=self.token_estimator.estimate_tokens(content)
+        )
+        self.calls.append(usage)
+        self.usage_totals.add(usage)
+        if not stateless:
+            self.history.append(prompt, content)
+        return {"content": content, "usage": Usage(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)}
+
+    async def send_message_async(self, prompt: str, bypass_cache: bool = False, timeout: Optional[float] = None,
+                                 stateless: bool = False, priority: int = PRIORITY_NORMAL) -> dict:
+        return self.send_message(prompt, bypass_cache, stateless, priority)
+
+    async def stream_message_async(self, prompt: str, bypass_cache: bool = False, timeout: Optional[float] = None,
+                                   priority: int = PRIORITY_NORMAL) -> AsyncIterator[str]:
+        content = self.send_message(prompt, bypass_cache, priority=priority)["content"]
+        for start in range(0, len(content), self.stream_chunk_chars):
+            yield content[start:start + self.stream_chunk_chars]
+        self.last_stream_stats = StreamStats(time_to_first_token=0.0, total_seconds=0.0)
+
+    def _answer(self, prompt: str) -> str:
+        if "Which files are most likely relevant" in prompt:
+            candidates = [path for path in listed_paths(prompt) if not path.endswith(BINARY_SUFFIXES)]
+            return "\n".join(candidates[:self.selection_size])
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "big")
+        # Roughly one token per word
+        return " ".join(WORDS[(seed + index * 7) % len(WORDS)] for index in range(self.answer_tokens))
@@ -0,0 +1,277 @@
+"""
+Offline benchmark of the analysis pipeline, without calling Vertex.
+
+Generates synthetic repositories (by default 1k, 10k and 100k files) with
+most entries below ignored directories and a long-tailed distribution of file
+sizes, then runs find_relevant_files (cold and warm index), read_file_contents,
+prompt construction, token estimation and analyze_changes against
+MockClaudeClient. Each size runs in its own process, so the peak RSS is that
+of the size alone. Results are written as JSON (wall time, peak RSS and tokens
+per stage, plus the traced sub-stages), and --baseline compares them with an
+earlier run and exits with 1 on regressions.
+
+Usage:
+    python -m benchmarks.offline_benchmark [--sizes 1000 10000 100000] [--output result.json]
+        [--baseline previous.json] [--tolerance 0.25]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Keep indexes and request logs of the benchmark out of the user's cache and Firestore
+os.environ.setdefault("REQUEST_LOG_SINKS", "none")
+# Spawned size runs inherit the directory of the parent, so "cold" means cold for every run
+OWN_CACHE_DIR = "REPO_CODER_CACHE_DIR" not in os.environ
+if OWN_CACHE_DIR:
+    os.environ["REPO_CODER_CACHE_DIR"] = tempfile.mkdtemp(prefix="repo-coder-benchmark-cache-")
+
+from repo_analyzer import RepoAnalyzer  # noqa: E402
+from token_estimator import TokenEstimator  # noqa: E402
+from tracing import start_trace  # noqa: E402
+from benchmarks.mock_claude import MockClaudeClient  # noqa: E402
+
+TASK = "Fix the token refresh in AuthSession and the cache invalidation of SessionStore"
+
+# Share of files below ignored directories, roughly what we see in monorepos
+IGNORED_SHARE = 0.6
+IGNORED_ROOTS = ["node_modules", ".git/objects", ".venv/lib", "dist", "src/__pycache__"]
+FILES_PER_DIR = 25
+
+# Extension mix of the kept files; png files are binary
+EXTENSIONS = [(".py", 0.45), (".js", 0.25), (".ts", 0.10), (".md", 0.08), (".json", 0.07), (".png", 0.05)]
+
+# Log-normal file sizes: median ~2.5 KB with a long tail, clipped to 100 B .. 2 MB
+MEDIAN_FILE_BYTES = 2500
+SIZE_SIGMA = 1.2
+MIN_FILE_BYTES = 100
+MAX_FILE_BYTES = 2 * 1024 * 1024
+
+# Identifiers the task refers to end up in a few files, like in a real code base
+VOCABULARY = ["session", "store", "cache", "token", "user", "request", "handler", "config", "render", "query",
+              "index", "report", "billing", "invoice", "payment", "search", "upload", "export", "metrics", "queue"]
+TASK_SYMBOLS = ["AuthSession", "SessionStore"]
+TASK_SYMBOL_SHARE = 0.002
+
+STAGES = ("find_relevant_files_cold", "find_relevant_files_warm", "read_file_contents",
+          "prompt_construction", "token_estimation", "analyze_changes")
+
+# Stages faster than this are too noisy to flag as regressions
+MIN_COMPARABLE_SECONDS = 0.05
+
+
+def source_text(rng: random.Random, size: int, extension: str, symbol: str = "") -> str:
+    """Plausible source code of about size bytes"""
+    lines = []
+    if symbol:
+        lines.append(f"class {symbol}:\n    \"\"\"Handles the {symbol} lifecycle\"\"\"\n")
+    length = sum(len(line) for line in lines)
+    while length < size:
+        first, second = rng.choice(VOCABULARY), rng.choice(VOCABULARY)
+        if extension == ".py":
+            line = (f"def {first}_{second}_{rng.randrange(1000)}({first}, {second}=None):\n"
+                    f"    return {first}.get('{second}') or {rng.randrange(10 ** 6)}\n\n")
+        elif extension in (".js", ".ts"):
+            line = (f"export function {first}{second.title()}{rng.randrange(1000)}({first}) {{\n"
+                    f"  return {first}.{second} ?? {rng.randrange(10 ** 6)};\n}}\n\n")
+        elif extension == ".json":
+            line = f'"{first}_{second}_{rng.randrange(1000)}": {rng.randrange(10 ** 6)},\n'
+        else:
+            line = f"The {first} {second} section describes step {rng.randrange(1000)} of the {first} flow.\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)
+
+
+def build_repository(root: Path, total_files: int, seed: int) -> dict:
+    """Create the synthetic repository and return its shape"""
+    rng = random.Random(seed)
+    ignored_count = int(total_files * IGNORED_SHARE)
+    kept_count = total_files - ignored_count
+    total_bytes = 0
+
+    for index in range(ignored_count):
+        ignored_root = IGNORED_ROOTS[index % len(IGNORED_ROOTS)]
+        directory = root / ignored_root / f"pkg{index // FILES_PER_DIR}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"file{index}.js").write_text(f"module.exports = {index};\n")
+
+    extensions, weights = zip(*EXTENSIONS)
+    for index in range(kept_count):
+        directory = root / "src" / f"package{index // (FILES_PER_DIR * 10)}" / f"module{index // FILES_PER_DIR}"
+        directory.mkdir(parents=True, exist_ok=True)
+        extension = rng.choices(extensions, weights)[0]
+        size = int(min(MAX_FILE_BYTES, max(MIN_FILE_BYTES, rng.lognormvariate(0, SIZE_SIGMA) * MEDIAN_FILE_BYTES)))
+        path = directory / f"{rng.choice(VOCABULARY)}_{index}{extension}"
+        if extension == ".png":
+            path.write_bytes(b"\x89PNG\r\n\x1a\n" + rng.randbytes(size))
+        else:
+            symbol = rng.choice(TASK_SYMBOLS) if extension == ".py" and rng.random() < TASK_SYMBOL_SHARE else ""
+            path.write_text(source_text(rng, size, extension, symbol))
+        total_bytes += size
+
+    return {"files": total_files, "keptFiles": kept_count, "ignoredFiles": ignored_count, "keptBytes": total_bytes}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def run_pipeline(repo_path: Path, selection_size: int) -> dict:
+    analyzer = RepoAnalyzer("offline", "offline", use_cache=False)
+    claude = MockClaudeClient(selection_size=selection_size)
+    analyzer.claude_client = claude
+    stages = {}
+
+    async def measure(name: str, work, **extra):
+        calls_before = len(claude.calls)
+        with start_trace(name) as trace:
+            start = time.perf_counter()
+            result = await work()
+            seconds = time.perf_counter() - start
+        calls = claude.calls[calls_before:]
+        stages[name] = {
+            "seconds": seconds,
+            "peakRssMb": peak_rss_mb(),
+            "inputTokens": sum(usage.input_tokens for usage in calls),
+            "outputTokens": sum(usage.output_tokens for usage in calls),
+            "claudeCalls": len(calls),
+            "subStages": {stage: values["seconds"] for stage, values in trace.breakdown().items()},
+        }
+        return result
+
+    files = await measure("find_relevant_files_cold", lambda: analyzer.find_relevant_files(repo_path, TASK))
+    await measure("find_relevant_files_warm", lambda: analyzer.find_relevant_files(repo_path, TASK))
+    reads = await measure("read_file_contents", lambda: analyzer.read_file_contents(repo_path, files))
+    stages["read_file_contents"]["bytesRead"] = sum(result.bytes_read for result in reads.values())
+
+    contents = analyzer._prompt_contents(reads)
+    prompt = await measure("prompt_construction", lambda: analyzer._prepare_analysis_prompt(TASK, contents))
+    stages["prompt_construction"]["promptTokens"] = analyzer.token_estimator.estimate_tokens(prompt)
+    stages["prompt_construction"]["batches"] = analyzer.last_batch_count
+
+    # A fresh estimator without memoized counts measures the tokenizer itself
+    counts = await measure("token_estimation", lambda: asyncio.to_thread(
+        TokenEstimator().estimate_many, list(contents.values())))
+    stages["token_estimation"]["tokensCounted"] = sum(counts)
+
+    await measure("analyze_changes", lambda: analyzer.analyze_changes(repo_path, files, TASK))
+    return {"selectedFiles": len(files), "stages": stages}
+
+
+def run_size(size: int, seed: int, selection_size: int, work_dir: str) -> dict:
+    """Generate and benchmark one repository size; runs in a child process"""
+    repo_path = Path(tempfile.mkdtemp(prefix=f"repo-{size}-", dir=work_dir))
+    try:
+        start = time.perf_counter()
+        shape = build_repository(repo_path, size, seed)
+        shape["generateSeconds"] = time.perf_counter() - start
+        # The analyzer prints prompts and warnings for humans; keep stdout free for the JSON result
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = asyncio.run(run_pipeline(repo_path, selection_size))
+        return {**shape, **result}
+    finally:
+        shutil.rmtree(repo_path, ignore_errors=True)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """Stages that got slower than the baseline by more than tolerance, per repository size"""
+    previous = {result["files"]: result["stages"] for result in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        for stage, values in result["stages"].items():
+            before = previous.get(result["files"], {}).get(stage)
+            if not before or max(before["seconds"], values["seconds"]) < MIN_COMPARABLE_SECONDS:
+                continue
+            if values["seconds"] > before["seconds"] * (1 + tolerance):
+                regressions.append(f"{result['files']} files, {stage}: "
+                                   f"{before['seconds']:.3f}s -> {values['seconds']:.3f}s")
+    return regressions
+
+
+def print_table(report: dict) -> None:
+    print(f"{'files':>8} {'stage':<26} {'seconds':>9} {'peak MB':>8} {'in tok':>9} {'out tok':>8}", file=sys.stderr)
+    for result in report["results"]:
+        for stage in STAGES:
+            values = result["stages"][stage]
+            print(f"{result['files']:>8} {stage:<26} {values['seconds']:>9.3f} {values['peakRssMb']:>8.1f} "
+                  f"{values['inputTokens']:>9} {values['outputTokens']:>8}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with a mock Claude backend")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--selection-size", type=int, default=20,
+                        help="Files the mock returns for the file selection")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown per stage against the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="repo-coder-benchmark-")
+    results = []
+    try:
+        for size in args.sizes:
+            print(f"Benchmarking {size} files...", file=sys.stderr)
+            # A fresh process per size, so that peak RSS and process-wide caches are its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_size, size, args.seed, args.selection_size, work_dir).result())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if OWN_CACHE_DIR:
+            shutil.rmtree(os.environ["REPO_CODER_CACHE_DIR"], ignore_errors=True)
+
+    report = {
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "task": TASK,
+        "results": results,
+    }
+    print_table(report)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = find_regressions(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
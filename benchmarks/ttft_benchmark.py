@@ -0,0 +1,77 @@
+"""
+Measure time-to-first-token of the streaming API against the blocking one.
+
+Runs the analyze/confirm flow against a running server, once through
+/api/confirm (polling the queued job) and once through /api/confirm/stream, and prints when the first
+recommendation text arrived and when the response was complete.
+
+Usage:
+    python -m benchmarks.ttft_benchmark <repo_path> "<task>" [--url http://127.0.0.1:443] [--runs 3]
+"""
+import argparse
+import json
+import time
+
+import httpx
+
+
+def create_request(client: httpx.Client, url: str, repo_path: str, task: str) -> str:
+    response = client.post(f"{url}/api/analyze", json={"task": task, "repoPath": repo_path, "noCache": True})
+    response.raise_for_status()
+    return response.json()["requestId"]
+
+
+def blocking_run(client: httpx.Client, url: str, repo_path: str, task: str) -> tuple[float, float]:
+    request_id = create_request(client, url, repo_path, task)
+    start = time.perf_counter()
+    response = client.post(f"{url}/api/confirm", json={"requestId": request_id})
+    response.raise_for_status()
+    job_id = response.json()["jobId"]
+    while True:
+        job = client.get(f"{url}/api/jobs/{job_id}").json()
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"])
+        if job["status"] == "succeeded":
+            break
+        time.sleep(0.05)
+    total = time.perf_counter() - start
+    # Nothing is visible before the whole response is there
+    return total, total
+
+
+def streaming_run(client: httpx.Client, url: str, repo_path: str, task: str) -> tuple[float, float]:
+    request_id = create_request(client, url, repo_path, task)
+    start = time.perf_counter()
+    first_token = None
+    with client.stream("POST", f"{url}/api/confirm/stream", json={"requestId": request_id}) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "delta" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line.startswith("data: ") and event == "error":
+                raise RuntimeError(json.loads(line[len("data: "):])["error"])
+    total = time.perf_counter() - start
+    return (first_token if first_token is not None else total), total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time-to-first-token benchmark")
+    parser.add_argument("repo_path")
+    parser.add_argument("task")
+    parser.add_argument("--url", default="http://127.0.0.1:443")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with httpx.Client(timeout=600) as client:
+        print(f"{'mode':>10} {'run':>4} {'first token s':>14} {'total s':>9}")
+        for mode, run in (("blocking", blocking_run), ("streaming", streaming_run)):
+            for index in range(args.runs):
+                first_token, total = run(client, args.url, args.repo_path, args.task)
+                print(f"{mode:>10} {index + 1:>4} {first_token:>14.2f} {total:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
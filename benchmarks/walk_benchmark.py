@@ -0,0 +1,93 @@
+"""
+Compare the pruning scandir walker with the previous rglob + should_ignore scan.
+
+Builds synthetic repositories of growing size in a temporary directory, where
+most entries live below ignored directories (node_modules, .git, .venv), and
+prints the walk time of both implementations per tree size. File pattern
+matching is left out on both sides, since it is applied identically to the
+files that survive the walk.
+
+Usage:
+    python -m benchmarks.walk_benchmark [--sizes 1000 10000 50000] [--repeat 3]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import IGNORED_DIRECTORIES  # noqa: E402
+from file_walker import walk_repository  # noqa: E402
+
+# Share of files that end up below ignored directories, roughly what we see in monorepos
+IGNORED_SHARE = 0.8
+FILES_PER_DIR = 20
+
+
+def build_tree(root: Path, total_files: int) -> None:
+    """Create total_files empty files, IGNORED_SHARE of them under ignored directories"""
+    ignored_roots = ["node_modules", ".git/objects", ".venv/lib"]
+    ignored_count = int(total_files * IGNORED_SHARE)
+
+    def populate(base: Path, count: int, prefix: str) -> None:
+        for index in range(count):
+            directory = base / f"{prefix}{index // FILES_PER_DIR}" / f"sub{index % 3}"
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / f"file{index}.py").touch()
+
+    for position, ignored_root in enumerate(ignored_roots):
+        share = ignored_count // len(ignored_roots)
+        populate(root / ignored_root, share, f"pkg{position}_")
+    populate(root / "src", total_files - ignored_count, "module")
+
+
+def legacy_walk(repo_path: Path) -> list:
+    """The previous implementation: full rglob, then a parents check per file"""
+    files = []
+    for file_path in repo_path.rglob('*'):
+        if not file_path.is_file():
+            continue
+        if any(parent.name in IGNORED_DIRECTORIES for parent in file_path.parents):
+            continue
+        files.append(str(file_path.relative_to(repo_path)))
+    return files
+
+
+def pruning_walk(repo_path: Path) -> list:
+    """The new implementation: scandir walk that never enters ignored directories"""
+    return list(walk_repository(repo_path, IGNORED_DIRECTORIES))
+
+
+def best_of(func, repo_path: Path, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    found = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = len(func(repo_path))
+        best = min(best, time.perf_counter() - start)
+    return best, found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Walker benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'files':>10} {'kept':>8} {'legacy s':>10} {'pruning s':>10} {'speedup':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo_path = Path(tmp)
+            build_tree(repo_path, size)
+            legacy_time, legacy_found = best_of(legacy_walk, repo_path, args.repeat)
+            pruning_time, pruning_found = best_of(pruning_walk, repo_path, args.repeat)
+            if legacy_found != pruning_found:
+                print(f"  warning: result mismatch ({legacy_found} vs {pruning_found})", file=sys.stderr)
+            print(f"{size:>10} {pruning_found:>8} {legacy_time:>10.3f} {pruning_time:>10.3f} "
+                  f"{legacy_time / max(pruning_time, 1e-9):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
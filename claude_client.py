@@ -1,26 +1,396 @@
-from anthropic import AnthropicVertex
+from anthropic import (AnthropicVertex, AsyncAnthropicVertex, APIConnectionError, APIStatusError,
+                       InternalServerError, RateLimitError)
+from anthropic.types import Usage
 from color_printer import ColorPrinter
-from token_estimator import TokenEstimator
-from request_logger import RequestLogger
-from config import MAX_OUTPUT_TOKEN, INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE
+from token_estimator import get_token_estimator
+from request_logger import get_request_logger
+from response_cache import get_response_cache, fingerprint_request
+from conversation_history import ConversationHistory
+from context_packer import split_file_blocks
+from rate_limiter import PRIORITY_NORMAL, Reservation, backoff_delay, get_rate_limiter
+from tracing import span
+from claude_transport import get_transport_mode, wrap_client
+from metrics import CLAUDE_TOKENS
+from config import (MAX_OUTPUT_TOKEN, INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE, CLAUDE_MODEL,
+                    CLAUDE_MAX_CONCURRENCY, CLAUDE_MAX_CONNECTIONS, CLAUDE_REQUEST_TIMEOUT,
+                    PROMPT_CACHING, PROMPT_CACHING_BETA, CACHE_READ_TOKEN_PRICE, CACHE_WRITE_TOKEN_PRICE,
+                    SYSTEM_PROMPT, HISTORY_TOKEN_BUDGET, HISTORY_STRATEGY, CLAUDE_MAX_RETRIES)
 from utils import prompt_user_confirmation
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+import asyncio
+import logging
+import time
+import threading
+import weakref
+import httpx
 import sys
 
+logger = logging.getLogger(__name__)
+
+# One pooled async client and concurrency cap per (event loop, region, project, transport).
+# httpx connections are bound to the loop that opened them, so they cannot be shared across loops.
+_async_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+_async_pools_lock = threading.Lock()
+
+
+def _get_async_pool(location: str, project_id: str) -> Tuple[AsyncAnthropicVertex, asyncio.Semaphore]:
+    loop = asyncio.get_running_loop()
+    key = (location, project_id, get_transport_mode())
+    with _async_pools_lock:
+        pools = _async_pools.setdefault(loop, {})
+        pool = pools.get(key)
+        if pool is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=CLAUDE_MAX_CONNECTIONS,
+                                    max_keepalive_connections=CLAUDE_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(CLAUDE_REQUEST_TIMEOUT, connect=10.0)
+            )
+            # Retries are done by ClaudeClient, so that the rate limiter sees every throttle response
+            client = AsyncAnthropicVertex(region=location, project_id=project_id, http_client=http_client,
+                                          max_retries=0)
+            pool = (wrap_client(client, asynchronous=True), asyncio.Semaphore(CLAUDE_MAX_CONCURRENCY))
+            pools[key] = pool
+        return pool
+
+
+async def close_async_pools() -> None:
+    """Close the pooled async clients of the running event loop (call on shutdown)"""
+    loop = asyncio.get_running_loop()
+    with _async_pools_lock:
+        pools = _async_pools.pop(loop, {})
+    for client, _ in pools.values():
+        await client.close()
+
+
+# Throttling (429), overload (529) and other server errors, and lost connections are worth another try
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+
+def is_throttle(error: Exception) -> bool:
+    return isinstance(error, RateLimitError) or (isinstance(error, APIStatusError) and error.status_code == 529)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The server's retry-after hint of an error response, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+EPHEMERAL_CACHE = {"type": "ephemeral"}
+
+
+def mark_cache_breakpoints(messages: list, breakpoints: int = 2) -> list:
+    """
+    Return a copy of messages with cache breakpoints on the last user turns.
+
+    Marking the latest user turn writes the whole conversation to the prompt
+    cache; marking the one before reads the prefix written on the previous
+    turn. Together with the system prompt this stays within the provider's
+    limit of four breakpoints.
+    """
+    marked = list(messages)
+    user_positions = [i for i, message in enumerate(messages) if message["role"] == "user"]
+    for i in user_positions[-breakpoints:]:
+        content = messages[i]["content"]
+        if isinstance(content, str):
+            blocks = [{"type": "text", "text": content}]
+        else:
+            blocks = [dict(block) for block in content]
+        blocks[-1]["cache_control"] = EPHEMERAL_CACHE
+        marked[i] = {**messages[i], "content": blocks}
+    return marked
+
+
+@dataclass
+class TokenUsage:
+    """
+    Token usage of one response, or summed up over a session.
+
+    input_tokens only counts the uncached part of the prompt; cached tokens
+    are reported separately as read from or written to the prompt cache.
+    """
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+
+    @classmethod
+    def from_usage(cls, usage) -> "TokenUsage":
+        # The cache fields are only present when the provider used prompt caching
+        return cls(
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+            cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0
+        )
+
+    def add(self, other: "TokenUsage") -> None:
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.cache_read_input_tokens += other.cache_read_input_tokens
+        self.cache_creation_input_tokens += other.cache_creation_input_tokens
+
+    @property
+    def input_cost(self) -> float:
+        return (self.input_tokens * INPUT_TOKEN_PRICE +
+                self.cache_read_input_tokens * CACHE_READ_TOKEN_PRICE +
+                self.cache_creation_input_tokens * CACHE_WRITE_TOKEN_PRICE)
+
+    @property
+    def output_cost(self) -> float:
+        return self.output_tokens * OUTPUT_TOKEN_PRICE
+
+
+@dataclass
+class StreamStats:
+    """Timing of the last streamed completion"""
+    time_to_first_token: float
+    total_seconds: float
+    cached: bool = False
+
+
 class ClaudeClient:
     """Handles all interactions with Claude AI"""
 
-    def __init__(self, location: str, project_id: str):
-        self.client = AnthropicVertex(
+    def __init__(self, location: str, project_id: str, use_cache: bool = True,
+                 timeout: float = CLAUDE_REQUEST_TIMEOUT, prompt_caching: bool = PROMPT_CACHING,
+                 history_budget: int = HISTORY_TOKEN_BUDGET, history_strategy: str = HISTORY_STRATEGY):
+        self.location = location
+        self.project_id = project_id
+        # Record, replay or synthetic answers instead of plain Vertex calls, see claude_transport
+        self.client = wrap_client(AnthropicVertex(
             region=location,
-            project_id=project_id
-        )
+            project_id=project_id,
+            max_retries=0  # See _get_async_pool
+        ))
         self.printer = ColorPrinter()
-        self.token_estimator = TokenEstimator()
-        self.message_history = []
-        self.request_logger = RequestLogger()  # Add logger
+        self.token_estimator = get_token_estimator()
+        self.history = ConversationHistory(self.token_estimator, history_budget, history_strategy)
+        self.request_logger = get_request_logger()  # Shared, writes in the background
+        self.use_cache = use_cache
+        self.response_cache = get_response_cache() if use_cache else None
+        self.timeout = timeout
+        self.last_stream_stats: Optional[StreamStats] = None
+        self.prompt_caching = prompt_caching
+        self.usage_totals = TokenUsage()
+        self.rate_limiter = get_rate_limiter()
+
+    def send_message(self, prompt: str, bypass_cache: bool = False, stateless: bool = False,
+                     priority: int = PRIORITY_NORMAL) -> dict:
+        messages, cache_key, cached = self._lookup_cache(prompt, bypass_cache, stateless)
+        if cached is not None:
+            return self._cached_response(prompt, cached, stateless)
+
+        estimated_input_tokens = self._estimate_prompt_tokens(prompt)
+        self._confirm_cost(estimated_input_tokens)
+
+        for attempt in range(CLAUDE_MAX_RETRIES + 1):
+            with span("rate_limit_wait"):
+                reservation = self.rate_limiter.acquire(estimated_input_tokens, MAX_OUTPUT_TOKEN, priority)
+            try:
+                with span("claude_call"):
+                    response = self.client.messages.create(
+                        **self._build_request(messages, stateless),
+                        timeout=self.timeout
+                    )
+            except Exception as e:
+                time.sleep(self._retry_delay(reservation, e, attempt))
+                continue
+            self._release(reservation, response)
+            break
+
+        self._log_response(prompt, response)
+        return self._finish(prompt, response, cache_key, stateless)
+
+    async def send_message_async(self, prompt: str, bypass_cache: bool = False,
+                                 timeout: Optional[float] = None, stateless: bool = False,
+                                 priority: int = PRIORITY_NORMAL) -> dict:
+        """
+        Non-blocking variant of send_message.
+
+        Uses the pooled AsyncAnthropicVertex client of the running event loop,
+        waits for a free slot under CLAUDE_MAX_CONCURRENCY, and moves token
+        estimation, response cache lookups and writes and request logging off
+        the loop. A stateless message is
+        sent without the conversation history and not added to it, so several
+        can run concurrently.
+        """
+        messages, cache_key, cached = await asyncio.to_thread(self._lookup_cache, prompt, bypass_cache, stateless)
+        if cached is not None:
+            return await asyncio.to_thread(self._cached_response, prompt, cached, stateless)
+
+        estimated_input_tokens = await asyncio.to_thread(self._estimate_prompt_tokens, prompt)
+        self._confirm_cost(estimated_input_tokens)
 
-    def send_message(self, prompt: str) -> dict:
-        estimated_input_tokens = self.token_estimator.estimate_tokens(prompt)
+        client, semaphore = _get_async_pool(self.location, self.project_id)
+        response = await self._call_with_retries(
+            lambda: client.messages.create(
+                **self._build_request(messages, stateless),
+                timeout=timeout or self.timeout
+            ),
+            semaphore, estimated_input_tokens, priority
+        )
+
+        await asyncio.to_thread(self._log_response, prompt, response)
+        result = self._finish(prompt, response, None, stateless)
+        await asyncio.to_thread(self._store_in_cache, cache_key, response)
+        return result
+
+    async def stream_message_async(self, prompt: str, bypass_cache: bool = False,
+                                   timeout: Optional[float] = None,
+                                   priority: int = PRIORITY_NORMAL) -> AsyncIterator[str]:
+        """
+        Stream the answer as text deltas while they arrive.
+
+        Usage logging, history and caching happen once the stream is complete;
+        the time to the first token is kept in last_stream_stats and logged.
+        A failed stream is retried only as long as nothing was yielded yet.
+        """
+        messages, cache_key, cached = await asyncio.to_thread(self._lookup_cache, prompt, bypass_cache)
+        if cached is not None:
+            result = await asyncio.to_thread(self._cached_response, prompt, cached)
+            self.last_stream_stats = StreamStats(time_to_first_token=0.0, total_seconds=0.0, cached=True)
+            yield result["content"]
+            return
+
+        estimated_input_tokens = await asyncio.to_thread(self._estimate_prompt_tokens, prompt)
+        self._confirm_cost(estimated_input_tokens)
+
+        client, semaphore = _get_async_pool(self.location, self.project_id)
+        start = time.perf_counter()
+        first_token = None
+        for attempt in range(CLAUDE_MAX_RETRIES + 1):
+            with span("rate_limit_wait"):
+                reservation = await self.rate_limiter.acquire_async(estimated_input_tokens, MAX_OUTPUT_TOKEN,
+                                                                    priority)
+            try:
+                with span("claude_stream"):
+                    async with semaphore:
+                        async with client.messages.stream(
+                            **self._build_request(messages),
+                            timeout=timeout or self.timeout
+                        ) as stream:
+                            async for text in stream.text_stream:
+                                if first_token is None:
+                                    first_token = time.perf_counter() - start
+                                yield text
+                            response = await stream.get_final_message()
+            except Exception as e:
+                if first_token is not None:
+                    self.rate_limiter.release(reservation, throttled=is_throttle(e))
+                    raise
+                await asyncio.sleep(self._retry_delay(reservation, e, attempt))
+                continue
+            except BaseException:
+                self.rate_limiter.release(reservation)
+                raise
+            self._release(reservation, response)
+            break
+
+        total = time.perf_counter() - start
+        self.last_stream_stats = StreamStats(
+            time_to_first_token=first_token if first_token is not None else total,
+            total_seconds=total
+        )
+        await asyncio.to_thread(self._log_response, prompt, response, {
+            "time_to_first_token": self.last_stream_stats.time_to_first_token,
+            "total_seconds": total
+        })
+        self._finish(prompt, response, None)
+        await asyncio.to_thread(self._store_in_cache, cache_key, response)
+
+    async def _call_with_retries(self, call: Callable[[], Awaitable], semaphore: asyncio.Semaphore,
+                                 estimated_input_tokens: int, priority: int):
+        """Run call under the rate limiter, retrying throttling and transient errors with backoff"""
+        for attempt in range(CLAUDE_MAX_RETRIES + 1):
+            with span("rate_limit_wait"):
+                reservation = await self.rate_limiter.acquire_async(estimated_input_tokens, MAX_OUTPUT_TOKEN,
+                                                                    priority)
+            try:
+                with span("claude_call"):
+                    async with semaphore:
+                        response = await call()
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(reservation, e, attempt))
+                continue
+            except BaseException:
+                self.rate_limiter.release(reservation)
+                raise
+            self._release(reservation, response)
+            return response
+
+    def _retry_delay(self, reservation: Reservation, error: Exception, attempt: int) -> float:
+        """
+        Settle a failed attempt with the rate limiter and return the backoff
+        before the next one; re-raises errors that are not worth a retry and
+        the last error once the retries are used up.
+        """
+        retry_after = retry_after_seconds(error)
+        self.rate_limiter.release(reservation, throttled=is_throttle(error), retry_after=retry_after)
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= CLAUDE_MAX_RETRIES:
+            raise error
+        delay = backoff_delay(attempt, retry_after)
+        logger.warning(f"Claude request failed ({type(error).__name__}), "
+                       f"retry {attempt + 1}/{CLAUDE_MAX_RETRIES} in {delay:.1f}s")
+        self.rate_limiter.record_retry()
+        return delay
+
+    def _release(self, reservation: Reservation, response) -> None:
+        """Settle a successful request with its actual token usage"""
+        usage = TokenUsage.from_usage(response.usage)
+        # Cache reads do not count against the input token quota
+        self.rate_limiter.release(reservation, input_tokens=usage.input_tokens + usage.cache_creation_input_tokens,
+                                  output_tokens=usage.output_tokens)
+
+    @property
+    def message_history(self) -> list:
+        """The (compacted) conversation in the format of the messages API"""
+        return self.history.messages()
+
+    def _lookup_cache(self, prompt: str, bypass_cache: bool,
+                      stateless: bool = False) -> Tuple[list, Optional[str], Optional[dict]]:
+        history = [] if stateless else self.history.messages()
+        messages = history + [{"role": "user", "content": prompt}]
+
+        # Identical model, limits and conversation always produce a reusable answer
+        cache_key = None
+        cached = None
+        if self.use_cache and not bypass_cache:
+            cache_key = fingerprint_request(CLAUDE_MODEL, MAX_OUTPUT_TOKEN, messages, system=SYSTEM_PROMPT)
+            cached = self.response_cache.get(cache_key)
+        return messages, cache_key, cached
+
+    def _build_request(self, messages: list, stateless: bool = False) -> dict:
+        """
+        Keyword arguments for messages.create/stream.
+
+        With prompt caching the system prompt and the conversation up to the
+        latest user turn are marked as cacheable, so follow-up questions only
+        pay full price for the new question. Stateless requests are sent once
+        and only get the system prompt cached.
+        """
+        request = {"max_tokens": MAX_OUTPUT_TOKEN, "model": CLAUDE_MODEL,
+                   "system": SYSTEM_PROMPT, "messages": messages}
+        if self.prompt_caching:
+            # The Vertex client has no beta namespace, the header enables caching on older model versions
+            request["system"] = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": EPHEMERAL_CACHE}]
+            if not stateless:
+                request["messages"] = mark_cache_breakpoints(messages)
+            request["extra_headers"] = {"anthropic-beta": PROMPT_CACHING_BETA}
+        return request
+
+    def _estimate_prompt_tokens(self, prompt: str) -> int:
+        # File blocks were usually counted already while packing the context
+        with span("estimate_tokens"):
+            return self.token_estimator.estimate_parts(split_file_blocks(prompt))
+
+    def _confirm_cost(self, estimated_input_tokens: int) -> None:
         estimated_output_tokens = MAX_OUTPUT_TOKEN
         total_estimated_tokens = estimated_input_tokens + estimated_output_tokens
 
@@ -31,45 +401,93 @@ class ClaudeClient:
             self.printer.error("Anfrage abgebrochen.")
             sys.exit(0)
 
-        messages = self.message_history + [{"role": "user", "content": prompt}]
-
-        response = self.client.messages.create(
-            max_tokens=MAX_OUTPUT_TOKEN,
-            messages=messages,
-            model="claude-3-5-sonnet-v2@20241022"
-        )
-
+    def _log_response(self, prompt: str, response, extra_metadata: Optional[dict] = None) -> None:
+        usage = TokenUsage.from_usage(response.usage)
         self.request_logger.log_request(
             request_type="claude_message",
             content=prompt,
             response=response.content[0].text,
             metadata={
-                "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens,
-                "cost_input": response.usage.input_tokens * INPUT_TOKEN_PRICE,
-                "cost_output": response.usage.output_tokens * OUTPUT_TOKEN_PRICE
+                "input_tokens": usage.input_tokens,
+                "output_tokens": usage.output_tokens,
+                "cache_read_input_tokens": usage.cache_read_input_tokens,
+                "cache_creation_input_tokens": usage.cache_creation_input_tokens,
+                "cost_input": usage.input_cost,
+                "cost_output": usage.output_cost,
+                **(extra_metadata or {})
             }
         )
 
-        self.message_history.append({"role": "user", "content": prompt})
-        self.message_history.append({"role": "assistant", "content": response.content[0].text})
+    def _finish(self, prompt: str, response, cache_key: Optional[str], stateless: bool = False) -> dict:
+        if not stateless:
+            self.history.append(prompt, response.content[0].text)
 
+        usage = TokenUsage.from_usage(response.usage)
+        self.usage_totals.add(usage)
+        CLAUDE_TOKENS.observe(usage.input_tokens, kind="input")
+        CLAUDE_TOKENS.observe(usage.output_tokens, kind="output")
+        if usage.cache_read_input_tokens or usage.cache_creation_input_tokens:
+            CLAUDE_TOKENS.observe(usage.cache_read_input_tokens, kind="cache_read")
+            CLAUDE_TOKENS.observe(usage.cache_creation_input_tokens, kind="cache_write")
         self._print_usage_stats(response, self.printer)
 
+        self._store_in_cache(cache_key, response)
+
         return {
             "content": response.content[0].text,
             "usage": response.usage
         }
 
+    def _store_in_cache(self, cache_key: Optional[str], response) -> None:
+        """Keep the answer for identical requests; writes to disk, so async callers run it in a thread"""
+        if cache_key:
+            self.response_cache.put(cache_key, {
+                "content": response.content[0].text,
+                "usage": {
+                    "input_tokens": response.usage.input_tokens,
+                    "output_tokens": response.usage.output_tokens
+                }
+            })
+
+    def _cached_response(self, prompt: str, cached: dict, stateless: bool = False) -> dict:
+        """Replay a cached answer as if it had just been received"""
+        self.printer.info("Antwort aus dem Cache, keine Kosten")
+
+        self.request_logger.log_request(
+            request_type="claude_message",
+            content=prompt,
+            response=cached["content"],
+            metadata={
+                "input_tokens": cached["usage"]["input_tokens"],
+                "output_tokens": cached["usage"]["output_tokens"],
+                "cost_input": 0,
+                "cost_output": 0,
+                "cached": True
+            }
+        )
+
+        if not stateless:
+            self.history.append(prompt, cached["content"])
+
+        return {
+            "content": cached["content"],
+            "usage": Usage(**cached["usage"]),
+            "cached": True
+        }
+
     def _print_usage_stats(self, response, printer):
-        used_input_tokens = response.usage.input_tokens
-        used_output_tokens = response.usage.output_tokens
-        cost_input = used_input_tokens * INPUT_TOKEN_PRICE
-        cost_output = used_output_tokens * OUTPUT_TOKEN_PRICE
+        usage = TokenUsage.from_usage(response.usage)
+        cost_input = usage.input_cost
+        cost_output = usage.output_cost
 
         printer.highlight(
-            f"Used input tokens: {used_input_tokens} Used output tokens: {used_output_tokens}")
+            f"Used input tokens: {usage.input_tokens} Used output tokens: {usage.output_tokens}")
+        if usage.cache_read_input_tokens or usage.cache_creation_input_tokens:
+            printer.highlight(
+                f"Prompt cache: {usage.cache_read_input_tokens} tokens read, "
+                f"{usage.cache_creation_input_tokens} tokens written, "
+                f"{usage.input_tokens} uncached")
         printer.highlight(
             f"Costs for input token: ${cost_input:.6f} "
             f"Costs for output token: ${cost_output:.6f} "
-            f"total: ${cost_input + cost_output:.6f}")
\ No newline at end of file
+            f"total: ${cost_input + cost_output:.6f}")
@@ -0,0 +1,423 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from anthropic import APITimeoutError, InternalServerError, RateLimitError
+from anthropic.types import Message
+
+from file_tree import listed_paths
+from response_cache import fingerprint_request
+from token_estimator import get_token_estimator
+from config import (CLAUDE_TRANSPORT, CLAUDE_RECORDINGS_DIR, CLAUDE_REPLAY_REALTIME, CLAUDE_SYNTHETIC_LATENCY,
+                    CLAUDE_SYNTHETIC_TOKENS_PER_SECOND, CLAUDE_SYNTHETIC_OUTPUT_TOKENS,
+                    CLAUDE_SYNTHETIC_ERROR_RATE, CLAUDE_SYNTHETIC_THROTTLE_RATE, CLAUDE_SYNTHETIC_RETRY_AFTER,
+                    CLAUDE_SYNTHETIC_SEED)
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_MODES = ("live", "record", "replay", "synthetic")
+
+# Injected errors come back quickly, like real 429/500 responses
+ERROR_LATENCY_SECONDS = 0.05
+# Streamed answers are yielded in chunks of this many words
+STREAM_CHUNK_WORDS = 4
+# Files a synthetic file selection returns
+SYNTHETIC_SELECTION_FILES = 10
+
+FILE_SELECTION_PROMPT_START = "Given the following files in a repository"
+WORDS = ("update", "the", "handler", "so", "that", "it", "checks", "input", "before", "calling", "service",
+         "and", "add", "a", "test", "for", "error", "case", "in", "module", "config", "return", "value")
+FAKE_URL = "https://synthetic.invalid/v1/messages"
+
+
+class ReplayMissError(LookupError):
+    """No recorded exchange for a request in replay mode"""
+
+
+_mode = CLAUDE_TRANSPORT
+
+
+def get_transport_mode() -> str:
+    return _mode
+
+
+def set_transport_mode(mode: str) -> None:
+    """Select the transport of ClaudeClients and async pools created from now on"""
+    global _mode
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f"Unknown Claude transport {mode!r}, expected one of {', '.join(TRANSPORT_MODES)}")
+    _mode = mode
+
+
+def request_fingerprint(request: dict) -> str:
+    """
+    Fingerprint of the model input of a messages request.
+
+    Cache breakpoints, headers and timeouts do not change the answer, so a
+    recording made with prompt caching replays without it and vice versa.
+    """
+    system = request.get("system")
+    return fingerprint_request(request["model"], request["max_tokens"],
+                               [{"role": message["role"], "content": content_text(message["content"])}
+                                for message in request["messages"]],
+                               system=content_text(system) if system else None)
+
+
+def content_text(content) -> str:
+    """Text of a message content given as a string or as a list of blocks"""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content)
+
+
+@dataclass
+class Exchange:
+    """What a replayed or synthetic request returns, and when"""
+    message: Optional[Message]
+    first_token_seconds: float
+    total_seconds: float
+    error: Optional[Exception] = None
+
+    def chunks(self) -> List[str]:
+        words = self.message.content[0].text.split(" ")
+        chunks = [" ".join(words[start:start + STREAM_CHUNK_WORDS])
+                  for start in range(0, len(words), STREAM_CHUNK_WORDS)]
+        # Keep the separators, so the chunks join to the full text
+        return [chunk + " " for chunk in chunks[:-1]] + chunks[-1:]
+
+
+class RecordingStore:
+    """Recorded request/response pairs, one JSON file per request fingerprint"""
+
+    def __init__(self, directory: str = CLAUDE_RECORDINGS_DIR):
+        self.directory = directory
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, f"{fingerprint}.json")
+
+    def save(self, request: dict, message: Message, first_token_seconds: float, total_seconds: float) -> None:
+        fingerprint = request_fingerprint(request)
+        record = {
+            "fingerprint": fingerprint,
+            "recorded": time.time(),
+            "request": {key: value for key, value in request.items() if key not in ("extra_headers", "timeout")},
+            "response": message.model_dump(mode="json"),
+            "firstTokenSeconds": first_token_seconds,
+            "totalSeconds": total_seconds,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write and rename, so concurrent replays never read half a file
+            temp_path = f"{self._path(fingerprint)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False, default=str)
+            os.replace(temp_path, self._path(fingerprint))
+        except OSError as e:
+            logger.error(f"Could not save Claude recording {fingerprint}: {e}")
+
+    def load(self, request: dict) -> Exchange:
+        fingerprint = request_fingerprint(request)
+        try:
+            with open(self._path(fingerprint), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            raise ReplayMissError(f"No recorded Claude response for request {fingerprint} in {self.directory}")
+        message = Message.model_validate(record["response"])
+        if not CLAUDE_REPLAY_REALTIME:
+            return Exchange(message, 0.0, 0.0)
+        return Exchange(message, record["firstTokenSeconds"], record["totalSeconds"])
+
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    """Parse fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA"""
+    kind, _, values = spec.partition(":")
+    parameters = [float(value) for value in values.split(",") if value]
+    expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+    if expected.get(kind) != len(parameters):
+        raise ValueError(f"Invalid latency distribution {spec!r}, "
+                         f"expected fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA")
+    return kind, parameters
+
+
+class SyntheticBackend:
+    """
+    Generated answers with configurable latency, streaming rate and failures.
+
+    Every attempt of a request draws from a random generator seeded with the
+    seed, the request fingerprint and the attempt number, so a run produces
+    the same answers, delays and injected errors regardless of scheduling.
+    """
+
+    def __init__(self, latency: str = CLAUDE_SYNTHETIC_LATENCY,
+                 tokens_per_second: float = CLAUDE_SYNTHETIC_TOKENS_PER_SECOND,
+                 output_tokens: int = CLAUDE_SYNTHETIC_OUTPUT_TOKENS,
+                 error_rate: float = CLAUDE_SYNTHETIC_ERROR_RATE,
+                 throttle_rate: float = CLAUDE_SYNTHETIC_THROTTLE_RATE,
+                 retry_after: float = CLAUDE_SYNTHETIC_RETRY_AFTER, seed: int = CLAUDE_SYNTHETIC_SEED):
+        self.latency_kind, self.latency_parameters = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.token_estimator = get_token_estimator()
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _first_token_seconds(self, rng: random.Random) -> float:
+        parameters = self.latency_parameters
+        if self.latency_kind == "fixed":
+            return parameters[0]
+        if self.latency_kind == "uniform":
+            return rng.uniform(parameters[0], parameters[1])
+        return parameters[0] * math.exp(rng.gauss(0, parameters[1]))
+
+    def plan(self, request: dict) -> Exchange:
+        fingerprint = request_fingerprint(request)
+        with self._lock:
+            attempt = self._attempts.get(fingerprint, 0)
+            self._attempts[fingerprint] = attempt + 1
+        rng = random.Random(f"{self.seed}:{fingerprint}:{attempt}")
+
+        failure = rng.random()
+        if failure < self.throttle_rate:
+            response = httpx.Response(429, headers={"retry-after": str(self.retry_after)},
+                                      request=httpx.Request("POST", FAKE_URL))
+            error = RateLimitError("Synthetic rate limit", response=response, body=None)
+            return Exchange(None, ERROR_LATENCY_SECONDS, ERROR_LATENCY_SECONDS, error)
+        if failure < self.throttle_rate + self.error_rate:
+            response = httpx.Response(500, request=httpx.Request("POST", FAKE_URL))
+            error = InternalServerError("Synthetic server error", response=response, body=None)
+            return Exchange(None, ERROR_LATENCY_SECONDS, ERROR_LATENCY_SECONDS, error)
+
+        prompt = content_text(request["messages"][-1]["content"])
+        text = self._answer(prompt, rng)
+        input_text = content_text(request.get("system") or "") + "".join(
+            content_text(message["content"]) for message in request["messages"])
+        output_tokens = self.token_estimator.estimate_tokens(text)
+        message = Message(
+            id=f"msg_synthetic_{fingerprint[:16]}_{attempt}", type="message", role="assistant",
+            model=request["model"], stop_reason="end_turn",
+            content=[{"type": "text", "text": text}],
+            usage={"input_tokens": self.token_estimator.estimate_tokens(input_text),
+                   "output_tokens": output_tokens}
+        )
+        first_token = self._first_token_seconds(rng)
+        generation = output_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        return Exchange(message, first_token, first_token + generation)
+
+    def _answer(self, prompt: str, rng: random.Random) -> str:
+        # A file selection answers with candidates of the prompt, so the pipeline carries on
+        if prompt.startswith(FILE_SELECTION_PROMPT_START):
+            return "\n".join(listed_paths(prompt)[:SYNTHETIC_SELECTION_FILES])
+        return " ".join(rng.choice(WORDS) for _ in range(self.output_tokens))
+
+
+def _timeout_error() -> APITimeoutError:
+    return APITimeoutError(request=httpx.Request("POST", FAKE_URL))
+
+
+class _ExchangeStream:
+    """Stand-in for the SDK's message stream that plays back an Exchange"""
+
+    def __init__(self, exchange: Exchange, timeout: Optional[float]):
+        self.exchange = exchange
+        self.timeout = timeout
+
+    async def __aenter__(self) -> "_ExchangeStream":
+        exchange = self.exchange
+        if self.timeout is not None and exchange.first_token_seconds > self.timeout:
+            await asyncio.sleep(self.timeout)
+            raise _timeout_error()
+        if exchange.error is not None:
+            await asyncio.sleep(exchange.first_token_seconds)
+            raise exchange.error
+        return self
+
+    async def __aexit__(self, *exc_info) -> bool:
+        return False
+
+    @property
+    def text_stream(self) -> AsyncIterator[str]:
+        return self._text()
+
+    async def _text(self) -> AsyncIterator[str]:
+        exchange = self.exchange
+        chunks = exchange.chunks()
+        await asyncio.sleep(exchange.first_token_seconds)
+        pause = (exchange.total_seconds - exchange.first_token_seconds) / max(1, len(chunks))
+        for chunk in chunks:
+            yield chunk
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+    async def get_final_message(self) -> Message:
+        return self.exchange.message
+
+
+class _RecordingStream:
+    """Wraps the SDK's message stream and saves the exchange once it is complete"""
+
+    def __init__(self, manager, request: dict, store: RecordingStore):
+        self.manager = manager
+        self.request = request
+        self.store = store
+        self.stream = None
+        self.start = 0.0
+        self.first_token: Optional[float] = None
+
+    async def __aenter__(self) -> "_RecordingStream":
+        self.start = time.perf_counter()
+        self.stream = await self.manager.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.manager.__aexit__(*exc_info)
+
+    @property
+    def text_stream(self) -> AsyncIterator[str]:
+        return self._text()
+
+    async def _text(self) -> AsyncIterator[str]:
+        async for text in self.stream.text_stream:
+            if self.first_token is None:
+                self.first_token = time.perf_counter() - self.start
+            yield text
+
+    async def get_final_message(self) -> Message:
+        message = await self.stream.get_final_message()
+        total = time.perf_counter() - self.start
+        await asyncio.to_thread(self.store.save, self.request, message,
+                                self.first_token if self.first_token is not None else total, total)
+        return message
+
+
+def _settle(exchange: Exchange, timeout: Optional[float]) -> Tuple[float, Optional[Exception]]:
+    """How long a non-streaming request takes and what it raises"""
+    if exchange.error is not None:
+        return exchange.first_token_seconds, exchange.error
+    if timeout is not None and exchange.total_seconds > timeout:
+        return timeout, _timeout_error()
+    return exchange.total_seconds, None
+
+
+class _Messages:
+    """messages namespace of TransportClient"""
+
+    def __init__(self, transport: "TransportClient"):
+        self.transport = transport
+
+    def create(self, timeout: Optional[float] = None, **request) -> Message:
+        transport = self.transport
+        if transport.mode == "record":
+            start = time.perf_counter()
+            message = transport.client.messages.create(timeout=timeout, **request)
+            seconds = time.perf_counter() - start
+            transport.store.save(request, message, seconds, seconds)
+            return message
+        exchange = transport.plan(request)
+        seconds, error = _settle(exchange, timeout)
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return exchange.message
+
+
+class _AsyncMessages:
+    """messages namespace of AsyncTransportClient"""
+
+    def __init__(self, transport: "AsyncTransportClient"):
+        self.transport = transport
+
+    async def create(self, timeout: Optional[float] = None, **request) -> Message:
+        transport = self.transport
+        if transport.mode == "record":
+            start = time.perf_counter()
+            message = await transport.client.messages.create(timeout=timeout, **request)
+            seconds = time.perf_counter() - start
+            await asyncio.to_thread(transport.store.save, request, message, seconds, seconds)
+            return message
+        exchange = await asyncio.to_thread(transport.plan, request)
+        seconds, error = _settle(exchange, timeout)
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return exchange.message
+
+    def stream(self, timeout: Optional[float] = None, **request):
+        transport = self.transport
+        if transport.mode == "record":
+            return _RecordingStream(transport.client.messages.stream(timeout=timeout, **request), request,
+                                    transport.store)
+        return _ExchangeStream(transport.plan(request), timeout)
+
+
+class TransportClient:
+    """
+    Drop-in for AnthropicVertex/AsyncAnthropicVertex in the record, replay
+    and synthetic modes; ClaudeClient only uses messages.create and
+    messages.stream.
+    """
+
+    def __init__(self, client, mode: str):
+        self.client = client
+        self.mode = mode
+        self.store = get_recording_store()
+        self.messages = self._messages()
+
+    def _messages(self):
+        return _Messages(self)
+
+    def plan(self, request: dict) -> Exchange:
+        if self.mode == "replay":
+            return self.store.load(request)
+        return get_synthetic_backend().plan(request)
+
+
+class AsyncTransportClient(TransportClient):
+    def _messages(self):
+        return _AsyncMessages(self)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def wrap_client(client, asynchronous: bool = False):
+    """The SDK client itself in live mode, otherwise a transport around it"""
+    mode = get_transport_mode()
+    if mode == "live":
+        return client
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f"Unknown Claude transport {mode!r}, expected one of {', '.join(TRANSPORT_MODES)}")
+    return AsyncTransportClient(client, mode) if asynchronous else TransportClient(client, mode)
+
+
+_recording_store: Optional[RecordingStore] = None
+_synthetic_backend: Optional[SyntheticBackend] = None
+_singletons_lock = threading.Lock()
+
+
+def get_recording_store() -> RecordingStore:
+    global _recording_store
+    with _singletons_lock:
+        if _recording_store is None:
+            _recording_store = RecordingStore()
+        return _recording_store
+
+
+def get_synthetic_backend() -> SyntheticBackend:
+    """Process-wide, so attempt counts and thereby injected errors are reproducible across clients"""
+    global _synthetic_backend
+    with _singletons_lock:
+        if _synthetic_backend is None:
+            _synthetic_backend = SyntheticBackend()
+        return _synthetic_backend
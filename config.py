@@ -1,5 +1,36 @@
+import os
+
 MAX_OUTPUT_TOKEN=5000
 
+CLAUDE_MODEL = "claude-3-5-sonnet-v2@20241022"
+
+# Async Claude backend: shared connection pool per event loop
+CLAUDE_MAX_CONCURRENCY = 8
+CLAUDE_MAX_CONNECTIONS = 20
+CLAUDE_REQUEST_TIMEOUT = 300.0
+
+# Process-wide Claude budget, set to the Vertex quota of the project (0 disables a limit)
+CLAUDE_REQUESTS_PER_MINUTE = int(os.getenv("CLAUDE_REQUESTS_PER_MINUTE", "60"))
+CLAUDE_INPUT_TOKENS_PER_MINUTE = int(os.getenv("CLAUDE_INPUT_TOKENS_PER_MINUTE", "400000"))
+CLAUDE_OUTPUT_TOKENS_PER_MINUTE = int(os.getenv("CLAUDE_OUTPUT_TOKENS_PER_MINUTE", "80000"))
+CLAUDE_MIN_CONCURRENCY = 1  # Lower bound when throttle responses reduce the concurrency
+CLAUDE_MAX_RETRIES = 5  # On throttling, overload, server and connection errors
+CLAUDE_RETRY_BASE_DELAY = 1.0
+CLAUDE_RETRY_MAX_DELAY = 60.0
+
+# Transport under ClaudeClient: live (Vertex), record (live, saving every exchange),
+# replay (recorded exchanges by request fingerprint) or synthetic (generated answers)
+CLAUDE_TRANSPORT = os.getenv("CLAUDE_TRANSPORT", "live")
+CLAUDE_REPLAY_REALTIME = os.getenv("CLAUDE_REPLAY_REALTIME", "0") == "1"  # Reproduce the recorded timing
+# Synthetic answers: latency to the first token as fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA
+CLAUDE_SYNTHETIC_LATENCY = os.getenv("CLAUDE_SYNTHETIC_LATENCY", "lognormal:0.8,0.4")
+CLAUDE_SYNTHETIC_TOKENS_PER_SECOND = float(os.getenv("CLAUDE_SYNTHETIC_TOKENS_PER_SECOND", "60"))
+CLAUDE_SYNTHETIC_OUTPUT_TOKENS = int(os.getenv("CLAUDE_SYNTHETIC_OUTPUT_TOKENS", "300"))
+CLAUDE_SYNTHETIC_ERROR_RATE = float(os.getenv("CLAUDE_SYNTHETIC_ERROR_RATE", "0"))  # 500 responses
+CLAUDE_SYNTHETIC_THROTTLE_RATE = float(os.getenv("CLAUDE_SYNTHETIC_THROTTLE_RATE", "0"))  # 429 responses
+CLAUDE_SYNTHETIC_RETRY_AFTER = float(os.getenv("CLAUDE_SYNTHETIC_RETRY_AFTER", "1"))
+CLAUDE_SYNTHETIC_SEED = int(os.getenv("CLAUDE_SYNTHETIC_SEED", "0"))
+
 DEFAULT_OUTPUT_TOKENS = 1024
 
 IGNORED_DIRECTORIES = {
@@ -10,6 +41,82 @@ IGNORED_DIRECTORIES = {
 INPUT_TOKEN_PRICE = 0.000003
 OUTPUT_TOKEN_PRICE = 0.000015
 
+# Provider-side prompt caching: reads cost 10%, writes 125% of the input price
+PROMPT_CACHING = True
+CACHE_READ_TOKEN_PRICE = INPUT_TOKEN_PRICE * 0.1
+CACHE_WRITE_TOKEN_PRICE = INPUT_TOKEN_PRICE * 1.25
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+
+# Stable system text, sent first so it is part of every cached prefix
+SYSTEM_PROMPT = (
+    "You are an experienced software engineer helping with changes to a code repository. "
+    "Refer to files by their path relative to the repository root."
+)
+
+# Rough prompt processing speed, only used to estimate latency savings
+INPUT_TOKENS_PER_SECOND = 4000
+
+# Change analysis: file contents per request are packed into this many tokens.
+# Larger selections are split into batches, analyzed concurrently and merged.
+ANALYSIS_TOKEN_BUDGET = 150_000
+ANALYSIS_BATCH_CONCURRENCY = 4
+ANALYSIS_MAX_FILES_PER_BATCH = 0  # 0 = only limited by the token budget
+
+# File contents shared by all analyzers of a process, validated by mtime, size and inode
+FILE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Reading files for prompts: binary sniffing, byte limits per file and per request
+BINARY_SNIFF_BYTES = 8000
+FILE_READ_MAX_BYTES = 512 * 1024
+REQUEST_READ_MAX_BYTES = 4 * 1024 * 1024
+MMAP_MIN_BYTES = 256 * 1024
+FALLBACK_ENCODINGS = ("utf-8", "cp1252", "latin-1")  # latin-1 accepts anything, keep it last
+
+# Request log: written in the background to these sinks ("firestore", "jsonl", "none")
+REQUEST_LOG_SINKS = os.getenv("REQUEST_LOG_SINKS", "firestore").split(",")
+REQUEST_LOG_JSONL_PATH = os.getenv("REQUEST_LOG_JSONL_PATH", os.path.join("logs", "requests.jsonl"))
+REQUEST_LOG_QUEUE_SIZE = 10_000
+REQUEST_LOG_BATCH_SIZE = 100
+REQUEST_LOG_FLUSH_INTERVAL = 1.0
+REQUEST_LOG_BLOCK_SECONDS = 0.05  # Backpressure on a full queue before a record is dropped
+
+# Background jobs for /api/confirm: parallel workers and how long finished jobs are kept
+JOB_CONCURRENCY = 4
+JOB_RETENTION_SECONDS = 3600
+
+# Batch mode (batch.py): tasks analyzed at the same time and processes that scan repositories up front
+BATCH_CONCURRENCY = 4
+BATCH_SCAN_WORKERS = min(4, os.cpu_count() or 1)
+
+# ASGI server mode
+ASGI_MAX_BODY_BYTES = 1024 * 1024
+
+# Token estimation: memoized counts per content hash, threads for batch estimation
+TOKEN_CACHE_ENTRIES = 50_000
+TOKEN_ESTIMATOR_WORKERS = 4
+
+# Conversation history: compacted once it exceeds this many tokens.
+# Strategies: "evict" (oldest turns), "supersede" (file contents sent again later,
+# then evict), "digest" (supersede, then fold old turns into a short summary)
+HISTORY_TOKEN_BUDGET = 160_000
+HISTORY_STRATEGY = "supersede"
+
+# Local BM25 pre-ranking: only the top K candidates are sent to Claude (0 disables it)
+DEFAULT_PRESELECT_K = 300
+# Bytes read per file for the ranking index
+PRESELECT_MAX_BYTES = 32 * 1024
+
+# Candidates in the file selection prompt: "tree" (grouped by directory) or "list" (one full path per line),
+# optionally annotated with "size" or "lines"
+SELECTION_PROMPT_FORMAT = os.getenv("SELECTION_PROMPT_FORMAT", "tree")
+SELECTION_TREE_ANNOTATION = os.getenv("SELECTION_TREE_ANNOTATION", "none")
+
+# Pre-flight estimate of /api/analyze: Claude usually picks this many files (low, expected, high).
+# A repository walk is reused for the TTL; token profiles are cached per snapshot.
+PREFLIGHT_SELECTED_FILES = (3, 8, 20)
+PREFLIGHT_SNAPSHOT_TTL_SECONDS = 30.0
+PREFLIGHT_CACHE_ENTRIES = 32
+
 
 IGNORED_FILE_PATTERNS = [
     # Dependency Directories
@@ -53,8 +160,22 @@ IGNORED_FILE_PATTERNS = [
 
     # Database Files
     "*.sqlite",
-    "*.db"
+    "*.db",
 
     # Config Files
     "*.properties"
-]
\ No newline at end of file
+]
+
+# Persistent caches (repository index, ...) live here, one file per repository
+CACHE_DIR = os.getenv(
+    "REPO_CODER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "claude-ai-repo-coder")
+)
+
+# Exchanges saved by the record transport, one JSON file per request fingerprint
+CLAUDE_RECORDINGS_DIR = os.getenv("CLAUDE_RECORDINGS_DIR", os.path.join(CACHE_DIR, "recordings"))
+
+# Claude response cache: in-memory LRU in front of a size-bounded SQLite store
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RESPONSE_CACHE_MEMORY_ENTRIES = 128
@@ -0,0 +1,131 @@
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from token_estimator import TokenEstimator
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARKER = "\n... [truncated to fit the token budget]\n"
+
+
+# Heading plus a backtick fence that is longer than any backtick run inside the file
+FILE_BLOCK_PATTERN = re.compile(r"^### (?P<path>[^\n]+)\n(?P<fence>`{3,})\n.*?\n(?P=fence)\n",
+                                re.MULTILINE | re.DOTALL)
+_BACKTICK_RUN = re.compile(r"`{3,}")
+
+
+def _fence(content: str) -> str:
+    longest = max((len(run) for run in _BACKTICK_RUN.findall(content)), default=2)
+    return "`" * (longest + 1)
+
+
+def format_file_block(rel_path: str, content: str) -> str:
+    """Render one file for a prompt, with its path as heading and the content fenced"""
+    fence = _fence(content)
+    return f"### {rel_path}\n{fence}\n{content}\n{fence}\n"
+
+
+def iter_file_blocks(text: str) -> Iterator[Tuple[str, int, int]]:
+    """Yield (path, start, end) of every file block rendered by format_file_block in text"""
+    for match in FILE_BLOCK_PATTERN.finditer(text):
+        yield match.group("path"), match.start(), match.end()
+
+
+def split_file_blocks(text: str) -> List[str]:
+    """Split a prompt into its file blocks and the text between them, e.g. for per-part token counts"""
+    parts = []
+    position = 0
+    for _, start, end in iter_file_blocks(text):
+        parts.extend((text[position:start], text[start:end]))
+        position = end
+    parts.append(text[position:])
+    return [part for part in parts if part]
+
+
+def format_files(files_content: Dict[str, str]) -> str:
+    return "\n".join(format_file_block(rel_path, content) for rel_path, content in files_content.items())
+
+
+@dataclass
+class ContextBatch:
+    """Files that fit into one analysis request"""
+    files: Dict[str, str] = field(default_factory=dict)
+    tokens: int = 0
+    truncated: List[str] = field(default_factory=list)
+
+
+class ContextPacker:
+    """
+    Pack file contents into batches that each stay within a token budget.
+
+    Files keep their order, so files selected next to each other (usually the
+    related ones) end up in the same batch. A single file larger than the
+    budget is cut down to fit and listed in ContextBatch.truncated.
+    """
+
+    def __init__(self, token_estimator: TokenEstimator, budget_tokens: int, max_files_per_batch: int = 0):
+        if budget_tokens <= 0:
+            raise ValueError("budget_tokens must be positive")
+        self.token_estimator = token_estimator
+        self.budget_tokens = budget_tokens
+        self.max_files_per_batch = max_files_per_batch
+
+    def pack(self, files_content: Dict[str, str],
+             content_tokens: Optional[Dict[str, int]] = None) -> List[ContextBatch]:
+        """
+        Args:
+            files_content: Text per file, in prompt order
+            content_tokens: Known token counts of file contents (e.g. from the
+                repository index); only the heading and fences are counted for these
+        """
+        batches: List[ContextBatch] = []
+        current = ContextBatch()
+        block_tokens = self._block_tokens(files_content, content_tokens or {})
+
+        for (rel_path, content), tokens in zip(files_content.items(), block_tokens):
+            if tokens > self.budget_tokens:
+                content, tokens = self._truncate(rel_path, content, tokens)
+                truncated = True
+            else:
+                truncated = False
+
+            full = (current.tokens + tokens > self.budget_tokens or
+                    (self.max_files_per_batch and len(current.files) >= self.max_files_per_batch))
+            if current.files and full:
+                batches.append(current)
+                current = ContextBatch()
+
+            current.files[rel_path] = content
+            current.tokens += tokens
+            if truncated:
+                current.truncated.append(rel_path)
+
+        if current.files:
+            batches.append(current)
+        return batches
+
+    def _block_tokens(self, files_content: Dict[str, str], content_tokens: Dict[str, int]) -> List[int]:
+        """Token count of each file block; like estimate_parts, a few tokens above an exact count"""
+        unknown = [rel_path for rel_path in files_content if rel_path not in content_tokens]
+        counts = dict(zip(unknown, self.token_estimator.estimate_many(
+            [format_file_block(rel_path, files_content[rel_path]) for rel_path in unknown])))
+        for rel_path, content in files_content.items():
+            if rel_path not in counts:
+                fence = _fence(content)
+                counts[rel_path] = content_tokens[rel_path] + self.token_estimator.estimate_tokens(
+                    f"### {rel_path}\n{fence}\n\n{fence}\n")
+        return [counts[rel_path] for rel_path in files_content]
+
+    def _truncate(self, rel_path: str, content: str, tokens: int) -> tuple[str, int]:
+        """Shorten content until its block fits the budget"""
+        logger.warning(f"{rel_path} has ~{tokens} tokens, truncating to the budget of {self.budget_tokens}")
+        keep = len(content)
+        truncated = content
+        while tokens > self.budget_tokens and keep > 0:
+            # Tokens per character are roughly constant within a file; aim a little below the budget
+            keep = int(keep * self.budget_tokens / tokens * 0.95)
+            truncated = content[:keep] + TRUNCATION_MARKER
+            tokens = self.token_estimator.estimate_tokens(format_file_block(rel_path, truncated))
+        return truncated, tokens
@@ -0,0 +1,177 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+from context_packer import iter_file_blocks, split_file_blocks
+from token_estimator import TokenEstimator
+from config import HISTORY_TOKEN_BUDGET, HISTORY_STRATEGY
+
+logger = logging.getLogger(__name__)
+
+HISTORY_STRATEGIES = ("evict", "supersede", "digest")
+
+# How much of each compacted turn survives in the digest
+DIGEST_QUESTION_CHARS = 300
+DIGEST_ANSWER_CHARS = 600
+
+
+@dataclass
+class Turn:
+    """One user prompt and the assistant's answer"""
+    user: str
+    assistant: str
+    user_tokens: int
+    assistant_tokens: int
+    files: Tuple[str, ...] = field(default_factory=tuple)
+    digest: bool = False
+
+    @property
+    def tokens(self) -> int:
+        return self.user_tokens + self.assistant_tokens
+
+
+class ConversationHistory:
+    """
+    Conversation history with a token budget.
+
+    After each turn the history is compacted until it fits the budget again,
+    depending on the strategy:
+
+    - evict: drop the oldest turns
+    - supersede: first replace file blocks that a later turn sent again with a
+      short note, then evict
+    - digest: drop superseded file blocks, then fold the oldest turns into a
+      compact digest of questions, files and answer openings, then evict
+
+    The latest turn is always kept. Nothing changes while the history fits,
+    so the prompt cache prefix stays valid until the budget is reached.
+    """
+
+    def __init__(self, token_estimator: TokenEstimator, budget_tokens: int = HISTORY_TOKEN_BUDGET,
+                 strategy: str = HISTORY_STRATEGY):
+        if strategy not in HISTORY_STRATEGIES:
+            raise ValueError(f"Unknown history strategy: {strategy}")
+        self.token_estimator = token_estimator
+        self.budget_tokens = budget_tokens
+        self.strategy = strategy
+        self.turns: List[Turn] = []
+        self.evicted_turns = 0
+
+    def messages(self) -> List[dict]:
+        """The history in the format of the messages API"""
+        messages = []
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn.user})
+            messages.append({"role": "assistant", "content": turn.assistant})
+        return messages
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def turn_tokens(self) -> List[dict]:
+        """Token counts per turn, oldest first"""
+        return [{"user": turn.user_tokens, "assistant": turn.assistant_tokens, "digest": turn.digest}
+                for turn in self.turns]
+
+    def append(self, user: str, assistant: str) -> None:
+        self.turns.append(Turn(
+            user=user,
+            assistant=assistant,
+            user_tokens=self.token_estimator.estimate_parts(split_file_blocks(user)),
+            assistant_tokens=self.token_estimator.estimate_tokens(assistant),
+            files=tuple(path for path, _, _ in iter_file_blocks(user))
+        ))
+        self.compact()
+
+    def clear(self) -> None:
+        self.turns.clear()
+
+    def compact(self) -> None:
+        """Shrink the history until it fits the budget"""
+        if self.total_tokens <= self.budget_tokens:
+            return
+        before = self.total_tokens
+
+        if self.strategy in ("supersede", "digest"):
+            self._drop_superseded_files()
+        if self.strategy == "digest" and self.total_tokens > self.budget_tokens:
+            self._digest_old_turns()
+        while self.total_tokens > self.budget_tokens and len(self.turns) > 1:
+            self.turns.pop(0)
+            self.evicted_turns += 1
+
+        logger.info(f"Compacted history ({self.strategy}) from {before} to {self.total_tokens} tokens, "
+                    f"{len(self.turns)} turns left")
+
+    def _drop_superseded_files(self) -> None:
+        seen_later = set()
+        for turn in reversed(self.turns):
+            stale = [path for path in turn.files if path in seen_later]
+            seen_later.update(turn.files)
+            if stale:
+                self._replace_turn_user(turn, _omit_file_blocks(turn.user, set(stale)))
+
+    def _digest_old_turns(self) -> None:
+        """Fold the oldest turns into one digest turn, one at a time until the history fits"""
+        while self.total_tokens > self.budget_tokens:
+            start = 1 if self.turns[0].digest else 0
+            if start >= len(self.turns) - 1:
+                break  # Only the digest and the latest turn are left
+            folded = self.turns[:start + 1]
+            self.turns[:start + 1] = [self._make_digest(folded)]
+
+    def _make_digest(self, turns: List[Turn]) -> Turn:
+        lines = []
+        for turn in turns:
+            if turn.digest:
+                lines.extend(turn.user.splitlines()[1:])
+                continue
+            question = _shorten(_without_file_blocks(turn.user), DIGEST_QUESTION_CHARS)
+            answer = _shorten(turn.assistant, DIGEST_ANSWER_CHARS)
+            lines.append(f"- Question: {question}")
+            if turn.files:
+                lines.append(f"  Files: {', '.join(turn.files)}")
+            lines.append(f"  Answer: {answer}")
+        user = "Summary of the earlier conversation:\n" + "\n".join(lines)
+        assistant = "Understood, I will take the earlier conversation into account."
+        return Turn(
+            user=user,
+            assistant=assistant,
+            user_tokens=self.token_estimator.estimate_tokens(user),
+            assistant_tokens=self.token_estimator.estimate_tokens(assistant),
+            digest=True
+        )
+
+    def _replace_turn_user(self, turn: Turn, user: str) -> None:
+        turn.user = user
+        turn.user_tokens = self.token_estimator.estimate_parts(split_file_blocks(user))
+
+
+def _replace_file_blocks(text: str, replacement: Callable[[str], Optional[str]]) -> str:
+    """Replace file blocks for which replacement(path) returns a string, keep the others"""
+    parts = []
+    position = 0
+    for path, start, end in iter_file_blocks(text):
+        new = replacement(path)
+        if new is not None:
+            parts.append(text[position:start])
+            parts.append(new)
+            position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def _omit_file_blocks(text: str, paths: set) -> str:
+    return _replace_file_blocks(
+        text, lambda path: f"### {path}\n[Content omitted, a later message contains a newer version]\n"
+        if path in paths else None)
+
+
+def _without_file_blocks(text: str) -> str:
+    return _replace_file_blocks(text, lambda path: "")
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
@@ -0,0 +1,132 @@
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Optional, Tuple
+
+from config import FILE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# (mtime_ns, size, inode): changes on every write, truncation or replacement of the file
+FileSignature = Tuple[int, int, int]
+
+
+def _entry_size(value) -> int:
+    """Memory of a cached value, including the attributes of result objects"""
+    size = sys.getsizeof(value)
+    if hasattr(value, "__dict__"):
+        size += sum(sys.getsizeof(attribute) for attribute in vars(value).values())
+    return size
+
+
+def file_signature(stat_result: os.stat_result) -> FileSignature:
+    return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+
+@dataclass
+class FileCacheStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class FileContentCache:
+    """
+    Byte-bounded LRU cache of file contents, validated against the file on disk.
+
+    Every lookup stats the file and only returns the cached content if mtime,
+    size and inode still match, so edits (including atomic replace-by-rename)
+    are never served stale. The size of an entry is the memory of the cached
+    object, and the least recently used entries are dropped beyond max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = FILE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.stats = FileCacheStats()
+        self._entries: "OrderedDict[str, Tuple[FileSignature, object, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, path, loader: Callable[[str], object]):
+        """
+        Return the content of path, calling loader(path) on a miss.
+
+        The file is stat'ed before it is loaded; if it changes while being read,
+        the stored signature is already outdated and the next lookup reloads it.
+        """
+        key = os.path.abspath(os.fspath(path))
+        signature = file_signature(os.stat(key))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return entry[1]
+                self._remove(key)
+                self.stats.invalidations += 1
+            self.stats.misses += 1
+
+        content = loader(key)
+        self.put(key, signature, content)
+        return content
+
+    def put(self, path, signature: FileSignature, content) -> None:
+        key = os.path.abspath(os.fspath(path))
+        size = _entry_size(content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, content, size)
+            self.stats.entries += 1
+            self.stats.bytes += size
+            while self.stats.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats.evictions += 1
+
+    def invalidate(self, path) -> None:
+        with self._lock:
+            self._remove(os.path.abspath(os.fspath(path)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.stats.entries = 0
+            self.stats.bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.stats.entries -= 1
+            self.stats.bytes -= entry[2]
+
+    def stats_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {**asdict(self.stats), "hit_rate": self.stats.hit_rate, "max_bytes": self.max_bytes}
+
+
+_file_cache: Optional[FileContentCache] = None
+_file_cache_lock = threading.Lock()
+
+
+def get_file_cache() -> FileContentCache:
+    """Process-wide file content cache shared by all RepoAnalyzer instances"""
+    global _file_cache
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = FileContentCache()
+        return _file_cache
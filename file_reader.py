@@ -0,0 +1,119 @@
+import os
+import mmap
+import codecs
+import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from config import BINARY_SNIFF_BYTES, MMAP_MIN_BYTES, FALLBACK_ENCODINGS
+
+logger = logging.getLogger(__name__)
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# Control characters that do not occur in text files (everything below 0x20 except \t \n \f \r and ESC)
+_CONTROL_BYTES = bytes(set(range(32)) - {9, 10, 12, 13, 27})
+
+
+@dataclass
+class FileReadResult:
+    """Outcome of reading one file for a prompt"""
+    path: str
+    content: str = ""
+    encoding: Optional[str] = None
+    bytes_read: int = 0
+    size: int = 0
+    truncated: bool = False
+    binary: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if there is text content to use"""
+        return self.error is None and not self.binary
+
+
+def detect_bom(block: bytes) -> Optional[str]:
+    for bom, encoding in _BOMS:
+        if block.startswith(bom):
+            return encoding
+    return None
+
+
+def looks_binary(block: bytes) -> bool:
+    """
+    Cheap binary check on the first block of a file.
+
+    A NUL byte, or more than 10% control characters, means binary; this is
+    the heuristic git and grep use.
+    """
+    if not block:
+        return False
+    if b"\0" in block:
+        return True
+    return len(block.translate(None, _CONTROL_BYTES)) < len(block) * 0.9
+
+
+def decode_text(data, truncated: bool = False, bom_encoding: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Decode bytes (or a memoryview) with the first encoding that fits.
+
+    UTF-8 is tried first; a multi-byte character cut off by truncation is
+    dropped instead of failing the whole file. latin-1 at the end of
+    FALLBACK_ENCODINGS accepts any input.
+    """
+    if bom_encoding:
+        return str(data, bom_encoding, errors="replace"), bom_encoding
+
+    for encoding in FALLBACK_ENCODINGS:
+        try:
+            return str(data, encoding), encoding
+        except UnicodeDecodeError as e:
+            if truncated and encoding == "utf-8" and e.reason == "unexpected end of data":
+                return str(data[:e.start], encoding), encoding
+    return str(data, "latin-1", errors="replace"), "latin-1"
+
+
+def read_text_file(path, max_bytes: int) -> FileReadResult:
+    """
+    Read up to max_bytes of a text file.
+
+    The first BINARY_SNIFF_BYTES decide whether the file is binary, in which
+    case nothing more is read. Files of at least MMAP_MIN_BYTES are memory-mapped
+    and decoded straight from the mapping instead of being copied into a
+    buffer first. Errors are reported in the result, never raised.
+    """
+    path = os.fspath(path)
+    result = FileReadResult(path=path)
+    try:
+        with open(path, "rb") as f:
+            result.size = os.fstat(f.fileno()).st_size
+            head = f.read(BINARY_SNIFF_BYTES)
+            bom_encoding = detect_bom(head)
+            if bom_encoding is None and looks_binary(head):
+                result.binary = True
+                return result
+
+            limit = min(result.size, max_bytes)
+            result.truncated = result.size > max_bytes
+            if limit >= MMAP_MIN_BYTES:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)[:limit]
+                    try:
+                        result.content, result.encoding = decode_text(view, result.truncated, bom_encoding)
+                    finally:
+                        view.release()
+            else:
+                data = head[:limit] + (f.read(limit - len(head)) if limit > len(head) else b"")
+                result.content, result.encoding = decode_text(data, result.truncated, bom_encoding)
+            result.bytes_read = limit
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading {path}: {e}")
+        result.error = str(e)
+    return result
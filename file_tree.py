@@ -0,0 +1,209 @@
+import re
+import difflib
+import logging
+import posixpath
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TREE_INDENT = "  "
+TREE_FENCE = "```"
+
+# "- path" lines of the flat candidate list
+LIST_LINE = re.compile(r"^\s*- (\S.*)$", re.MULTILINE)
+# Size or line count appended to a file entry by render_file_tree
+ANNOTATION = re.compile(r"\s+\(\d+(?:\.\d+)? ?(?:B|KB|MB|lines?)\)$")
+# Bullets, numbering, quotes and backticks models put around paths
+ANSWER_DECORATION = re.compile(r"^(?:[-*•+]|\d+[.)])\s+")
+
+# Similarity a near-miss path needs to be mapped to a candidate
+FUZZY_CUTOFF = 0.85
+
+
+class _Node:
+    __slots__ = ("dirs", "files", "count")
+
+    def __init__(self):
+        self.dirs: Dict[str, "_Node"] = {}
+        self.files: List[str] = []
+        self.count = 0  # Files in the whole subtree
+
+
+def render_file_tree(paths: Iterable[str], annotations: Optional[Dict[str, str]] = None) -> str:
+    """
+    Render relative paths as an indented tree.
+
+    Directories end with '/' and their entries are indented below them.
+    Chains of directories with a single subdirectory are collapsed into one
+    line (src/main/java/), and a subtree holding a single file is written as
+    its full remaining path. Entries keep the order in which they first
+    appear in paths, so a ranked candidate list stays roughly ranked.
+
+    Args:
+        paths: File paths relative to the repository root, '/' separated
+        annotations: Optional text per path, appended in parentheses (e.g. "3 KB")
+    """
+    root = _Node()
+    for path in paths:
+        node = root
+        node.count += 1
+        *directories, name = path.split("/")
+        for directory in directories:
+            node = node.dirs.setdefault(directory, _Node())
+            node.count += 1
+        node.files.append(name)
+
+    lines: List[str] = []
+
+    def entry(path: str, label: str) -> str:
+        note = annotations.get(path) if annotations else None
+        return f"{label} ({note})" if note else label
+
+    def render(node: _Node, prefix: str, depth: int) -> None:
+        indent = TREE_INDENT * depth
+        for name in node.files:
+            lines.append(indent + entry(prefix + name, name))
+        for name, child in node.dirs.items():
+            label = name
+            while not child.files and len(child.dirs) == 1:
+                sub_name, child = next(iter(child.dirs.items()))
+                label = f"{label}/{sub_name}"
+            if child.count == 1 and child.files:
+                lines.append(indent + entry(f"{prefix}{label}/{child.files[0]}", f"{label}/{child.files[0]}"))
+                continue
+            lines.append(f"{indent}{label}/")
+            render(child, f"{prefix}{label}/", depth + 1)
+
+    render(root, "", 0)
+    return "\n".join(lines)
+
+
+def parse_file_tree(text: str) -> List[str]:
+    """Full paths of the files in a tree rendered by render_file_tree, in order"""
+    paths = []
+    stack: List[Tuple[int, str]] = []  # (depth, directory path)
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        stripped = line.lstrip(" ")
+        depth = (len(line) - len(stripped)) // len(TREE_INDENT)
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        parent = stack[-1][1] if stack else ""
+        stripped = ANNOTATION.sub("", stripped.rstrip())
+        if stripped.endswith("/"):
+            stack.append((depth, parent + stripped))
+        else:
+            paths.append(parent + stripped)
+    return paths
+
+
+def listed_paths(prompt: str) -> List[str]:
+    """
+    Candidates of a file selection prompt: the fenced tree of
+    format_candidates, or the "- path" lines of the flat list.
+    """
+    start = prompt.find(TREE_FENCE + "\n")
+    if start >= 0:
+        end = prompt.find("\n" + TREE_FENCE, start)
+        if end > start:
+            return parse_file_tree(prompt[start + len(TREE_FENCE) + 1:end])
+    return LIST_LINE.findall(prompt)
+
+
+def format_candidates(paths: List[str], tree: bool = True, annotations: Optional[Dict[str, str]] = None) -> str:
+    """Candidate files for the selection prompt, as a fenced tree or as the flat "- path" list"""
+    if not tree:
+        return "\n".join(f"- {path}" for path in paths)
+    return f"{TREE_FENCE}\n{render_file_tree(paths, annotations)}\n{TREE_FENCE}"
+
+
+def format_size(num_bytes: int) -> str:
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    if num_bytes < 1024 * 1024:
+        return f"{num_bytes / 1024:.0f} KB"
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def count_lines(path) -> int:
+    """Newlines in a file, read in chunks"""
+    lines = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            lines += chunk.count(b"\n")
+    return lines
+
+
+def clean_answer_line(line: str) -> str:
+    """Strip list markers, quotes, annotations and a leading ./ from a path the model returned"""
+    line = ANSWER_DECORATION.sub("", line.strip())
+    line = line.strip("`'\"*, ")
+    line = ANNOTATION.sub("", line)
+    line = line.replace("\\", "/")
+    while line.startswith("./"):
+        line = line[2:]
+    return line.lstrip("/")
+
+
+class PathResolver:
+    """
+    Maps paths returned by the model to real repository paths.
+
+    Tried in order: the exact path, the normalized path (case-insensitive,
+    . and .. resolved), a unique candidate whose path ends with the answer
+    (e.g. a path without its collapsed directory prefix), a unique
+    candidate with the same file name, and finally the most similar
+    candidate above FUZZY_CUTOFF. Only the candidates shown in the prompt are
+    considered for the guesses, so a near miss cannot pick an unrelated file.
+    """
+
+    def __init__(self, all_files: Iterable[str], candidates: Iterable[str]):
+        self.all_files = set(all_files)
+        self.candidates = list(dict.fromkeys(candidates))
+        self._normalized: Dict[str, Optional[str]] = {}
+        for path in self.all_files:
+            key = path.lower()
+            # Ambiguous case-insensitive matches resolve to nothing
+            self._normalized[key] = None if key in self._normalized else path
+        self._by_name: Dict[str, List[str]] = {}
+        for path in self.candidates:
+            self._by_name.setdefault(posixpath.basename(path).lower(), []).append(path)
+
+    def resolve(self, answer: str) -> Optional[str]:
+        path = clean_answer_line(answer)
+        if not path:
+            return None
+        if path in self.all_files:
+            return path
+
+        normalized = posixpath.normpath(path).lower()
+        match = self._normalized.get(normalized)
+        if match:
+            return match
+
+        suffix_matches = [candidate for candidate in self.candidates
+                          if candidate.lower().endswith("/" + normalized)]
+        if len(suffix_matches) == 1:
+            return suffix_matches[0]
+
+        name_matches = self._by_name.get(posixpath.basename(normalized), [])
+        if len(name_matches) == 1:
+            return name_matches[0]
+
+        close = difflib.get_close_matches(path, self.candidates, n=1, cutoff=FUZZY_CUTOFF)
+        return close[0] if close else None
+
+    def resolve_all(self, answers: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """Resolved paths (in answer order, without duplicates) and the answers that matched nothing"""
+        resolved: List[str] = []
+        unresolved: List[str] = []
+        for answer in answers:
+            if not answer.strip():
+                continue
+            path = self.resolve(answer)
+            if path is None:
+                unresolved.append(answer.strip())
+            elif path not in resolved:
+                resolved.append(path)
+        return resolved, unresolved
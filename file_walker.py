@@ -0,0 +1,93 @@
+import os
+import logging
+from typing import Iterator, Iterable, Optional, Set, Tuple
+
+from config import IGNORED_DIRECTORIES
+from ignore_rules import IgnoreMatcher
+
+logger = logging.getLogger(__name__)
+
+
+def walk_repository_entries(root, ignored_directories: Optional[Iterable[str]] = None,
+                            follow_symlinks: bool = False,
+                            ignore_matcher: Optional[IgnoreMatcher] = None
+                            ) -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    Walk a repository with os.scandir and yield (relative path, DirEntry) per file.
+
+    Ignored directories are pruned before they are entered, so nothing below
+    e.g. node_modules or .git is ever listed. Symlinked directories are only
+    entered with follow_symlinks=True, and every directory is visited at most
+    once (keyed by device and inode), so symlink loops terminate.
+
+    With an ignore_matcher, every directory's .gitignore/.dockerignore is
+    compiled once when the directory is listed, and matching directories are
+    pruned just like IGNORED_DIRECTORIES.
+
+    Args:
+        root: Repository root directory
+        ignored_directories: Directory names to prune (defaults to IGNORED_DIRECTORIES)
+        follow_symlinks: Descend into symlinked directories
+        ignore_matcher: Pattern matcher for files and directories, see ignore_rules
+
+    Yields:
+        File paths relative to root, using '/' as separator, with their DirEntry
+    """
+    ignored: Set[str] = set(IGNORED_DIRECTORIES if ignored_directories is None else ignored_directories)
+    root = os.fspath(root)
+
+    visited: Set[Tuple[int, int]] = set()
+    try:
+        root_stat = os.stat(root)
+        visited.add((root_stat.st_dev, root_stat.st_ino))
+    except OSError as e:
+        logger.error(f"Cannot access repository root {root}: {e}")
+        return
+
+    # Explicit stack instead of recursion: deep trees must not hit the recursion limit
+    stack = [(root, "", ignore_matcher)]
+    while stack:
+        dir_path, rel_prefix, matcher = stack.pop()
+        try:
+            with os.scandir(dir_path) as iterator:
+                entries = list(iterator)
+        except OSError as e:
+            logger.warning(f"Cannot read directory {dir_path}: {e}")
+            continue
+
+        if matcher is not None:
+            matcher = matcher.for_directory(dir_path, rel_prefix.rstrip("/"),
+                                            (entry.name for entry in entries))
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_prefix}{entry.name}"
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if entry.name in ignored:
+                        continue
+                    if matcher is not None and matcher.is_ignored(rel_path, is_dir=True):
+                        continue
+                    # One stat per directory; resolves symlinks when following them
+                    target = entry.stat()
+                    key = (target.st_dev, target.st_ino)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    subdirs.append((entry.path, f"{rel_path}/", matcher))
+                elif entry.is_file():
+                    if matcher is None or not matcher.is_ignored(rel_path):
+                        yield rel_path, entry
+            except OSError as e:
+                logger.debug(f"Skipping {entry.path}: {e}")
+
+        # Reverse so directories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+
+def walk_repository(root, ignored_directories: Optional[Iterable[str]] = None,
+                    follow_symlinks: bool = False,
+                    ignore_matcher: Optional[IgnoreMatcher] = None) -> Iterator[str]:
+    """Stream relative file paths, see walk_repository_entries"""
+    for rel_path, _ in walk_repository_entries(root, ignored_directories, follow_symlinks, ignore_matcher):
+        yield rel_path
@@ -162,6 +162,7 @@ const CodeAnalyzer = () => {
           <ConfirmationDialog
             estimatedTokens={confirmation.estimatedTokens}
             estimatedCost={confirmation.estimatedCost}
+            estimate={confirmation.estimate}
             onConfirm={handleConfirmAnalysis}
             onCancel={() => setConfirmation(null)}
           />
@@ -3,6 +3,7 @@ import React from "react";
 const ConfirmationDialog = ({
   estimatedTokens,
   estimatedCost,
+  estimate,
   onConfirm,
   onCancel,
 }) => {
@@ -14,6 +15,14 @@ const ConfirmationDialog = ({
           The analysis requires {estimatedTokens} tokens and costs approximately{" "}
           {estimatedCost.toFixed(2)} €.
         </p>
+        {estimate && (
+          <p className="estimate-range">
+            Depending on the files selected: {Math.round(estimate.total_tokens.low)}
+            {" "}to {Math.round(estimate.total_tokens.high)} tokens,{" "}
+            {estimate.cost.low.toFixed(2)} € to {estimate.cost.high.toFixed(2)} €
+            {" "}({estimate.files} files in the repository).
+          </p>
+        )}
         <div className="dialog-actions">
           <button
             onClick={onConfirm}
@@ -1,6 +1,7 @@
 import axios from 'axios';
 
 const API_BASE_URL = 'http://127.0.0.1:443/api';
+const JOB_POLL_INTERVAL = 1000;
 
 const axiosInstance = axios.create({
     baseURL: API_BASE_URL,
@@ -28,18 +29,31 @@ const api = {
         }
     },
 
-    async confirmAnalysis(requestId) {
+    async confirmAnalysis(requestId, onProgress) {
+        let job;
         try {
             const response = await axiosInstance.post('/confirm', {
                 requestId
             });
-            return response.data;
+            job = response.data;
+            // The analysis runs as a background job; poll until it is finished
+            while (job.status !== 'succeeded' && job.status !== 'failed') {
+                await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+                job = (await axiosInstance.get(`/jobs/${job.jobId}`)).data;
+                if (onProgress) {
+                    onProgress(job);
+                }
+            }
         } catch (error) {
             if (error.response?.data?.error) {
                 throw new Error(error.response.data.error);
             }
             throw new Error(error.message || 'Ein Fehler ist bei der Bestätigung aufgetreten');
         }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Ein Fehler ist bei der Analyse aufgetreten');
+        }
+        return job.result;
     },
 
     async askFollowUpQuestion(question, requestId) {
@@ -0,0 +1,236 @@
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import itertools
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import JOB_CONCURRENCY, JOB_RETENTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+@dataclass
+class Job:
+    """
+    A unit of background work with its progress events.
+
+    Events are appended by the worker and read by any number of pollers or
+    subscribers; wait_for_events blocks (in a thread) until there is
+    something new, wait_for_events_async waits on the caller's event loop.
+    """
+    id: str
+    kind: str
+    priority: int = 0
+    status: str = QUEUED
+    stage: str = QUEUED
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    events: List[dict] = field(default_factory=list)
+    text: str = ""
+    _changed: threading.Condition = field(default_factory=threading.Condition, repr=False)
+    _watchers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = field(default_factory=list, repr=False)
+
+    def progress(self, stage: str, **details) -> None:
+        """Record a progress event, e.g. progress("files_selected", files=[...])"""
+        with self._changed:
+            self.stage = stage
+            if stage == "analysis_delta":
+                self.text += details.get("text", "")
+            self.events.append({"stage": stage, "time": time.time(), **details})
+            self._notify()
+
+    def _set_status(self, status: str, **fields) -> None:
+        with self._changed:
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.events.append({"stage": status, "time": time.time()})
+            self._notify()
+
+    def _notify(self) -> None:
+        """Wake blocked and async waiters; the caller holds _changed"""
+        self._changed.notify_all()
+        for loop, event in self._watchers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Loop already closed, its waiter is gone
+
+    def wait_for_events(self, after: int, timeout: Optional[float] = None) -> List[dict]:
+        """Events after the first `after` ones, waiting up to timeout for new ones"""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > after or self.status in FINISHED_STATES,
+                                   timeout)
+            return self.events[after:]
+
+    async def wait_for_events_async(self, after: int, timeout: Optional[float] = None) -> List[dict]:
+        """Like wait_for_events, but waits on the running event loop instead of holding a thread"""
+        event = asyncio.Event()
+        watcher = (asyncio.get_running_loop(), event)
+        with self._changed:
+            if len(self.events) > after or self.status in FINISHED_STATES:
+                return self.events[after:]
+            self._watchers.append(watcher)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._changed:
+                self._watchers.remove(watcher)
+        with self._changed:
+            return self.events[after:]
+
+    def to_dict(self, include_events: bool = False) -> dict:
+        with self._changed:
+            data = {
+                "jobId": self.id,
+                "kind": self.kind,
+                "priority": self.priority,
+                "status": self.status,
+                "stage": self.stage,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "text": self.text,
+                "result": self.result,
+                "error": self.error,
+            }
+            if include_events:
+                data["events"] = list(self.events)
+            return data
+
+
+JobFunction = Callable[[Job], Awaitable[dict]]
+
+
+class JobQueue:
+    """
+    Priority job queue with a pool of async workers on its own event loop.
+
+    Jobs are submitted from any thread (Flask request threads, the ASGI loop)
+    and run on a background loop that lives as long as the process, so the
+    async Claude connections of that loop are reused across jobs. Higher
+    priority runs first, equal priorities in submission order. Finished jobs
+    are kept for retention_seconds.
+    """
+
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, retention_seconds: float = JOB_RETENTION_SECONDS):
+        self.concurrency = concurrency
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._functions: Dict[str, JobFunction] = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._loop = asyncio.new_event_loop()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="job-queue", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def submit(self, kind: str, function: JobFunction, priority: int = 0) -> Job:
+        """Queue function(job) and return the job right away"""
+        job = Job(id=str(uuid.uuid4()), kind=kind, priority=priority)
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job.id] = job
+            self._functions[job.id] = function
+        entry = (-priority, next(self._sequence), job.id)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, entry)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def queued_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def status_counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Stop the workers; running jobs are cancelled"""
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop)
+            self._thread.join(timeout)
+
+    async def _stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._loop.stop()
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and now - job.finished > self.retention_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [self._loop.create_task(self._worker(index)) for index in range(self.concurrency)]
+        self._loop.call_soon(self._ready.set)
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                function = self._functions.pop(job_id, None)
+            if job is None or function is None:
+                continue
+
+            job._set_status(RUNNING, started=time.time(), stage=RUNNING)
+            try:
+                result = await function(job)
+                job._set_status(SUCCEEDED, result=result, finished=time.time(), stage=SUCCEEDED)
+            except Exception as e:
+                logger.error(f"Job {job_id} ({job.kind}) failed: {e}")
+                job._set_status(FAILED, error=str(e), finished=time.time(), stage=FAILED)
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide job queue, started on first use"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
+
+
+def shutdown_job_queue() -> None:
+    """Stop the process-wide job queue if it was started"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is not None:
+            _job_queue.shutdown()
+            _job_queue = None
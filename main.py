@@ -5,6 +5,8 @@ import asyncio
 import arg_parser
 from color_printer import ColorPrinter
 from repo_analyzer import RepoAnalyzer
+from tracing import start_trace, format_breakdown
+from claude_transport import set_transport_mode
 
 import logging
 
@@ -20,12 +22,44 @@ logger = logging.getLogger(__name__)
 init(autoreset=True)
 
 
+async def print_stream(stream, analyzer: RepoAnalyzer, printer: ColorPrinter) -> str:
+    """Print text deltas as they arrive and return the full text"""
+    chunks = []
+    async for delta in stream:
+        chunks.append(delta)
+        print(f"{Fore.GREEN}{delta}{Style.RESET_ALL}", end="", flush=True)
+    print()
+
+    stats = analyzer.claude_client.last_stream_stats
+    if stats and not stats.cached:
+        printer.info(f"Zeit bis zum ersten Token: {stats.time_to_first_token:.2f}s, "
+                     f"gesamt: {stats.total_seconds:.2f}s")
+    return "".join(chunks)
+
+
 async def main():
     parser = arg_parser.create_argument_parser()
 
     args = parser.parse_args()
     printer = ColorPrinter()
-    analyzer = RepoAnalyzer(args.location, args.project_id)
+    set_transport_mode(args.transport)
+
+    with start_trace("cli") as trace:
+        try:
+            await run(args, printer)
+        finally:
+            if args.profile:
+                printer.highlight("\nPhasen:")
+                for line in format_breakdown(trace):
+                    print(f"  {line}")
+
+
+async def run(args, printer: ColorPrinter):
+    analyzer = RepoAnalyzer(args.location, args.project_id, preselect_k=args.preselect_k,
+                            symbols_only=args.symbols_only, use_cache=not args.no_cache,
+                            token_budget=args.token_budget, batch_concurrency=args.batch_concurrency,
+                            max_files_per_batch=args.batch_max_files,
+                            history_budget=args.history_budget, history_strategy=args.history_strategy)
 
     if args.ignore:
         for pattern in args.ignore:
@@ -41,6 +75,11 @@ async def main():
     printer.highlight(f"Analysiere Repository: {printer.file_path(args.repo_path)}")
     printer.highlight(f"Aufgabe: {args.task}")
 
+    estimate = await analyzer.estimate_pipeline(args.repo_path, args.task)
+    printer.info(f"Geschätzt für Dateiauswahl und Analyse: {estimate.total_tokens.low:,.0f} bis "
+                 f"{estimate.total_tokens.high:,.0f} Token (erwartet {estimate.total_tokens.expected:,.0f}), "
+                 f"${estimate.cost.low:.2f} bis ${estimate.cost.high:.2f}")
+
     # Asynchroner Aufruf für das Finden der relevanten Dateien
     relevant_files = await analyzer.find_relevant_files(args.repo_path, args.task)
 
@@ -54,19 +93,28 @@ async def main():
 
     printer.highlight("\nAnalysiere Änderungen...")
 
-    # Asynchroner Aufruf für die Analyse der Änderungen
-    analysis = await analyzer.analyze_changes(args.repo_path, relevant_files, args.task)
+    if args.no_stream:
+        # Asynchroner Aufruf für die Analyse der Änderungen
+        analysis = await analyzer.analyze_changes(args.repo_path, relevant_files, args.task)
 
-    printer.success("\nEmpfohlene Änderungen:")
-    print(f"{Fore.GREEN}{analysis.recommendations}{Style.RESET_ALL}")
+        printer.success("\nEmpfohlene Änderungen:")
+        print(f"{Fore.GREEN}{analysis.recommendations}{Style.RESET_ALL}")
+    else:
+        printer.success("\nEmpfohlene Änderungen:")
+        await print_stream(analyzer.analyze_changes_stream(args.repo_path, relevant_files, args.task),
+                           analyzer, printer)
 
     if args.interactive:
         while True:
             question = input(f"\n{Fore.CYAN}Nachfrage (oder 'q' zum Beenden): {Style.RESET_ALL}")
             if question.lower() in ['q', 'quit', 'exit']:
                 break
-            response = await analyzer.ask_followup_question(question)  # Asynchroner Aufruf
-            print(f"\n{Fore.GREEN}{response}{Style.RESET_ALL}")
+            if args.no_stream:
+                response = await analyzer.ask_followup_question(question)  # Asynchroner Aufruf
+                print(f"\n{Fore.GREEN}{response}{Style.RESET_ALL}")
+            else:
+                print()
+                response = await print_stream(analyzer.ask_followup_stream(question), analyzer, printer)
 
             # Check if response indicates need for additional files
             if "additional files" in response.lower() or "zusätzliche dateien" in response.lower():
@@ -0,0 +1,248 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from statistics import median
+from typing import Iterable, List, Optional, Tuple
+
+from file_tree import render_file_tree
+from file_walker import walk_repository_entries
+from ignore_rules import IgnoreMatcher
+from repo_index import get_repo_index
+from token_estimator import approximate_tokens_for_size
+from config import (PREFLIGHT_SELECTED_FILES, PREFLIGHT_SNAPSHOT_TTL_SECONDS, PREFLIGHT_CACHE_ENTRIES,
+                    DEFAULT_OUTPUT_TOKENS, MAX_OUTPUT_TOKEN, INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TokenProfile:
+    """Distribution of per-file token counts of one repository snapshot"""
+    snapshot: str
+    files: int
+    exact_files: int  # Counted during earlier analyses, the others are estimated from their size
+    listing_tokens: int  # The "- path" lines of all files in the file selection prompt
+    tree_listing_tokens: int  # All files rendered as a tree, see file_tree
+    median_tokens: int
+    p90_tokens: int
+    mean_tokens: float
+
+    @property
+    def mean_path_tokens(self) -> float:
+        return self.listing_tokens / self.files if self.files else 0.0
+
+    @property
+    def mean_tree_entry_tokens(self) -> float:
+        return self.tree_listing_tokens / self.files if self.files else 0.0
+
+
+@dataclass
+class EstimateRange:
+    low: float
+    expected: float
+    high: float
+
+
+@dataclass
+class PreflightEstimate:
+    """Expected tokens and cost of the file selection plus the analysis that follows"""
+    files: int
+    candidates: int
+    snapshot: str
+    exact_files: int
+    selection_input_tokens: int
+    analysis_input_tokens: EstimateRange
+    output_tokens: EstimateRange
+    total_tokens: EstimateRange
+    cost: EstimateRange
+    batches: EstimateRange
+    seconds: float = 0.0
+    cached: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def percentile(sorted_values: List[int], share: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * share))]
+
+
+class PreflightProfiler:
+    """
+    Token profiles of repositories, cheap enough to answer /api/analyze in
+    well under a second.
+
+    The repository is only walked and stat'ed, nothing is hashed or read:
+    files whose size and mtime still match the repository index contribute
+    the token count stored there when an analysis read them, all others
+    approximate_tokens_for_size. The
+    walk is reused for PREFLIGHT_SNAPSHOT_TTL_SECONDS, and profiles are kept
+    per snapshot (paths, sizes and mtimes) and stored counts, so an unchanged
+    repository is only profiled again after an analysis counted more files.
+    """
+
+    def __init__(self, snapshot_ttl: float = PREFLIGHT_SNAPSHOT_TTL_SECONDS,
+                 cache_entries: int = PREFLIGHT_CACHE_ENTRIES):
+        self.snapshot_ttl = snapshot_ttl
+        self.cache_entries = cache_entries
+        self._recent: "OrderedDict[tuple, Tuple[float, TokenProfile]]" = OrderedDict()
+        self._profiles: "OrderedDict[tuple, TokenProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def profile(self, repo_path, ignore_matcher: Optional[IgnoreMatcher],
+                ignored_directories: Iterable[str], patterns: Tuple[str, ...],
+                max_file_bytes: int) -> Tuple[TokenProfile, bool]:
+        """The token profile of the repository and whether it came from the cache"""
+        repo_path = Path(repo_path).resolve()
+        if not repo_path.is_dir():
+            raise FileNotFoundError(f"Repository path not found: {repo_path}")
+
+        recent_key = (str(repo_path), patterns, max_file_bytes)
+        with self._lock:
+            recent = self._recent.get(recent_key)
+            if recent is not None and time.monotonic() - recent[0] < self.snapshot_ttl:
+                return recent[1], True
+
+        entries = []
+        digest = hashlib.blake2b(digest_size=16)
+        for rel_path, entry in walk_repository_entries(repo_path, ignored_directories,
+                                                       ignore_matcher=ignore_matcher):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((rel_path, stat.st_size, stat.st_mtime_ns))
+            digest.update(f"{rel_path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+        snapshot = digest.hexdigest()
+
+        # Token counts stored by analyses since the last profile make it more exact
+        profile_key = (str(repo_path), snapshot, max_file_bytes, get_repo_index(repo_path).token_count_version)
+        with self._lock:
+            profile = self._profiles.get(profile_key)
+        cached = profile is not None
+        if profile is None:
+            profile = self._build(repo_path, entries, snapshot, max_file_bytes)
+
+        with self._lock:
+            self._profiles[profile_key] = profile
+            self._profiles.move_to_end(profile_key)
+            self._recent[recent_key] = (time.monotonic(), profile)
+            self._recent.move_to_end(recent_key)
+            for cache in (self._profiles, self._recent):
+                while len(cache) > self.cache_entries:
+                    cache.popitem(last=False)
+        return profile, cached
+
+    @staticmethod
+    def _build(repo_path: Path, entries: List[Tuple[str, int, int]], snapshot: str,
+               max_file_bytes: int) -> TokenProfile:
+        indexed = get_repo_index(repo_path).file_stats()
+        max_file_tokens = approximate_tokens_for_size(max_file_bytes)
+        counts = []
+        exact = 0
+        listing_bytes = 0
+        for rel_path, size, mtime_ns in entries:
+            row = indexed.get(rel_path)
+            if row is not None and row.token_count is not None and row.size == size and row.mtime_ns == mtime_ns:
+                tokens = row.token_count
+                exact += 1
+            else:
+                tokens = approximate_tokens_for_size(size)
+            counts.append(min(tokens, max_file_tokens))
+            listing_bytes += len(rel_path.encode("utf-8")) + 3  # "- " and the newline
+
+        counts.sort()
+        profile = TokenProfile(
+            snapshot=snapshot,
+            files=len(counts),
+            exact_files=exact,
+            listing_tokens=approximate_tokens_for_size(listing_bytes),
+            tree_listing_tokens=approximate_tokens_for_size(
+                len(render_file_tree(rel_path for rel_path, _, _ in entries).encode("utf-8"))),
+            median_tokens=int(median(counts)) if counts else 0,
+            p90_tokens=percentile(counts, 0.9),
+            mean_tokens=sum(counts) / len(counts) if counts else 0.0
+        )
+        logger.info(f"Token profile of {repo_path}: {profile.files} files "
+                    f"({profile.exact_files} counted), median {profile.median_tokens} tokens per file")
+        return profile
+
+
+def estimate_pipeline(profile: TokenProfile, selection_template_tokens: int, analysis_template_tokens: int,
+                      file_overhead_tokens: int, history_tokens: int, preselect_k: int, token_budget: int,
+                      max_request_bytes: int, tree_listing: bool = True) -> PreflightEstimate:
+    """
+    Token and cost range of a file selection followed by its analysis.
+
+    The low, expected and high cases assume PREFLIGHT_SELECTED_FILES files of
+    median, mean and 90th percentile size, answers of DEFAULT_OUTPUT_TOKENS
+    (MAX_OUTPUT_TOKEN for the high case) and the batching of ContextPacker:
+    above token_budget the files are analyzed in stateless batches and merged
+    in one more request. Prompt cache discounts are not applied. A tree of
+    preselected candidates shares fewer directories than the tree of all
+    files, so tree listings are estimated on the low side.
+    """
+    candidates = min(profile.files, preselect_k) if preselect_k > 0 else profile.files
+    entry_tokens = profile.mean_tree_entry_tokens if tree_listing else profile.mean_path_tokens
+    selection_input = history_tokens + selection_template_tokens + math.ceil(entry_tokens * candidates)
+    request_tokens = approximate_tokens_for_size(max_request_bytes)
+
+    scenarios = []
+    for files, per_file, answer_tokens in zip(
+            PREFLIGHT_SELECTED_FILES,
+            (profile.median_tokens, profile.mean_tokens, profile.p90_tokens),
+            (DEFAULT_OUTPUT_TOKENS, DEFAULT_OUTPUT_TOKENS, MAX_OUTPUT_TOKEN)):
+        files = min(files, profile.files)
+        selection_output = math.ceil(files * profile.mean_path_tokens)
+        # Every file block also carries its path and fences
+        file_tokens = min(math.ceil(files * (per_file + file_overhead_tokens + profile.mean_path_tokens)),
+                          request_tokens)
+        batches = max(1, math.ceil(file_tokens / token_budget))
+        history = selection_input + selection_output
+        if batches == 1:
+            analysis_input = history + analysis_template_tokens + file_tokens
+            responses = 1
+        else:
+            # Stateless batch requests, then a merge of their answers on top of the history
+            analysis_input = (file_tokens + batches * analysis_template_tokens +
+                              history + analysis_template_tokens + batches * answer_tokens)
+            responses = batches + 1
+        output = selection_output + responses * answer_tokens
+        input_tokens = selection_input + analysis_input
+        scenarios.append((analysis_input, output, input_tokens + output,
+                          input_tokens * INPUT_TOKEN_PRICE + output * OUTPUT_TOKEN_PRICE, batches))
+
+    low, expected, high = scenarios
+    ranges = [EstimateRange(*values) for values in zip(low, expected, high)]
+    return PreflightEstimate(
+        files=profile.files,
+        candidates=candidates,
+        snapshot=profile.snapshot,
+        exact_files=profile.exact_files,
+        selection_input_tokens=selection_input,
+        analysis_input_tokens=ranges[0],
+        output_tokens=ranges[1],
+        total_tokens=ranges[2],
+        cost=ranges[3],
+        batches=ranges[4]
+    )
+
+
+_profiler: Optional[PreflightProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_preflight_profiler() -> PreflightProfiler:
+    """Process-wide profiler, so the API and all analyzers share the cached profiles"""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = PreflightProfiler()
+        return _profiler
@@ -0,0 +1,241 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import threading
+import itertools
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+from config import (CLAUDE_REQUESTS_PER_MINUTE, CLAUDE_INPUT_TOKENS_PER_MINUTE, CLAUDE_OUTPUT_TOKENS_PER_MINUTE,
+                    CLAUDE_MAX_CONCURRENCY, CLAUDE_MIN_CONCURRENCY, CLAUDE_RETRY_BASE_DELAY,
+                    CLAUDE_RETRY_MAX_DELAY)
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first: follow-up questions a user is waiting for, then analyses, then batch work
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+
+# How often waiting requests re-check the limits
+POLL_SECONDS = 0.05
+MAX_WAIT_SLICE = 1.0
+
+# A throttle response halves the concurrency at most once per cooldown
+THROTTLE_COOLDOWN_SECONDS = 5.0
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = CLAUDE_RETRY_BASE_DELAY, cap: float = CLAUDE_RETRY_MAX_DELAY) -> float:
+    """Exponential backoff with full jitter, but never shorter than the server's retry-after"""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+class TokenBucket:
+    """Refills per_minute units evenly over a minute; a per_minute of 0 means unlimited"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available; larger amounts than the capacity wait for a full bucket"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        if not self.unlimited:
+            self._refill(now)
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """Give back (positive) or additionally charge (negative) tokens after the fact"""
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass
+class Reservation:
+    input_tokens: int
+    output_tokens: int
+    priority: int
+
+
+@dataclass
+class RateLimitStats:
+    requests: int = 0
+    throttled: int = 0
+    retries: int = 0
+    waited: int = 0
+    wait_seconds: float = 0.0
+    concurrency_limit: int = 0
+    in_flight: int = 0
+    queued: int = 0
+
+
+class RateLimiter:
+    """
+    Process-wide budget for Claude requests.
+
+    A request reserves one request and its estimated input and output tokens
+    from per-minute token buckets before it is sent, and a concurrency slot.
+    Afterwards the reservation is settled against the reported usage. Waiting
+    requests are served strictly by priority, then in arrival order.
+
+    The concurrency limit adapts: a throttle response halves it (at most once
+    per cooldown) and pauses all requests for the server's retry-after; as
+    many successful requests in a row as the current limit raise it by one,
+    up to max_concurrency.
+
+    State is guarded by a lock, and waiting is done by sleeping, so callers on
+    any thread or event loop share the same budget.
+    """
+
+    def __init__(self, requests_per_minute: int = CLAUDE_REQUESTS_PER_MINUTE,
+                 input_tokens_per_minute: int = CLAUDE_INPUT_TOKENS_PER_MINUTE,
+                 output_tokens_per_minute: int = CLAUDE_OUTPUT_TOKENS_PER_MINUTE,
+                 max_concurrency: int = CLAUDE_MAX_CONCURRENCY, min_concurrency: int = CLAUDE_MIN_CONCURRENCY):
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.output_tokens = TokenBucket(output_tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = max(1, min(min_concurrency, max_concurrency))
+        self.stats = RateLimitStats(concurrency_limit=max_concurrency)
+
+        self._lock = threading.Lock()
+        self._waiting: List[Tuple[int, int]] = []  # Heap of (priority, ticket)
+        self._tickets = itertools.count()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._successes = 0
+
+    async def acquire_async(self, input_tokens: int, output_tokens: int,
+                            priority: int = PRIORITY_NORMAL) -> Reservation:
+        entry, start = self._enqueue(priority)
+        try:
+            while (delay := self._try_acquire(entry, input_tokens, output_tokens)) > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self._dequeue(entry, start)
+        return Reservation(input_tokens, output_tokens, priority)
+
+    def acquire(self, input_tokens: int, output_tokens: int, priority: int = PRIORITY_NORMAL) -> Reservation:
+        """Blocking variant of acquire_async for synchronous callers"""
+        entry, start = self._enqueue(priority)
+        try:
+            while (delay := self._try_acquire(entry, input_tokens, output_tokens)) > 0:
+                time.sleep(delay)
+        finally:
+            self._dequeue(entry, start)
+        return Reservation(input_tokens, output_tokens, priority)
+
+    def release(self, reservation: Reservation, input_tokens: Optional[int] = None,
+                output_tokens: Optional[int] = None, throttled: bool = False,
+                retry_after: Optional[float] = None) -> None:
+        """
+        Free the concurrency slot and settle the token reservation.
+
+        Pass the actual token counts after a response; a failed request gives
+        back its output reservation but keeps the input one, which slows the
+        next attempts down a little.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.stats.in_flight -= 1
+            self.output_tokens.adjust(reservation.output_tokens - (output_tokens or 0))
+            if input_tokens is not None:
+                self.input_tokens.adjust(reservation.input_tokens - input_tokens)
+
+            if throttled:
+                self.stats.throttled += 1
+                self._successes = 0
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                if now - self._last_decrease >= THROTTLE_COOLDOWN_SECONDS:
+                    self._last_decrease = now
+                    limit = max(self.min_concurrency, self.stats.concurrency_limit // 2)
+                    if limit < self.stats.concurrency_limit:
+                        logger.warning(f"Claude throttled, concurrency lowered to {limit}")
+                    self.stats.concurrency_limit = limit
+            elif input_tokens is not None:
+                self._successes += 1
+                if (self._successes >= self.stats.concurrency_limit
+                        and self.stats.concurrency_limit < self.max_concurrency):
+                    self.stats.concurrency_limit += 1
+                    self._successes = 0
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.stats.retries += 1
+
+    def stats_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {**asdict(self.stats), "queued": len(self._waiting)}
+
+    def _enqueue(self, priority: int) -> Tuple[Tuple[int, int], float]:
+        entry = (priority, next(self._tickets))
+        with self._lock:
+            heapq.heappush(self._waiting, entry)
+        return entry, time.monotonic()
+
+    def _dequeue(self, entry: Tuple[int, int], start: float) -> None:
+        waited = time.monotonic() - start
+        with self._lock:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            if waited >= POLL_SECONDS:
+                self.stats.waited += 1
+                self.stats.wait_seconds += waited
+
+    def _try_acquire(self, entry: Tuple[int, int], input_tokens: int, output_tokens: int) -> float:
+        """Take the reservation and return 0, or return how long to wait before trying again"""
+        now = time.monotonic()
+        with self._lock:
+            if self._waiting[0] != entry:
+                return POLL_SECONDS  # Someone with a higher priority or an earlier ticket goes first
+            if self.stats.in_flight >= self.stats.concurrency_limit:
+                return POLL_SECONDS
+            delay = max(self._paused_until - now,
+                        self.requests.wait_time(1, now),
+                        self.input_tokens.wait_time(input_tokens, now),
+                        self.output_tokens.wait_time(output_tokens, now))
+            if delay > 0:
+                return min(max(delay, POLL_SECONDS), MAX_WAIT_SLICE)
+
+            self.requests.take(1, now)
+            self.input_tokens.take(input_tokens, now)
+            self.output_tokens.take(output_tokens, now)
+            heapq.heappop(self._waiting)
+            self.stats.requests += 1
+            self.stats.in_flight += 1
+            return 0.0
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter shared by all Claude clients"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
@@ -0,0 +1,197 @@
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import PRESELECT_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+_IDENTIFIER = re.compile(r"[^\W\d_]\w*")
+_WORD_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+|[^\W\d_]+")
+
+# Path terms describe a file better than any single line of content
+PATH_TERM_WEIGHT = 3
+
+# Term counts per content hash, shared by all rankers of the process
+_TERM_CACHE_SIZE = 200_000
+_term_cache: "OrderedDict[str, Counter]" = OrderedDict()
+_term_cache_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase search terms.
+
+    Identifiers are kept whole and also split at camelCase and snake_case
+    boundaries, so 'ClaudeClient.send_message' yields 'claudeclient', 'claude',
+    'client', 'send_message', 'send' and 'message'.
+    """
+    terms = []
+    for identifier in _IDENTIFIER.findall(text):
+        terms.append(identifier.lower())
+        parts = [part.lower() for chunk in identifier.split("_") for part in _WORD_PART.findall(chunk)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return [term for term in terms if len(term) > 1]
+
+
+@dataclass
+class PreselectionStats:
+    """What the local pre-ranking saved on a file-selection prompt"""
+    total_files: int
+    kept_files: int
+    saved_tokens: int
+    ranking_seconds: float
+    estimated_latency_saved: float
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of documents with an inverted index"""
+
+    def __init__(self, documents: Dict[str, Counter], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = list(documents)
+        self.doc_lengths = [sum(documents[doc_id].values()) for doc_id in self.doc_ids]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for position, doc_id in enumerate(self.doc_ids):
+            for term, frequency in documents[doc_id].items():
+                self.postings.setdefault(term, []).append((position, frequency))
+
+    def idf(self, term: str) -> float:
+        containing = len(self.postings.get(term, ()))
+        total = len(self.doc_ids)
+        return math.log(1 + (total - containing + 0.5) / (containing + 0.5))
+
+    def rank(self, query: str, top_k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Score all documents containing at least one query term.
+
+        Returns:
+            (document id, score) pairs, best first; documents without a match are left out
+        """
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / (self.avg_length or 1))
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if top_k is not None:
+            ranked = ranked[:top_k]
+        return [(self.doc_ids[position], score) for position, score in ranked]
+
+
+def _content_terms(file_path: str, content_hash: Optional[str]) -> Counter:
+    if content_hash:
+        with _term_cache_lock:
+            cached = _term_cache.get(content_hash)
+            if cached is not None:
+                _term_cache.move_to_end(content_hash)
+                return cached
+
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            terms = Counter(tokenize(f.read(PRESELECT_MAX_BYTES)))
+    except OSError as e:
+        logger.debug(f"Cannot read {file_path} for ranking: {e}")
+        terms = Counter()
+
+    if content_hash:
+        with _term_cache_lock:
+            _term_cache[content_hash] = terms
+            if len(_term_cache) > _TERM_CACHE_SIZE:
+                _term_cache.popitem(last=False)
+    return terms
+
+
+class RelevanceRanker:
+    """
+    Lexical pre-ranking of repository files against a task description.
+
+    Each document is the file's path terms plus the terms of its first
+    PRESELECT_MAX_BYTES. Content terms are cached per content hash, and the
+    BM25 index is reused as long as the repository snapshot does not change.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._index: Optional[BM25Index] = None
+        self._fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def build(self, repo_path, files: List[str], hashes: Dict[str, str],
+              fingerprint: Optional[str] = None) -> BM25Index:
+        """Build (or reuse) the BM25 index for the given files"""
+        with self._lock:
+            if fingerprint is not None and fingerprint == self._fingerprint and self._index is not None:
+                return self._index
+
+            root = os.fspath(repo_path)
+
+            def document(rel_path: str) -> Tuple[str, Counter]:
+                terms = _content_terms(os.path.join(root, rel_path), hashes.get(rel_path))
+                path_terms = Counter(tokenize(rel_path.replace("/", " ")))
+                for term in path_terms:
+                    path_terms[term] *= PATH_TERM_WEIGHT
+                return rel_path, terms + path_terms
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                documents = dict(executor.map(document, files))
+
+            self._index = BM25Index(documents)
+            self._fingerprint = fingerprint
+            return self._index
+
+    def preselect(self, repo_path, files: List[str], hashes: Dict[str, str], task: str,
+                  top_k: int, fingerprint: Optional[str] = None) -> List[str]:
+        """
+        Return the top_k files for the task.
+
+        Files are returned unchanged when there are no more than top_k of them.
+        If fewer than top_k files match, the rest is filled up in walk order; if
+        no file shares a single term with the task (e.g. a task in another
+        language than the code), the first top_k files in walk order are kept,
+        so the candidate list stays bounded on large repositories.
+        """
+        if top_k <= 0 or len(files) <= top_k:
+            return files
+        ranked = self.build(repo_path, files, hashes, fingerprint).rank(task, top_k)
+        if not ranked:
+            logger.info(f"No lexical match for the task, keeping the first {top_k} files in walk order")
+            return files[:top_k]
+
+        selected = [rel_path for rel_path, _ in ranked]
+        if len(selected) < top_k:
+            # Fill up with unmatched files in walk order rather than sending fewer candidates
+            chosen = set(selected)
+            selected.extend([rel_path for rel_path in files if rel_path not in chosen][:top_k - len(selected)])
+        return selected
+
+
+_rankers: Dict[str, RelevanceRanker] = {}
+_rankers_lock = threading.Lock()
+
+
+def get_relevance_ranker(repo_path) -> RelevanceRanker:
+    """Process-wide ranker per repository, so its BM25 index is shared across sessions"""
+    key = os.path.realpath(os.fspath(repo_path))
+    with _rankers_lock:
+        ranker = _rankers.get(key)
+        if ranker is None:
+            ranker = RelevanceRanker()
+            _rankers[key] = ranker
+        return ranker
+
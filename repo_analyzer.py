@@ -1,18 +1,40 @@
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict
-from fnmatch import fnmatch
+from typing import AsyncIterator, Callable, List, Dict, Optional
 import asyncio
+import hashlib
+import json
+import os
 import logging
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 from claude_client import ClaudeClient
-from token_estimator import TokenEstimator
-from config import IGNORED_FILE_PATTERNS, IGNORED_DIRECTORIES
+from ignore_rules import IgnoreMatcher
+from repo_index import get_repo_index, ScanResult
+from relevance_ranker import get_relevance_ranker, PreselectionStats
+from symbol_index import get_symbol_index
+from file_cache import get_file_cache
+from file_reader import FileReadResult, read_text_file
+from context_packer import ContextPacker, ContextBatch, format_files, format_file_block
+from file_tree import PathResolver, count_lines, format_candidates, format_size
+from preflight import PreflightEstimate, estimate_pipeline, get_preflight_profiler
+from token_estimator import get_token_estimator
+from single_flight import get_single_flight
+from rate_limiter import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH
+from tracing import span
+from config import (IGNORED_FILE_PATTERNS, IGNORED_DIRECTORIES, DEFAULT_PRESELECT_K,
+                    INPUT_TOKENS_PER_SECOND, ANALYSIS_TOKEN_BUDGET, ANALYSIS_BATCH_CONCURRENCY,
+                    ANALYSIS_MAX_FILES_PER_BATCH, HISTORY_TOKEN_BUDGET, HISTORY_STRATEGY,
+                    FILE_READ_MAX_BYTES, REQUEST_READ_MAX_BYTES, SELECTION_PROMPT_FORMAT,
+                    SELECTION_TREE_ANNOTATION)
 from color_printer import ColorPrinter
 
 logger = logging.getLogger(__name__)
 
+TREE_LAYOUT_NOTE = (" (as a tree: directories end with '/' and their entries are indented below them, "
+                    "a line like 'a/b.py' continues the path of its directory)")
+
 
 @dataclass
 class AnalysisResult:
@@ -22,52 +44,116 @@ class AnalysisResult:
     recommendations: str
 
 
+@dataclass
+class FileSelection:
+    """Outcome of a file selection, shared with identical concurrent selections"""
+    files: List[str]
+    symbol_matches: List[str]
+    preselection: Optional[PreselectionStats]
+    prompt: Optional[str] = None  # The exchange with Claude, None if it was not asked
+    answer: Optional[str] = None
+
+
+@dataclass
+class SharedAnalysis:
+    """Outcome of a change analysis, shared with identical concurrent analyses"""
+    prompt: str
+    recommendations: str
+    batch_count: int
+
+
 class RepoAnalyzer:
-    def __init__(self, location: str, project_id: str):
+    def __init__(self, location: str, project_id: str, preselect_k: int = DEFAULT_PRESELECT_K,
+                 symbols_only: bool = False, use_cache: bool = True,
+                 token_budget: int = ANALYSIS_TOKEN_BUDGET,
+                 batch_concurrency: int = ANALYSIS_BATCH_CONCURRENCY,
+                 max_files_per_batch: int = ANALYSIS_MAX_FILES_PER_BATCH,
+                 history_budget: int = HISTORY_TOKEN_BUDGET, history_strategy: str = HISTORY_STRATEGY,
+                 max_file_bytes: int = FILE_READ_MAX_BYTES, max_request_bytes: int = REQUEST_READ_MAX_BYTES,
+                 selection_format: str = SELECTION_PROMPT_FORMAT,
+                 selection_annotation: str = SELECTION_TREE_ANNOTATION):
         """Initialize RepoAnalyzer with required dependencies"""
-        self.claude_client = ClaudeClient(location, project_id)
-        self.token_estimator = TokenEstimator()
-        self.ignored_patterns = set(IGNORED_FILE_PATTERNS)  # Using set for faster lookups
+        self.claude_client = ClaudeClient(location, project_id, use_cache=use_cache,
+                                          history_budget=history_budget, history_strategy=history_strategy)
+        self.token_estimator = get_token_estimator()
+        self.ignored_patterns: List[str] = list(IGNORED_FILE_PATTERNS)  # Ordered, negations depend on it
+        self._ignore_matcher: Optional[IgnoreMatcher] = None
         self.printer = ColorPrinter()
-        self.file_cache: Dict[str, str] = {}  # Cache for file contents
+        self.file_cache = get_file_cache()  # Shared by all analyzers of the process
         self._executor = ThreadPoolExecutor(max_workers=4)
+        self.last_scan: Optional[ScanResult] = None
+        self.preselect_k = preselect_k
+        self.last_preselection: Optional[PreselectionStats] = None
+        self.symbols_only = symbols_only
+        self.last_symbol_matches: List[str] = []
+        self.context_packer = ContextPacker(self.token_estimator, token_budget, max_files_per_batch)
+        self.batch_concurrency = max(1, batch_concurrency)
+        self.last_batch_count = 0
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.last_file_reads: Dict[str, FileReadResult] = {}
+        self.selection_format = selection_format
+        self.selection_annotation = selection_annotation
+        # Called as progress_callback(stage, **details) at the milestones of find_relevant_files
+        self.progress_callback: Optional[Callable[..., None]] = None
 
     def add_ignore_pattern(self, pattern: str) -> None:
         """Add a new pattern to ignored patterns"""
-        self.ignored_patterns.add(pattern)
+        if pattern not in self.ignored_patterns:
+            self.ignored_patterns.append(pattern)
+            self._ignore_matcher = None
         logger.info(f"Added ignore pattern: {pattern}")
 
-    def should_ignore(self, file_path: Path) -> bool:
+    @property
+    def ignore_matcher(self) -> IgnoreMatcher:
+        """Matcher compiled from the configured and added patterns, built on first use"""
+        if self._ignore_matcher is None:
+            self._ignore_matcher = IgnoreMatcher.from_patterns(self.ignored_patterns)
+        return self._ignore_matcher
+
+    def should_ignore(self, file_path: Path, repo_path: Optional[Path] = None) -> bool:
         """
         Check if a file should be ignored based on patterns and directories.
 
+        Only the configured patterns are considered here; the repository's own
+        .gitignore/.dockerignore files are applied while walking the tree.
+
         Args:
             file_path: Path object representing the file
+            repo_path: Repository root, if file_path is not already relative to it
 
         Returns:
             bool: True if file should be ignored, False otherwise
         """
         try:
+            if repo_path is not None:
+                file_path = file_path.relative_to(repo_path)
+
             # Check if parent directory should be ignored
             if any(parent.name in IGNORED_DIRECTORIES
                    for parent in file_path.parents):
                 return True
 
-            # Check file against ignore patterns
-            return any(fnmatch(str(file_path), pattern)
-                       for pattern in self.ignored_patterns)
+            return self.ignore_matcher.is_path_ignored(file_path.as_posix())
 
         except Exception as e:
             logger.error(f"Error checking ignore status for {file_path}: {e}")
             return True
 
-    async def find_relevant_files(self, repo_path: str, task_description: str, approve=False) -> List[str]:
+    async def find_relevant_files(self, repo_path: str, task_description: str, approve=False,
+                                  preselect_k: Optional[int] = None) -> List[str]:
         """
         Find files relevant to the given task asynchronously.
 
         Args:
             repo_path: Path to the repository
             task_description: Description of the task
+            preselect_k: Send only the K best BM25 candidates to Claude
+                (defaults to self.preselect_k, 0 sends all files)
+
+        Code mentions in the task (e.g. 'ClaudeClient.send_message') are resolved
+        with the symbol index first. Their files and direct import neighbours are
+        always offered to Claude; with symbols_only they are returned right away.
 
         Returns:
             List of relevant file paths
@@ -82,19 +168,46 @@ class RepoAnalyzer:
         if not repo_path.exists():
             raise FileNotFoundError(f"Repository path not found: {repo_path}")
 
-        # Collect all files asynchronously
-        all_files = []
-        for file_path in repo_path.rglob('*'):
-            if file_path.is_file() and not self.should_ignore(file_path):
-                rel_path = file_path.relative_to(repo_path)
-                all_files.append(str(rel_path))
+        scan = await self.scan_repository(repo_path)
+        all_files = scan.files
+        self._report_progress("walk_done", files=len(all_files), seconds=scan.duration)
 
         if not all_files:
             logger.warning("No files found in repository")
             return []
 
+        # Identical selections running at the same time (same snapshot, task, options and history) share one
+        preselect_k = self.preselect_k if preselect_k is None else preselect_k
+        key = (str(repo_path.resolve()), scan.fingerprint, task_description, preselect_k, self.symbols_only,
+               self.selection_format, self.selection_annotation, self._history_key())
+        selection, joined = await get_single_flight("file_selection").run(
+            key, lambda: self._select_files(repo_path, all_files, task_description, preselect_k, approve)
+        )
+        if joined:
+            self._adopt_file_selection(selection)
+        self._report_progress("files_selected", files=selection.files)
+        return selection.files
+
+    async def _select_files(self, repo_path: Path, all_files: List[str], task_description: str,
+                            preselect_k: int, approve=False) -> FileSelection:
+        hashes = await asyncio.get_event_loop().run_in_executor(
+            self._executor, get_repo_index(repo_path).get_hashes, all_files
+        )
+        with span("symbol_index"):
+            symbol_matches = await self._resolve_symbol_mentions(repo_path, all_files, hashes, task_description)
+        if symbol_matches and self.symbols_only:
+            logger.info(f"Resolved {len(symbol_matches)} files from symbols, skipping Claude")
+            self.last_preselection = None  # Nothing was ranked on this path
+            return FileSelection(symbol_matches, symbol_matches, None)
+
+        with span("preselect"):
+            candidates = await self._preselect_files(repo_path, all_files, hashes, task_description, preselect_k)
+        matched = set(symbol_matches)
+        candidates = symbol_matches + [f for f in candidates if f not in matched]
+        self._report_progress("candidates_ranked", candidates=len(candidates))
+
         # Create context for Claude
-        files_context = "\n".join([f"- {f}" for f in all_files])
+        files_context = await self._format_candidates(repo_path, candidates)
         prompt = self._create_file_selection_prompt(task_description, files_context)
         print("Prompt:", prompt)
 
@@ -103,47 +216,271 @@ class RepoAnalyzer:
             response = await self._async_claude_query(prompt, auto_approve=approve)
             relevant_files = response.get("content").strip().splitlines()
 
-            # Validate returned files exist in repository
-            validated_files = [f.strip() for f in relevant_files if f.strip() in all_files]
+            # Map the answer to real files, tolerating near misses of the candidates
+            validated_files, unresolved = PathResolver(all_files, candidates).resolve_all(relevant_files)
+            if unresolved:
+                logger.warning(f"Could not map {len(unresolved)} answered paths to files: {', '.join(unresolved)}")
 
             #logger.info(f"Found {len(validated_files)} relevant files")
-            return validated_files
+            return FileSelection(validated_files, self.last_symbol_matches, self.last_preselection,
+                                 prompt=prompt, answer=response.get("content"))
 
         except Exception as e:
             logger.error(f"Error during file analysis: {e}")
             raise
 
-    async def read_file_contents(self, repo_path: Path, files: List[str]) -> Dict[str, str]:
+    async def _format_candidates(self, repo_path: Path, candidates: List[str]) -> str:
+        """The candidate list of the selection prompt, see SELECTION_PROMPT_FORMAT"""
+        if self.selection_format != "tree":
+            return format_candidates(candidates, tree=False)
+
+        annotations = None
+        if self.selection_annotation != "none":
+            annotations = await asyncio.get_event_loop().run_in_executor(
+                self._executor, self._candidate_annotations, repo_path, candidates
+            )
+        files_context = format_candidates(candidates, annotations=annotations)
+        flat_tokens = self.token_estimator.approximate_tokens(format_candidates(candidates, tree=False))
+        tree_tokens = self.token_estimator.approximate_tokens(files_context)
+        logger.info(f"Candidate tree: ~{tree_tokens} tokens instead of ~{flat_tokens} for the flat list")
+        return files_context
+
+    def _candidate_annotations(self, repo_path: Path, candidates: List[str]) -> Dict[str, str]:
+        """Size (from the repository index) or line count per candidate"""
+        annotations = {}
+        if self.selection_annotation == "size":
+            index = get_repo_index(repo_path)
+            for rel_path in candidates:
+                row = index.get(rel_path)
+                if row is not None:
+                    annotations[rel_path] = format_size(row.size)
+        elif self.selection_annotation == "lines":
+            for rel_path in candidates:
+                try:
+                    annotations[rel_path] = f"{count_lines(repo_path / rel_path)} lines"
+                except OSError:
+                    continue
+        return annotations
+
+    def _adopt_file_selection(self, selection: FileSelection) -> None:
+        """Take over the state a joined file selection left on the analyzer that ran it"""
+        self.last_symbol_matches = selection.symbol_matches
+        self.last_preselection = selection.preselection
+        if selection.prompt is not None:
+            self.claude_client.history.append(selection.prompt, selection.answer)
+
+    def _history_key(self) -> str:
+        """Hash of the conversation so far; Claude's answers depend on it"""
+        messages = json.dumps(self.claude_client.history.messages(), sort_keys=True)
+        return hashlib.blake2b(messages.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _analysis_key(self, repo_path: Path, files: List[str], task_description: str) -> tuple:
+        return (str(Path(repo_path).resolve()), self.last_scan.fingerprint if self.last_scan else None,
+                task_description, tuple(files), self.context_packer.budget_tokens,
+                self.context_packer.max_files_per_batch, self.max_file_bytes, self.max_request_bytes,
+                self._history_key())
+
+    def _adopt_analysis(self, shared: SharedAnalysis) -> None:
+        """Take over the state a joined analysis left on the analyzer that ran it"""
+        self.last_batch_count = shared.batch_count
+        self.claude_client.history.append(shared.prompt, shared.recommendations)
+
+    def _report_progress(self, stage: str, **details) -> None:
+        if self.progress_callback is not None:
+            self.progress_callback(stage, **details)
+
+    async def scan_repository(self, repo_path) -> ScanResult:
+        """
+        Update the persistent index of the repository and return its file list.
+
+        Ignored directories and patterns are applied while walking; only files
+        whose size or mtime changed since the last scan are read. Concurrent
+        scans of the same repository with the same patterns share one walk.
         """
-        Read contents of specified files asynchronously with caching.
+        index = get_repo_index(repo_path)
+        key = (str(Path(repo_path).resolve()), tuple(self.ignored_patterns))
+        with span("scan"):
+            self.last_scan, _ = await get_single_flight("scan").run(
+                key,
+                lambda: asyncio.get_event_loop().run_in_executor(
+                    self._executor,
+                    index.scan,
+                    self.ignore_matcher,
+                    IGNORED_DIRECTORIES
+                )
+            )
+        return self.last_scan
+
+    async def _resolve_symbol_mentions(self, repo_path: Path, all_files: List[str], hashes: Dict[str, str],
+                                       task_description: str) -> List[str]:
+        """Files defining symbols named in the task, plus their import neighbours"""
+        index = get_symbol_index(repo_path)
+        fingerprint = self.last_scan.fingerprint if self.last_scan else None
+        await asyncio.get_event_loop().run_in_executor(
+            self._executor,
+            index.build,
+            all_files,
+            hashes,
+            fingerprint
+        )
+        self.last_symbol_matches = index.resolve_mentions(task_description)
+        if self.last_symbol_matches:
+            logger.info(f"Symbol index matched: {', '.join(self.last_symbol_matches)}")
+        return self.last_symbol_matches
+
+    async def _preselect_files(self, repo_path: Path, all_files: List[str], hashes: Dict[str, str],
+                               task_description: str, top_k: int) -> List[str]:
+        """Rank files locally with BM25 and keep the top_k, recording what that saved"""
+        self.last_preselection = None
+        if top_k <= 0 or len(all_files) <= top_k:
+            return all_files
+
+        start = time.perf_counter()
+        ranker = get_relevance_ranker(repo_path)
+        candidates = await asyncio.get_event_loop().run_in_executor(
+            self._executor,
+            lambda: ranker.preselect(repo_path, all_files, hashes, task_description, top_k,
+                                     self.last_scan.fingerprint if self.last_scan else None)
+        )
+        ranking_seconds = time.perf_counter() - start
+
+        kept = set(candidates)
+        dropped_context = "\n".join(f"- {f}" for f in all_files if f not in kept)
+        saved_tokens = self.token_estimator.approximate_tokens(dropped_context)
+        self.last_preselection = PreselectionStats(
+            total_files=len(all_files),
+            kept_files=len(candidates),
+            saved_tokens=saved_tokens,
+            ranking_seconds=ranking_seconds,
+            estimated_latency_saved=saved_tokens / INPUT_TOKENS_PER_SECOND - ranking_seconds
+        )
+        self.printer.info(
+            f"Vorauswahl: {len(candidates)} von {len(all_files)} Dateien, "
+            f"~{saved_tokens:,} Token gespart, Ranking {ranking_seconds:.2f}s, "
+            f"geschätzte Latenzersparnis {self.last_preselection.estimated_latency_saved:.1f}s"
+        )
+        return candidates
+
+    async def estimate_pipeline(self, repo_path, task_description: str) -> PreflightEstimate:
+        """
+        Pre-flight estimate of the tokens and cost of find_relevant_files and
+        the analyze_changes that follows, without reading or hashing files.
+
+        Raises:
+            FileNotFoundError: If repository path doesn't exist
+        """
+        start = time.perf_counter()
+        with span("preflight"):
+            profile, cached = await asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                get_preflight_profiler().profile,
+                repo_path,
+                self.ignore_matcher,
+                IGNORED_DIRECTORIES,
+                tuple(self.ignored_patterns),
+                self.max_file_bytes
+            )
+            estimator = self.token_estimator
+            estimate = estimate_pipeline(
+                profile,
+                selection_template_tokens=estimator.estimate_tokens(
+                    self._create_file_selection_prompt(task_description, "")),
+                analysis_template_tokens=estimator.estimate_tokens(
+                    self._create_analysis_prompt(task_description, {})),
+                file_overhead_tokens=estimator.estimate_tokens(format_file_block("", "")),
+                history_tokens=self.claude_client.history.total_tokens,
+                preselect_k=self.preselect_k,
+                token_budget=self.context_packer.budget_tokens,
+                max_request_bytes=self.max_request_bytes,
+                tree_listing=self.selection_format == "tree"
+            )
+        estimate.seconds = time.perf_counter() - start
+        estimate.cached = cached
+        return estimate
+
+    async def read_file_contents(self, repo_path: Path, files: List[str]) -> Dict[str, FileReadResult]:
         """
+        Read the specified files for a prompt.
 
-        tasks = []
+        Binary files are recognised from their first block and not read any
+        further. Each file is limited to max_file_bytes and all files together
+        to max_request_bytes, handed out in the given order. With the default
+        FILE_READ_MAX_BYTES, results come from the process-wide file cache as
+        long as the file's mtime, size and inode are unchanged.
 
-        async def read_file(rel_path: str) -> tuple[str, str]:
-            if rel_path in self.file_cache:
-                return rel_path, self.file_cache[rel_path]
+        Returns:
+            FileReadResult per file path; read errors are reported there, not raised
+        """
+        loop = asyncio.get_event_loop()
+        allowances = await loop.run_in_executor(self._executor, self._byte_allowances, repo_path, files)
 
+        async def read_file(rel_path: str, allowance: int) -> tuple[str, FileReadResult]:
             file_path = repo_path / rel_path
+            if allowance <= 0:
+                return rel_path, FileReadResult(path=str(file_path), truncated=True)
             try:
-                content = await self._read_file_async(file_path)
-                self.file_cache[rel_path] = content
-                return rel_path, content
-            except Exception as e:
+                # The shared cache holds contents read with the default limit only, keyed by path alone
+                if allowance == self.max_file_bytes == FILE_READ_MAX_BYTES:
+                    result = await loop.run_in_executor(
+                        self._executor, self.file_cache.read, file_path,
+                        lambda path: read_text_file(path, self.max_file_bytes)
+                    )
+                else:
+                    # Cut short by the request limit or read with another limit, not cached
+                    result = await loop.run_in_executor(self._executor, read_text_file, file_path, allowance)
+            except OSError as e:
                 logger.error(f"Error reading {file_path}: {e}")
-                return rel_path, ""
-
-        for file in files:
-            tasks.append(read_file(file))
-
-        results = await asyncio.gather(*tasks)
-        return dict(results)
+                result = FileReadResult(path=str(file_path), error=str(e))
+            return rel_path, result
+
+        with span("read_files"):
+            results = await asyncio.gather(*(read_file(rel_path, allowances[rel_path]) for rel_path in files))
+        self.last_file_reads = dict(results)
+        return self.last_file_reads
+
+    def _byte_allowances(self, repo_path: Path, files: List[str]) -> Dict[str, int]:
+        """Bytes each file may contribute, so that all files together stay within max_request_bytes"""
+        remaining = self.max_request_bytes
+        allowances = {}
+        for rel_path in files:
+            allowance = min(self.max_file_bytes, remaining)
+            allowances[rel_path] = allowance
+            try:
+                remaining -= min(os.stat(repo_path / rel_path).st_size, allowance)
+            except OSError:
+                pass  # Reported when the file is read
+        return allowances
+
+    def _prompt_contents(self, results: Dict[str, FileReadResult]) -> Dict[str, str]:
+        """Text for the prompt per file, leaving out binary and unreadable files"""
+        contents = {}
+        skipped = []
+        for rel_path, result in results.items():
+            if result.binary:
+                skipped.append(f"{rel_path} (binär)")
+            elif result.error:
+                skipped.append(f"{rel_path} ({result.error})")
+            elif result.truncated and not result.bytes_read:
+                skipped.append(f"{rel_path} (Byte-Limit der Anfrage erreicht)")
+            elif result.truncated:
+                contents[rel_path] = (result.content +
+                                      f"\n... [truncated after {result.bytes_read} of {result.size} bytes]\n")
+            else:
+                contents[rel_path] = result.content
+        if skipped:
+            self.printer.warning(f"Nicht an Claude gesendet: {', '.join(skipped)}")
+        return contents
 
     async def analyze_changes(self, repo_path: str, files: List[str],
                               task_description: str) -> AnalysisResult:
         """
         Analyze required changes for the given task and files.
 
+        If the file contents exceed the token budget, they are split into
+        batches that are analyzed concurrently (without touching the
+        conversation history), and a final request merges the per-batch
+        recommendations. Only that final exchange is kept for follow-ups.
+
         Args:
             repo_path: Repository path
             files: List of files to analyze
@@ -155,70 +492,185 @@ class RepoAnalyzer:
         logger.info("Starting change analysis...")
         repo_path = Path(repo_path)
 
-        files_content = await self.read_file_contents(repo_path, files)
-        prompt = self._create_analysis_prompt(task_description, files_content)
+        async def analyze() -> SharedAnalysis:
+            reads = await self.read_file_contents(repo_path, files)
+            files_content = self._prompt_contents(reads)
+            content_tokens = await self._content_tokens(repo_path, reads)
+            prompt = await self._prepare_analysis_prompt(task_description, files_content, content_tokens)
+            response = await self._async_claude_query(prompt, auto_approve=False)
+            return SharedAnalysis(prompt, response.get("content"), self.last_batch_count)
 
         try:
-            response = await self._async_claude_query(prompt, auto_approve=False)
+            # Identical analyses running at the same time share one
+            shared, joined = await get_single_flight("analysis").run(
+                self._analysis_key(repo_path, files, task_description), analyze
+            )
+            if joined:
+                self._adopt_analysis(shared)
             return AnalysisResult(
                 task=task_description,
                 files=files,
-                recommendations=response.get("content")
+                recommendations=shared.recommendations
             )
         except Exception as e:
             logger.error(f"Error during change analysis: {e}")
             raise
 
+    async def analyze_changes_stream(self, repo_path: str, files: List[str],
+                                     task_description: str) -> AsyncIterator[str]:
+        """
+        Like analyze_changes, but yield the recommendations as text deltas.
+
+        Timing of the stream is available afterwards in
+        claude_client.last_stream_stats. A call that joins an identical
+        analysis already in flight gets the recommendations in one piece once
+        that analysis is done.
+        """
+        logger.info("Starting streamed change analysis...")
+        flight = get_single_flight("analysis").begin(self._analysis_key(repo_path, files, task_description))
+        if not flight.leader:
+            logger.info("Coalesced analysis call with one already in flight")
+            shared = await flight.wait()
+            self._adopt_analysis(shared)
+            yield shared.recommendations
+            return
+
+        chunks = []
+        try:
+            reads = await self.read_file_contents(Path(repo_path), files)
+            files_content = self._prompt_contents(reads)
+            content_tokens = await self._content_tokens(Path(repo_path), reads)
+            # With several batches only the merging request is streamed
+            prompt = await self._prepare_analysis_prompt(task_description, files_content, content_tokens)
+            async for delta in self.claude_client.stream_message_async(prompt):
+                chunks.append(delta)
+                yield delta
+        except Exception as e:
+            logger.error(f"Error during change analysis: {e}")
+            flight.fail(e)
+            raise
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        flight.resolve(SharedAnalysis(prompt, "".join(chunks), self.last_batch_count))
+
+    async def _content_tokens(self, repo_path: Path, reads: Dict[str, FileReadResult]) -> Dict[str, int]:
+        """
+        Token counts of the files read in full, from the repository index or
+        counted now and stored there, so later estimates of these files are exact.
+        """
+        complete = {rel_path: result for rel_path, result in reads.items()
+                    if result.ok and not result.truncated}
+        if not complete:
+            return {}
+        with span("estimate_tokens"):
+            return await asyncio.to_thread(
+                get_repo_index(repo_path).token_counts, list(complete), self.token_estimator,
+                {rel_path: result.content for rel_path, result in complete.items()},
+                {rel_path: result.size for rel_path, result in complete.items()}
+            )
+
+    async def _prepare_analysis_prompt(self, task: str, files_content: Dict[str, str],
+                                       content_tokens: Optional[Dict[str, int]] = None) -> str:
+        """
+        Pack the files into the token budget and return the prompt for the final request.
+
+        A single batch gives the usual analysis prompt. Otherwise all batches
+        are analyzed first and the returned prompt merges their results.
+        """
+        with span("pack_context"):
+            batches = await asyncio.to_thread(self.context_packer.pack, files_content, content_tokens)
+        self.last_batch_count = len(batches)
+        if len(batches) <= 1:
+            return self._create_analysis_prompt(task, batches[0].files if batches else files_content)
+
+        self.printer.info(
+            f"Dateien passen nicht in {self.context_packer.budget_tokens:,} Token, "
+            f"Analyse in {len(batches)} Teilen ({self.batch_concurrency} parallel)"
+        )
+        with span("batch_analysis"):
+            partial_results = await self._analyze_batches(task, batches)
+        return self._create_merge_prompt(task, partial_results)
+
+    async def _analyze_batches(self, task: str, batches: List[ContextBatch]) -> List[str]:
+        """Analyze all batches concurrently, at most batch_concurrency at a time"""
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def analyze(index: int, batch: ContextBatch) -> str:
+            prompt = self._create_batch_analysis_prompt(task, batch.files, index + 1, len(batches))
+            async with semaphore:
+                logger.info(f"Analyzing batch {index + 1}/{len(batches)} "
+                            f"({len(batch.files)} files, ~{batch.tokens} tokens)")
+                response = await self.claude_client.send_message_async(prompt, stateless=True,
+                                                                       priority=PRIORITY_BATCH)
+            return response["content"]
+
+        return await asyncio.gather(*(analyze(index, batch) for index, batch in enumerate(batches)))
+
     async def ask_followup_question(self, question: str) -> str:
         """Handle follow-up questions asynchronously"""
         try:
-            response = await self._async_claude_query(question, auto_approve=False)
+            response = await self._async_claude_query(question, auto_approve=False, priority=PRIORITY_INTERACTIVE)
             return response["content"]
         except Exception as e:
             logger.error(f"Error during follow-up question: {e}")
             raise
 
+    async def ask_followup_stream(self, question: str) -> AsyncIterator[str]:
+        """Handle follow-up questions, yielding the answer as text deltas"""
+        try:
+            async for delta in self.claude_client.stream_message_async(question, priority=PRIORITY_INTERACTIVE):
+                yield delta
+        except Exception as e:
+            logger.error(f"Error during follow-up question: {e}")
+            raise
+
     def _create_file_selection_prompt(self, task: str, files: str) -> str:
         """Create prompt for file selection"""
+        layout = TREE_LAYOUT_NOTE if self.selection_format == "tree" else ""
         return f"""Given the following files in a repository and this task: "{task}"
 
-        Files:
-        {files}
+Files{layout}:
+{files}
 
-        Which files are most likely relevant for this task? Return only the filenames separated by newlines.
-        """
+Which files are most likely relevant for this task? Return only the full relative paths of the files, one per line.
+"""
 
     def _create_analysis_prompt(self, task: str, files_content: Dict[str, str]) -> str:
         """Create prompt for change analysis"""
         return f"""Given these files and this task: "{task}"
 
-        Files:
-        {files_content}
-
-        What changes should be made to accomplish this task? Provide specific code modifications for each file.
-        """
-
-    async def _async_claude_query(self, prompt: str, auto_approve=False) -> dict:
-        """Wrapper for async Claude queries"""
-        return self.claude_client.send_message(prompt)
-
-    async def _read_file_async(self, file_path: Path) -> str:
-        """Read file contents asynchronously"""
-        try:
-            return await asyncio.get_event_loop().run_in_executor(
-                self._executor,
-                self._read_file_sync,
-                file_path
-            )
-        except Exception as e:
-            logger.error(f"Error reading file {file_path}: {e}")
-            raise
-
-    @staticmethod
-    def _read_file_sync(file_path: Path) -> str:
-        """Synchronous file reading helper"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+Files:
+{format_files(files_content)}
+What changes should be made to accomplish this task? Provide specific code modifications for each file.
+"""
+
+    def _create_batch_analysis_prompt(self, task: str, files_content: Dict[str, str],
+                                      batch_number: int, batch_count: int) -> str:
+        """Create prompt for the analysis of one part of a large file selection"""
+        return f"""This is part {batch_number} of {batch_count} of the files relevant for this task: "{task}"
+
+Files:
+{format_files(files_content)}
+What changes should be made to these files to accomplish the task? Provide specific code modifications for each file.
+Mention assumptions about code that is not shown, it may be part of another batch.
+"""
+
+    def _create_merge_prompt(self, task: str, partial_results: List[str]) -> str:
+        """Create prompt that merges the per-batch recommendations"""
+        parts = "\n\n".join(f"## Part {number}\n{result}" for number, result in enumerate(partial_results, 1))
+        return f"""The files for this task: "{task}" were analyzed in {len(partial_results)} parts.
+
+Recommendations per part:
+{parts}
+
+Merge these into one consistent set of changes. Resolve contradictions and assumptions between the parts, \
+drop duplicates and provide the specific code modifications for each file.
+"""
+
+    async def _async_claude_query(self, prompt: str, auto_approve=False, priority: int = PRIORITY_NORMAL) -> dict:
+        """Wrapper for async Claude queries, does not block the event loop"""
+        return await self.claude_client.send_message_async(prompt, priority=priority)
 
     def __del__(self):
         """Cleanup resources"""
@@ -0,0 +1,298 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from config import CACHE_DIR
+from file_walker import walk_repository_entries
+from ignore_rules import IgnoreMatcher
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files modified this close to the scan may still change within the same mtime
+# tick; they are stored without mtime so the next scan hashes them again
+RACY_WINDOW_NS = 2_000_000_000
+
+# Paths per "WHERE path IN (...)" query, below SQLite's limit of bound parameters
+PATH_QUERY_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    token_count INTEGER
+)
+"""
+
+
+@dataclass
+class IndexedFile:
+    """One row of the repository index"""
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: str
+    token_count: Optional[int] = None
+
+
+@dataclass
+class ScanResult:
+    """Outcome of an index scan"""
+    files: List[str]
+    fingerprint: str
+    added: int = 0
+    changed: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    duration: float = 0.0
+    hashed_paths: List[str] = field(default_factory=list)
+
+
+def hash_file(file_path: str) -> str:
+    """Content hash of a file, read in chunks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RepoIndex:
+    """
+    On-disk index of a repository's files, stored as SQLite under CACHE_DIR.
+
+    The first scan hashes every file. Later scans only stat the tree and re-hash
+    files whose size or mtime changed, so an unchanged repository is rescanned
+    without reading a single file. The database is keyed by the absolute repo
+    path, so the CLI and the API server share it.
+    """
+
+    def __init__(self, repo_path, cache_dir: str = CACHE_DIR, hash_workers: int = 8):
+        self.repo_path = Path(repo_path).resolve()
+        repo_key = hashlib.sha1(str(self.repo_path).encode("utf-8")).hexdigest()[:16]
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, f"index-{repo_key}.sqlite")
+        self.hash_workers = hash_workers
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self.last_scan: Optional[ScanResult] = None
+        # Bumped whenever token counts are stored, so profiles built from the old counts can be told apart
+        self.token_count_version = 0
+
+    def scan(self, ignore_matcher: Optional[IgnoreMatcher] = None,
+             ignored_directories: Optional[Iterable[str]] = None) -> ScanResult:
+        """
+        Bring the index up to date with the working tree.
+
+        Args:
+            ignore_matcher: Matcher applied while walking, see ignore_rules
+            ignored_directories: Directory names to prune
+
+        Returns:
+            ScanResult with the current file list and change counts
+        """
+        with self._lock:
+            start = time.perf_counter()
+            scan_start_ns = time.time_ns()
+            known = {row[0]: (row[1], row[2], row[3]) for row in
+                     self._conn.execute("SELECT path, size, mtime_ns, content_hash FROM files")}
+
+            files: List[str] = []
+            stale = []
+            for rel_path, entry in walk_repository_entries(self.repo_path, ignored_directories,
+                                                           ignore_matcher=ignore_matcher):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append(rel_path)
+                entry = known.get(rel_path)
+                if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                    stale.append((rel_path, stat.st_size, stat.st_mtime_ns))
+
+            hashes = self._hash_files([rel_path for rel_path, _, _ in stale])
+
+            result = ScanResult(files=files, fingerprint="")
+            rows = []
+            for rel_path, size, mtime_ns in stale:
+                content_hash = hashes.get(rel_path)
+                if content_hash is None:
+                    continue
+                if mtime_ns >= scan_start_ns - RACY_WINDOW_NS:
+                    mtime_ns = -1
+                rows.append((rel_path, size, mtime_ns, content_hash))
+                previous = known.get(rel_path)
+                if previous is None:
+                    result.added += 1
+                elif previous[2] != content_hash:
+                    result.changed += 1
+            result.hashed_paths = [row[0] for row in rows]
+
+            seen = set(files)
+            removed = [(path,) for path in known if path not in seen]
+            result.removed = len(removed)
+            result.unchanged = len(files) - result.added - result.changed
+
+            self._conn.executemany(
+                """INSERT INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET
+                       size = excluded.size,
+                       mtime_ns = excluded.mtime_ns,
+                       token_count = CASE WHEN files.content_hash = excluded.content_hash
+                                          THEN files.token_count ELSE NULL END,
+                       content_hash = excluded.content_hash""",
+                rows
+            )
+            self._conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            self._conn.commit()
+
+            current = {path: entry[2] for path, entry in known.items()}
+            current.update(hashes)
+            result.fingerprint = self._fingerprint(files, current)
+            result.duration = time.perf_counter() - start
+            self.last_scan = result
+
+        logger.info(f"Index scan of {self.repo_path}: {len(files)} files, "
+                    f"{result.added} added, {result.changed} changed, {result.removed} removed "
+                    f"in {result.duration:.3f}s")
+        return result
+
+    def _hash_files(self, rel_paths: List[str]) -> Dict[str, str]:
+        def hash_one(rel_path: str):
+            try:
+                return rel_path, hash_file(os.path.join(self.repo_path, rel_path))
+            except OSError as e:
+                logger.debug(f"Cannot hash {rel_path}: {e}")
+                return rel_path, None
+
+        if len(rel_paths) < 64:
+            results = map(hash_one, rel_paths)
+        else:
+            with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+                results = list(executor.map(hash_one, rel_paths))
+        return {rel_path: content_hash for rel_path, content_hash in results if content_hash}
+
+    @staticmethod
+    def _fingerprint(files: List[str], hashes: Dict[str, str]) -> str:
+        """Snapshot id over the (path, content hash) pairs of the given files"""
+        digest = hashlib.blake2b(digest_size=16)
+        for rel_path in sorted(files):
+            digest.update(f"{rel_path}\0{hashes.get(rel_path, '')}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _select_paths(self, columns: str, rel_paths: Iterable[str]) -> List[tuple]:
+        """Rows of the given paths only, looked up by primary key in chunks; the caller holds the lock"""
+        rel_paths = list(dict.fromkeys(rel_paths))
+        rows = []
+        for start in range(0, len(rel_paths), PATH_QUERY_CHUNK):
+            chunk = rel_paths[start:start + PATH_QUERY_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            rows.extend(self._conn.execute(f"SELECT {columns} FROM files WHERE path IN ({placeholders})", chunk))
+        return rows
+
+    def get(self, rel_path: str) -> Optional[IndexedFile]:
+        """Look up a single indexed file"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size, mtime_ns, content_hash, token_count FROM files WHERE path = ?",
+                (rel_path,)
+            ).fetchone()
+        return IndexedFile(*row) if row else None
+
+    def get_hashes(self, rel_paths: Iterable[str]) -> Dict[str, str]:
+        """Content hashes for the given paths (missing paths are left out)"""
+        with self._lock:
+            return dict(self._select_paths("path, content_hash", rel_paths))
+
+    def file_stats(self) -> Dict[str, IndexedFile]:
+        """All indexed files, for callers that check size and mtime themselves"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, content_hash, token_count FROM files").fetchall()
+        return {row[0]: IndexedFile(*row) for row in rows}
+
+    def token_counts(self, rel_paths: Iterable[str], token_estimator, texts: Optional[Dict[str, str]] = None,
+                     sizes: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        Token counts for the given files, computed on first request and stored.
+
+        Counts are stored for the content hash they were computed for and
+        stay valid as long as it does not change. Texts the caller already
+        read are counted instead of reading the files again; with their sizes
+        given, a text whose size no longer matches the index (changed since
+        the last scan) is counted but not stored.
+        """
+        rel_paths = list(dict.fromkeys(rel_paths))
+        texts = texts or {}
+        sizes = sizes or {}
+        with self._lock:
+            rows = {row[0]: row[1:] for row in self._select_paths("path, size, content_hash, token_count", rel_paths)}
+
+        counts = {}
+        missing, missing_texts, hashes = [], [], []
+        for rel_path in rel_paths:
+            size, content_hash, count = rows.get(rel_path, (None, None, None))
+            if sizes.get(rel_path, size) != size:
+                content_hash = None  # Changed since the scan, the stored hash is not this text's
+            if count is not None and content_hash:
+                counts[rel_path] = count
+                continue
+            text = texts.get(rel_path)
+            if text is None:
+                try:
+                    with open(os.path.join(self.repo_path, rel_path), "r",
+                              encoding="utf-8", errors="replace") as f:
+                        text = f.read()
+                except OSError as e:
+                    logger.debug(f"Cannot count tokens of {rel_path}: {e}")
+                    continue
+            missing.append(rel_path)
+            missing_texts.append(text)
+            hashes.append(content_hash)
+
+        # The estimator memoizes them by content hash as well
+        new_counts = token_estimator.estimate_many(missing_texts, hashes)
+        counts.update(zip(missing, new_counts))
+
+        updates = [(count, rel_path, content_hash)
+                   for rel_path, count, content_hash in zip(missing, new_counts, hashes) if content_hash]
+        if updates:
+            with self._lock:
+                self._conn.executemany("UPDATE files SET token_count = ? WHERE path = ? AND content_hash = ?",
+                                       updates)
+                self._conn.commit()
+                self.token_count_version += 1
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_indexes: Dict[str, RepoIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_repo_index(repo_path, cache_dir: str = CACHE_DIR) -> RepoIndex:
+    """Process-wide RepoIndex per repository, so all analyzers and sessions share one"""
+    key = str(Path(repo_path).resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = RepoIndex(key, cache_dir)
+            _indexes[key] = index
+        return index
@@ -1,26 +1,279 @@
-import firebase_admin
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
 from datetime import datetime
-from firebase_admin import credentials, firestore
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Sequence
+
+from tracing import span
+from metrics import STAGE_SECONDS
+from config import (REQUEST_LOG_SINKS, REQUEST_LOG_JSONL_PATH, REQUEST_LOG_QUEUE_SIZE, REQUEST_LOG_BATCH_SIZE,
+                    REQUEST_LOG_FLUSH_INTERVAL, REQUEST_LOG_BLOCK_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+
+class NullSink:
+    """Discards all records"""
+
+    def write_batch(self, records: List[dict]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSink:
+    """Appends one JSON object per record to a local file"""
+
+    def __init__(self, path: str = REQUEST_LOG_JSONL_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write_batch(self, records: List[dict]) -> None:
+        self._file.write("".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class FirestoreSink:
+    """Writes records to the 'requests' collection, one batched commit per batch"""
+
+    # Firestore accepts at most 500 writes per batch
+    MAX_BATCH_WRITES = 500
 
-class RequestLogger:
     def __init__(self):
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
         if not firebase_admin._apps:
-        # Initialize Firebase Admin SDK
+            # Initialize Firebase Admin SDK
             cred = credentials.ApplicationDefault()
             firebase_admin.initialize_app(cred)
         self.db = firestore.client()
         self.project_id = firebase_admin.get_app().project_id
         print(f"Using Firebase project: {self.project_id}")
 
+    def write_batch(self, records: List[dict]) -> None:
+        collection = self.db.collection('requests')
+        for start in range(0, len(records), self.MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for record in records[start:start + self.MAX_BATCH_WRITES]:
+                batch.set(collection.document(), record)
+            batch.commit()
+
+    def close(self) -> None:
+        pass
+
+
+SINKS = {"firestore": FirestoreSink, "jsonl": JsonlSink, "none": NullSink}
+
+
+def create_sinks(names: Sequence[str]) -> list:
+    """Instantiate sinks by name, skipping (and logging) those that cannot be set up"""
+    sinks = []
+    for name in names:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in SINKS:
+            logger.error(f"Unknown request log sink: {name}")
+            continue
+        try:
+            sinks.append(SINKS[name]())
+        except Exception as e:
+            logger.error(f"Cannot set up request log sink {name}: {e}")
+    return sinks or [NullSink()]
+
+
+@dataclass
+class RequestLogStats:
+    enqueued: int = 0
+    written: int = 0
+    dropped: int = 0
+    failed: int = 0
+    blocked: int = 0
+
+
+class RequestLogger:
+    """
+    Logs requests in the background, so callers never wait for the network.
+
+    log_request puts the record into a bounded queue. When the queue is
+    full, the caller is held back for up to block_seconds (backpressure) and
+    the record is dropped after that. A worker thread writes the queue in
+    batches of up to batch_size records to every sink, no later than
+    flush_interval seconds after a record was queued. close() (also run at
+    exit) writes what is left.
+    """
+
+    def __init__(self, sinks: Optional[list] = None, queue_size: int = REQUEST_LOG_QUEUE_SIZE,
+                 batch_size: int = REQUEST_LOG_BATCH_SIZE, flush_interval: float = REQUEST_LOG_FLUSH_INTERVAL,
+                 block_seconds: float = REQUEST_LOG_BLOCK_SECONDS):
+        self.sinks = sinks if sinks is not None else create_sinks(REQUEST_LOG_SINKS)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_seconds = block_seconds
+        self.stats = RequestLogStats()
+
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        # Guards _closed and counts callers between the closed check and their enqueue,
+        # so close() puts its sentinel behind every record it accepted
+        self._producers = threading.Condition()
+        self._active_producers = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="request-logger", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
 
     def log_request(self, request_type, content, response=None, metadata=None):
-        print("Logging request: "+request_type)
-        doc_ref = self.db.collection('requests').document()
-        doc_data = {
-            'timestamp': datetime.utcnow(),
-            'type': request_type,
-            'content': content,
-            'response': response,
-            'metadata': metadata or {}
-        }
-        doc_ref.set(doc_data)
\ No newline at end of file
+        if not self._enter():
+            return
+        try:
+            self._enqueue({
+                'timestamp': datetime.utcnow(),
+                'type': request_type,
+                'content': content,
+                'response': response,
+                'metadata': metadata or {}
+            })
+        finally:
+            self._leave()
+
+    def _enter(self) -> bool:
+        """Admit a caller that is about to enqueue; False once the logger is closed"""
+        with self._producers:
+            if self._closed:
+                return False
+            self._active_producers += 1
+            return True
+
+    def _leave(self) -> None:
+        with self._producers:
+            self._active_producers -= 1
+            self._producers.notify_all()
+
+    def _enqueue(self, record: dict) -> None:
+        with span("log_request"):
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self._count("blocked")
+                try:
+                    self._queue.put(record, timeout=self.block_seconds)
+                except queue.Full:
+                    dropped = self._count("dropped")
+                    if dropped % 100 == 1:  # Do not flood the log while the sinks cannot keep up
+                        logger.warning(f"Request log queue full, {dropped} records dropped so far")
+                    return
+            self._count("enqueued")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every record queued so far is written; False on timeout or once closed"""
+        if not self._enter():
+            return False
+        done = threading.Event()
+        try:
+            self._queue.put({"_flush": done}, timeout=timeout)
+        except queue.Full:
+            return False
+        finally:
+            self._leave()
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Write the remaining records and stop the worker"""
+        with self._producers:
+            if self._closed:
+                return
+            self._closed = True
+            # Callers admitted before the close finish their enqueue first
+            if not self._producers.wait_for(lambda: self._active_producers == 0, timeout):
+                logger.warning("Request log writers still busy on shutdown, their records may be lost")
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.error("Request log queue still full on shutdown, remaining records are lost")
+            return
+        self._worker.join(timeout)
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"Error closing request log sink: {e}")
+
+    def stats_dict(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {**asdict(self.stats), "queued": self._queue.qsize()}
+
+    def _count(self, field: str, amount: int = 1) -> int:
+        with self._stats_lock:
+            value = getattr(self.stats, field) + amount
+            setattr(self.stats, field, value)
+            return value
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch: List[dict] = []
+            flushes: List[threading.Event] = []
+            # Collect for up to flush_interval after the first record, unless a flush or close is requested
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif "_flush" in item:
+                    flushes.append(item["_flush"])
+                else:
+                    batch.append(item)
+                if stop or flushes or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            for event in flushes:
+                event.set()
+
+    def _write(self, batch: List[dict]) -> None:
+        # Records only count as written once every sink took them, failures are counted per sink
+        failed = False
+        for sink in self.sinks:
+            start = time.perf_counter()
+            try:
+                sink.write_batch(batch)
+                # Written in the background, so only in the histogram and not in a request's trace
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=f"log_write_{type(sink).__name__}")
+            except Exception as e:
+                failed = True
+                self._count("failed", len(batch))
+                logger.error(f"Request log sink {type(sink).__name__} failed for {len(batch)} records: {e}")
+        if not failed:
+            self._count("written", len(batch))
+
+
+_request_logger: Optional[RequestLogger] = None
+_request_logger_lock = threading.Lock()
+
+
+def get_request_logger() -> RequestLogger:
+    """Process-wide request logger with the sinks from REQUEST_LOG_SINKS"""
+    global _request_logger
+    with _request_logger_lock:
+        if _request_logger is None:
+            _request_logger = RequestLogger()
+        return _request_logger
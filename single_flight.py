@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    executions: int = 0
+    coalesced: int = 0
+    failures: int = 0
+    in_flight: int = 0
+
+
+class Flight:
+    """
+    One computation for a key. The leader computes and resolves it, every
+    other caller waits for the outcome.
+    """
+
+    def __init__(self, group: "SingleFlight", key: Hashable, future: Future, leader: bool):
+        self.group = group
+        self.key = key
+        self.leader = leader
+        self._future = future
+
+    async def wait(self):
+        """Result of the leader; cancelling the waiter does not cancel the leader"""
+        return await asyncio.shield(asyncio.wrap_future(self._future))
+
+    def resolve(self, value) -> None:
+        self.group._finish(self, value=value)
+
+    def fail(self, error: BaseException) -> None:
+        self.group._finish(self, error=error)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one computation.
+
+    While a computation for a key is running, further calls with the same key
+    attach to it and get its result (or exception) instead of starting their
+    own. Nothing is kept once it finishes, so this is not a cache: later calls
+    compute again. The futures are thread-safe, so callers on different event
+    loops (Flask requests, the job queue, the ASGI loop) coalesce as well.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stats = SingleFlightStats()
+        self._flights: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: Hashable) -> Flight:
+        """Join the computation for key, or become its leader if there is none"""
+        with self._lock:
+            self.stats.calls += 1
+            future = self._flights.get(key)
+            if future is not None:
+                self.stats.coalesced += 1
+                return Flight(self, key, future, leader=False)
+            future = Future()
+            self._flights[key] = future
+            self.stats.executions += 1
+            self.stats.in_flight += 1
+            return Flight(self, key, future, leader=True)
+
+    async def run(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Return (result, joined): the result of function(), or of the identical
+        call already in flight, in which case joined is True.
+        """
+        flight = self.begin(key)
+        if not flight.leader:
+            logger.info(f"Coalesced {self.name} call with one already in flight")
+            return await flight.wait(), True
+        try:
+            value = await function()
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        flight.resolve(value)
+        return value, False
+
+    def _finish(self, flight: Flight, value=None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight._future:
+                del self._flights[flight.key]
+                self.stats.in_flight -= 1
+            if error is not None:
+                self.stats.failures += 1
+        if flight._future.done():
+            return
+        if error is None:
+            flight._future.set_result(value)
+        elif isinstance(error, Exception):
+            flight._future.set_exception(error)
+        else:
+            # Cancellation of the leader must not look like cancellation of the waiters
+            flight._future.set_exception(RuntimeError(f"Coalesced {self.name} call was aborted"))
+
+    def stats_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return asdict(self.stats)
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Process-wide coalescing group for one kind of call"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def single_flight_stats() -> Dict[str, Dict[str, int]]:
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats_dict() for group in groups}
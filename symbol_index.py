@@ -0,0 +1,374 @@
+import os
+import re
+import ast
+import json
+import sqlite3
+import logging
+import threading
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Bump when the extracted data changes, so cached entries are rebuilt
+EXTRACTOR_VERSION = 2
+
+PYTHON_EXTENSIONS = (".py",)
+JS_EXTENSIONS = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx")
+JS_RESOLVE_SUFFIXES = ("", ".js", ".jsx", ".ts", ".tsx", ".mjs", "/index.js", "/index.jsx",
+                       "/index.ts", "/index.tsx")
+
+# Below this many uncached files, extraction runs in-process
+PARALLEL_THRESHOLD = 200
+MAX_SOURCE_BYTES = 2 * 1024 * 1024
+
+_JS_CLASS = re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)", re.M)
+_JS_FUNCTION = re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)", re.M)
+_JS_ARROW = re.compile(
+    r"^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*(?::[^=]+)?=\s*(?:async\s+)?"
+    r"(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)", re.M)
+_JS_METHOD = re.compile(r"^\s+(?:static\s+|async\s+|get\s+|set\s+|public\s+|private\s+|protected\s+)*"
+                        r"([A-Za-z_$][\w$]*)\s*\([^)]*\)\s*(?::[^{]+)?\{", re.M)
+_JS_IMPORT = re.compile(r"""(?:^|\s)(?:import|export)\s[^'";]*?from\s*['"]([^'"]+)['"]|"""
+                        r"""(?:^|\s)import\s*['"]([^'"]+)['"]|"""
+                        r"""\brequire\(\s*['"]([^'"]+)['"]\s*\)|"""
+                        r"""\bimport\(\s*['"]([^'"]+)['"]\s*\)""", re.M)
+_JS_EXPORT = re.compile(r"^\s*export\s+(?:default\s+)?(?:async\s+)?(?:abstract\s+)?"
+                        r"(?:class|function\s*\*?|const|let|var|interface|type|enum)\s+([A-Za-z_$][\w$]*)", re.M)
+_JS_EXPORT_LIST = re.compile(r"^\s*export\s*\{([^}]*)\}", re.M)
+_JS_EXPORT_DEFAULT = re.compile(r"^\s*export\s+default\s+([A-Za-z_$][\w$]*)\s*;?\s*$", re.M)
+_JS_KEYWORDS = {"if", "for", "while", "switch", "catch", "function", "return", "constructor"}
+
+# Task words that look like code: dotted names, snake_case or CamelCase
+_MENTION = re.compile(r"[A-Za-z_][\w]*(?:\.[A-Za-z_]\w*)*")
+_CAMEL_CASE = re.compile(r"[a-z][A-Z]")
+
+
+@dataclass
+class ModuleSymbols:
+    """Symbols of one source file"""
+    classes: List[str] = field(default_factory=list)
+    functions: List[str] = field(default_factory=list)
+    methods: List[str] = field(default_factory=list)
+    imports: List[str] = field(default_factory=list)
+    exports: List[str] = field(default_factory=list)
+
+
+def language_of(rel_path: str) -> Optional[str]:
+    if rel_path.endswith(PYTHON_EXTENSIONS):
+        return "python"
+    if rel_path.endswith(JS_EXTENSIONS):
+        return "js"
+    return None
+
+
+def extract_python_symbols(source: str) -> ModuleSymbols:
+    """
+    Classes, functions, methods ('Class.method'), imports and exported names of a Python module.
+
+    Without __all__, the public classes, functions and module-level
+    assignments (e.g. constants) count as exported.
+    """
+    symbols = ModuleSymbols()
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return symbols
+
+    explicit_exports = None
+    assigned: List[str] = []  # Module-level names such as constants
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            symbols.classes.append(node.name)
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    symbols.methods.append(f"{node.name}.{item.name}")
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.functions.append(node.name)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id == "__all__":
+                    try:
+                        explicit_exports = [str(name) for name in ast.literal_eval(node.value)]
+                    except (ValueError, SyntaxError):
+                        pass
+                elif isinstance(target, (ast.Tuple, ast.List)):
+                    assigned.extend(element.id for element in target.elts if isinstance(element, ast.Name))
+                elif isinstance(target, ast.Name):
+                    assigned.append(target.id)
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            assigned.append(node.target.id)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            symbols.imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = "." * node.level + (node.module or "")
+            symbols.imports.append(module)
+            # 'from pkg import mod' may import a submodule
+            separator = "" if module.endswith(".") else "."
+            symbols.imports.extend(f"{module}{separator}{alias.name}" for alias in node.names
+                                   if alias.name != "*")
+
+    if explicit_exports is not None:
+        symbols.exports = explicit_exports
+    else:
+        symbols.exports = [name for name in dict.fromkeys(symbols.classes + symbols.functions + assigned)
+                           if not name.startswith("_")]
+    return symbols
+
+
+def extract_js_symbols(source: str) -> ModuleSymbols:
+    """Best-effort symbols of a JavaScript/TypeScript module, based on regular expressions"""
+    symbols = ModuleSymbols()
+    symbols.classes = _JS_CLASS.findall(source)
+    symbols.functions = _JS_FUNCTION.findall(source) + _JS_ARROW.findall(source)
+    if symbols.classes:
+        # Without a parser, methods are attributed to the only class or left unqualified
+        owner = symbols.classes[0] if len(symbols.classes) == 1 else None
+        for name in _JS_METHOD.findall(source):
+            if name not in _JS_KEYWORDS:
+                symbols.methods.append(f"{owner}.{name}" if owner else name)
+    symbols.imports = [next(group for group in match if group) for match in _JS_IMPORT.findall(source)]
+    symbols.exports = _JS_EXPORT.findall(source) + _JS_EXPORT_DEFAULT.findall(source)
+    for names in _JS_EXPORT_LIST.findall(source):
+        for name in names.split(","):
+            name = name.strip().split(" as ")[-1].strip()
+            if name:
+                symbols.exports.append(name)
+    return symbols
+
+
+def _extract_file(args: Tuple[str, str]) -> Optional[dict]:
+    """Process pool entry point: (absolute path, language) -> symbols as dict"""
+    file_path, language = args
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            source = f.read(MAX_SOURCE_BYTES)
+    except OSError:
+        return None
+    symbols = extract_python_symbols(source) if language == "python" else extract_js_symbols(source)
+    return symbols.__dict__
+
+
+class SymbolCache:
+    """Symbols per content hash in SQLite, shared by all repositories"""
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "symbols.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS symbols ("
+            "content_hash TEXT NOT NULL, version INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (content_hash, version))"
+        )
+        self._conn.commit()
+
+    def get_many(self, content_hashes: Iterable[str]) -> Dict[str, ModuleSymbols]:
+        wanted = list(set(content_hashes))
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for content_hash, data in self._conn.execute(
+                        f"SELECT content_hash, data FROM symbols WHERE version = ? "
+                        f"AND content_hash IN ({placeholders})", [EXTRACTOR_VERSION] + chunk):
+                    found[content_hash] = ModuleSymbols(**json.loads(data))
+        return found
+
+    def put_many(self, entries: Dict[str, ModuleSymbols]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO symbols (content_hash, version, data) VALUES (?, ?, ?)",
+                [(content_hash, EXTRACTOR_VERSION, json.dumps(symbols.__dict__))
+                 for content_hash, symbols in entries.items()]
+            )
+            self._conn.commit()
+
+
+class SymbolIndex:
+    """
+    Queryable symbol table of a repository with its import graph.
+
+    Symbols are extracted per content hash and cached on disk, so after small
+    edits only the changed files are parsed again; large batches are parsed in
+    a process pool.
+    """
+
+    def __init__(self, repo_path, cache: Optional[SymbolCache] = None, max_workers: Optional[int] = None):
+        self.repo_path = os.fspath(repo_path)
+        self.cache = cache or _get_symbol_cache()
+        self.max_workers = max_workers
+        self.modules: Dict[str, ModuleSymbols] = {}
+        self.definitions: Dict[str, Set[str]] = {}
+        self.module_files: Dict[str, Set[str]] = {}
+        self.imports: Dict[str, Set[str]] = {}
+        self.imported_by: Dict[str, Set[str]] = {}
+        self.fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def build(self, files: List[str], hashes: Dict[str, str], fingerprint: Optional[str] = None) -> "SymbolIndex":
+        """(Re)build the index for the given files, parsing only hashes not seen before"""
+        with self._lock:
+            if fingerprint is not None and fingerprint == self.fingerprint:
+                return self
+
+            # The language is part of the key: an empty .py and an empty .js share a hash
+            sources = {rel_path: f"{hashes[rel_path]}:{language_of(rel_path)}" for rel_path in files
+                       if language_of(rel_path) and rel_path in hashes}
+            cached = self.cache.get_many(sources.values())
+
+            missing = {}
+            pending = set()
+            for rel_path, content_hash in sources.items():
+                if content_hash not in cached and content_hash not in pending:
+                    missing[rel_path] = content_hash
+                    pending.add(content_hash)
+            if missing:
+                extracted = self._extract(list(missing))
+                new_entries = {missing[rel_path]: symbols for rel_path, symbols in extracted.items()}
+                self.cache.put_many(new_entries)
+                cached.update(new_entries)
+                logger.info(f"Extracted symbols from {len(missing)} files")
+
+            self.modules = {rel_path: cached[content_hash] for rel_path, content_hash in sources.items()
+                            if content_hash in cached}
+            self._build_tables()
+            self.fingerprint = fingerprint
+            return self
+
+    def _extract(self, rel_paths: List[str]) -> Dict[str, ModuleSymbols]:
+        jobs = [(os.path.join(self.repo_path, rel_path), language_of(rel_path)) for rel_path in rel_paths]
+        if len(jobs) < PARALLEL_THRESHOLD:
+            results = map(_extract_file, jobs)
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(_extract_file, jobs, chunksize=64))
+        return {rel_path: ModuleSymbols(**data) for rel_path, data in zip(rel_paths, results) if data is not None}
+
+    def _build_tables(self) -> None:
+        self.definitions = {}
+        self.module_files = {}
+        for rel_path, symbols in self.modules.items():
+            for name in symbols.classes + symbols.functions + symbols.methods + symbols.exports:
+                self.definitions.setdefault(name, set()).add(rel_path)
+            for module_name in self._module_names(rel_path):
+                self.module_files.setdefault(module_name, set()).add(rel_path)
+
+        self.imports = {}
+        self.imported_by = {}
+        for rel_path, symbols in self.modules.items():
+            targets = set()
+            for spec in symbols.imports:
+                targets.update(self._resolve_import(rel_path, spec))
+            targets.discard(rel_path)
+            self.imports[rel_path] = targets
+            for target in targets:
+                self.imported_by.setdefault(target, set()).add(rel_path)
+
+    @staticmethod
+    def _module_names(rel_path: str) -> List[str]:
+        """Dotted names a file can be imported as, including every suffix ('src.pkg.mod', 'pkg.mod', 'mod')"""
+        if language_of(rel_path) != "python":
+            return []
+        parts = rel_path[:-3].split("/")
+        if parts[-1] == "__init__":
+            parts = parts[:-1]
+        return [".".join(parts[start:]) for start in range(len(parts)) if parts[start:]]
+
+    def _resolve_import(self, rel_path: str, spec: str) -> Set[str]:
+        if language_of(rel_path) == "python":
+            if spec.startswith("."):
+                level = len(spec) - len(spec.lstrip("."))
+                base = rel_path.split("/")[:-level]
+                name = spec.lstrip(".")
+                spec = ".".join(base + ([name] if name else []))
+            files = self.module_files.get(spec, set())
+            # Suffix matches are ambiguous in large repos; only trust unique ones
+            return files if len(files) == 1 else set()
+
+        if not spec.startswith("."):
+            return set()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(rel_path), spec))
+        for suffix in JS_RESOLVE_SUFFIXES:
+            if f"{target}{suffix}" in self.modules:
+                return {f"{target}{suffix}"}
+        return set()
+
+    def find_definitions(self, name: str) -> Set[str]:
+        """Files defining a class, function, method ('Class.method') or exported name"""
+        files = set(self.definitions.get(name, ()))
+        if not files and "." in name:
+            # 'ClaudeClient.send_message' may be a module attribute or a dotted module path
+            owner, _, member = name.rpartition(".")
+            owner_files = self.definitions.get(owner, set()) | self.module_files.get(owner, set())
+            files = {rel_path for rel_path in owner_files
+                     if member in self._names_of(rel_path)} or set(owner_files)
+        if not files:
+            files = set(self.module_files.get(name, ()))
+        return files
+
+    def _names_of(self, rel_path: str) -> Set[str]:
+        symbols = self.modules[rel_path]
+        return set(symbols.classes + symbols.functions + symbols.exports +
+                   [method.rsplit(".", 1)[-1] for method in symbols.methods])
+
+    def resolve_mentions(self, text: str, hops: int = 1) -> List[str]:
+        """
+        Map code-like mentions in a task to files, then follow the import graph.
+
+        Only words that look like code are considered: dotted names, snake_case
+        and CamelCase. Definitions come first, followed by the files they import
+        and the files importing them, up to `hops` steps away.
+        """
+        found: List[str] = []
+        for mention in dict.fromkeys(_MENTION.findall(text)):
+            if not ("." in mention or "_" in mention or _CAMEL_CASE.search(mention)):
+                continue
+            for rel_path in sorted(self.find_definitions(mention.strip("."))):
+                if rel_path not in found:
+                    found.append(rel_path)
+
+        frontier = list(found)
+        for _ in range(hops):
+            neighbours = []
+            for rel_path in frontier:
+                for other in sorted(self.imports.get(rel_path, set()) | self.imported_by.get(rel_path, set())):
+                    if other not in found and other not in neighbours:
+                        neighbours.append(other)
+            found.extend(neighbours)
+            frontier = neighbours
+        return found
+
+
+_symbol_cache: Optional[SymbolCache] = None
+_indexes: Dict[str, SymbolIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _get_symbol_cache() -> SymbolCache:
+    global _symbol_cache
+    with _indexes_lock:
+        if _symbol_cache is None:
+            _symbol_cache = SymbolCache()
+        return _symbol_cache
+
+
+def get_symbol_index(repo_path) -> SymbolIndex:
+    """Process-wide SymbolIndex per repository"""
+    key = os.path.realpath(os.fspath(repo_path))
+    cache = _get_symbol_cache()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = SymbolIndex(key, cache)
+            _indexes[key] = index
+        return index
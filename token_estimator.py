@@ -1,8 +1,120 @@
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
 import tiktoken
 
+from config import TOKEN_CACHE_ENTRIES, TOKEN_ESTIMATOR_WORKERS
+
+# Approximate mode for pre-flight checks. cl100k_base averages about 3.5 to 4
+# UTF-8 bytes per token on source code and English text, so dividing the byte
+# count by 3.5 over-estimates such files by up to ~15%. Dense input (minified
+# bundles, long numbers, non-Latin scripts) has fewer bytes per token and is
+# under-estimated by up to APPROX_ERROR_BOUND; callers that must not exceed a
+# limit should add that margin.
+APPROX_BYTES_PER_TOKEN = 3.5
+APPROX_ERROR_BOUND = 0.3
+
+# Texts shorter than this are encoded directly, hashing them is not worth it
+_MEMO_MIN_CHARS = 256
+
+
+def approximate_tokens_for_size(num_bytes: int) -> int:
+    """O(1) token estimate from a byte count, e.g. a file size from the repository index"""
+    return math.ceil(num_bytes / APPROX_BYTES_PER_TOKEN)
+
+
 class TokenEstimator:
-    def __init__(self):
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+    """
+    Token counts for prompts and files.
+
+    The tiktoken encoding is loaded on first use. Counts of longer texts are
+    memoized by content hash, so a file that is part of several prompts is
+    only encoded once; use estimate_parts to add up a prompt from its pieces.
+    With approximate=True no encoding happens at all (see
+    APPROX_BYTES_PER_TOKEN for the error bound).
+    """
+
+    def __init__(self, approximate: bool = False, cache_entries: int = TOKEN_CACHE_ENTRIES,
+                 max_workers: int = TOKEN_ESTIMATOR_WORKERS):
+        self.approximate = approximate
+        self.cache_entries = cache_entries
+        self.max_workers = max_workers
+        self._encoding = None
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    self._encoding = tiktoken.get_encoding("cl100k_base")
+        return self._encoding
+
+    def estimate_tokens(self, text: str, content_hash: Optional[str] = None) -> int:
+        """
+        Token count of text.
+
+        Args:
+            text: Text to count
+            content_hash: Hash of the text if already known (e.g. from the repository index)
+        """
+        if self.approximate:
+            return self.approximate_tokens(text)
+        if content_hash is None and len(text) < _MEMO_MIN_CHARS:
+            return len(self.encoding.encode(text, disallowed_special=()))
+
+        key = content_hash or hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+
+        count = len(self.encoding.encode(text, disallowed_special=()))
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.cache_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def estimate_parts(self, parts: Iterable[str]) -> int:
+        """
+        Sum of the counts of the parts of a prompt.
+
+        Each part is memoized on its own. Tokens never merge across the part
+        boundaries here, so the sum can be a few tokens above an exact count of
+        the joined text.
+        """
+        return sum(self.estimate_tokens(part) for part in parts)
+
+    def estimate_many(self, texts: List[str], content_hashes: Optional[List[Optional[str]]] = None) -> List[int]:
+        """Counts for many texts, encoded across threads (tiktoken releases the GIL)"""
+        content_hashes = content_hashes or [None] * len(texts)
+        if self.approximate or len(texts) < 2 * self.max_workers:
+            return [self.estimate_tokens(text, content_hash) for text, content_hash in zip(texts, content_hashes)]
+        self.encoding  # Load once before the threads start
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.estimate_tokens, texts, content_hashes))
+
+    @staticmethod
+    def approximate_tokens(text: str) -> int:
+        """O(n) estimate without encoding, within APPROX_ERROR_BOUND for typical text"""
+        return approximate_tokens_for_size(len(text.encode("utf-8", "surrogatepass")))
+
+
+_shared_estimator: Optional[TokenEstimator] = None
+_shared_estimator_lock = threading.Lock()
+
 
-    def estimate_tokens(self, text: str) -> int:
-        return len(self.encoding.encode(text))
\ No newline at end of file
+def get_token_estimator() -> TokenEstimator:
+    """Process-wide estimator, so the encoding and the memoized counts are shared"""
+    global _shared_estimator
+    with _shared_estimator_lock:
+        if _shared_estimator is None:
+            _shared_estimator = TokenEstimator()
+        return _shared_estimator
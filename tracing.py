@@ -0,0 +1,97 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional
+
+from metrics import STAGE_SECONDS
+
+
+@dataclass
+class Span:
+    name: str
+    start: float  # Seconds after the start of the trace
+    seconds: float
+
+
+class Trace:
+    """
+    The stage timings of one request.
+
+    Spans from concurrent tasks of the request (e.g. batch analyses) are all
+    recorded, so the summed stage times can exceed the wall time.
+    """
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def add(self, name: str, start: float, seconds: float) -> None:
+        with self._lock:
+            self.spans.append(Span(name, start - self.started, seconds))
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """Count and total seconds per stage, in the order the stages first started"""
+        stages: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        for span in spans:
+            stage = stages.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += span.seconds
+        return stages
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [asdict(span) for span in self.spans]
+        return {"requestId": self.request_id, "totalSeconds": self.elapsed, "spans": spans}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(request_id: Optional[str] = None) -> Iterator[Trace]:
+    """Collect the spans of the enclosed code, including tasks and threads started with its context"""
+    trace = Trace(request_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a stage: recorded in the stage histogram and in the current trace, if any"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, start, seconds)
+
+
+def format_breakdown(trace: Trace) -> List[str]:
+    """Lines of a stage table for the console"""
+    total = trace.elapsed
+    lines = [f"{'Phase':<20} {'Anzahl':>6} {'Sekunden':>10} {'Anteil':>7}"]
+    for name, stage in trace.breakdown().items():
+        share = stage["seconds"] / total * 100 if total else 0.0
+        lines.append(f"{name:<20} {stage['count']:>6} {stage['seconds']:>10.3f} {share:>6.1f}%")
+    lines.append(f"{'gesamt':<20} {'':>6} {total:>10.3f}")
+    return lines